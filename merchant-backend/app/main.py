@@ -7,6 +7,7 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
+import threading
 import time
 import json
 import os
@@ -16,8 +17,16 @@ from fastapi import FastAPI, Depends, HTTPException, Request, Response
 # Load environment variables
 load_dotenv()
 from fastapi.middleware.cors import CORSMiddleware
-from app.database.database import create_tables
-from app.routes import products, cart, orders, auth, onchain_payment, sienna_payment
+from app.database.database import create_tables, engine, SessionLocal, SQLALCHEMY_DATABASE_URL
+from app.services.facilitator import facilitator_client
+from app.services.solana_quotes import solana_quote_client
+from app.services.solana_rpc import blockhash_prefetcher, solana_rpc_pool
+from app.services.search_index import build_search_index
+from app.services.inventory import ReservationSweeper
+from app.services.cart_gc import CartCollector
+from app.services.sales_rollup import SalesRollupJob
+from app.services.order_archive import ORDER_ARCHIVE_PATH, OrderArchiver, attach_archive
+from app.routes import products, cart, orders, analytics, auth, onchain_payment, sienna_payment
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +35,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+reservation_sweeper = ReservationSweeper(SessionLocal)
+cart_collector = CartCollector(SessionLocal)
+sales_rollup = SalesRollupJob(SessionLocal)
+order_archiver = OrderArchiver(SessionLocal)
+
 # Create FastAPI app
 app = FastAPI(
     title="Reference Merchant API",
@@ -63,6 +77,7 @@ app.add_middleware(
 app.include_router(products.router, prefix="/api")
 app.include_router(cart.router, prefix="/api")
 app.include_router(orders.router, prefix="/api")
+app.include_router(analytics.router, prefix="/api")
 app.include_router(auth.router, prefix="/api")
 app.include_router(onchain_payment.router)
 app.include_router(sienna_payment.router)
@@ -73,6 +88,46 @@ def startup_event():
     logger.info("🚀 Starting Reference Merchant API...")
     create_tables()
     logger.info("✅ Database tables created/verified")
+    # Premium search falls back to SQL until the index has finished loading
+    threading.Thread(target=load_search_index, name="search-index-build", daemon=True).start()
+    # Shared Solana RPC clients for payment execution
+    solana_rpc_pool.start()
+    # Return stock held by checkouts that were never completed
+    reservation_sweeper.start()
+    cart_collector.start()
+    # Fold order events into the daily sales rollups behind /api/analytics
+    sales_rollup.start()
+    # Move finished orders past the horizon out of the live tables (SQLite only: the archive is ATTACHed)
+    if ORDER_ARCHIVE_PATH and SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        attach_archive(engine, ORDER_ARCHIVE_PATH)
+        order_archiver.start()
+
+@app.on_event("startup")
+async def start_blockhash_prefetcher():
+    """Keep a recent Solana blockhash warm per cluster; runs on the event loop the RPC clients use"""
+    blockhash_prefetcher.start()
+
+def load_search_index():
+    """Build the premium search index from the catalog"""
+    db = SessionLocal()
+    try:
+        build_search_index(db)
+    except Exception as e:
+        logger.error(f"❌ Failed to build search index: {e}")
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers and close pooled upstream connections"""
+    reservation_sweeper.stop()
+    cart_collector.stop()
+    sales_rollup.stop()
+    order_archiver.stop()
+    await facilitator_client.aclose()
+    await solana_quote_client.aclose()
+    await blockhash_prefetcher.stop()
+    await solana_rpc_pool.close()
 
 @app.get("/")
 def read_root():
@@ -84,6 +139,11 @@ def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/metrics/cart-gc")
+def cart_gc_metrics():
+    """Rows reclaimed by the abandoned cart collector since startup"""
+    return cart_collector.metrics()
+
 if __name__ == "__main__":
     import uvicorn
     # Run development server
@@ -6,28 +6,78 @@
 #
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import (
+    Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Boolean, Index, DDL, UniqueConstraint,
+    event, inspect, insert, select, update
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, Session
 from datetime import datetime
+from typing import Optional
 
 Base = declarative_base()
 
+def normalize_category(name: Optional[str]) -> Optional[str]:
+    """Normalize a category name for lookups (trimmed, single-spaced, lower-case)"""
+    if name is None:
+        return None
+    normalized = " ".join(name.split()).lower()
+    return normalized or None
+
+class Category(Base):
+    __tablename__ = "categories"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False, index=True)  # Normalized name used for filtering
+    display_name = Column(String(100), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    products = relationship("Product", back_populates="category_ref")
+
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Category + price range filters resolve to an index range scan
+        Index("ix_products_category_id_price", "category_id", "price"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, index=True)
     description = Column(Text)
-    price = Column(Float, nullable=False)
+    price = Column(Float, nullable=False, index=True)
     category = Column(String(100), index=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
     image_url = Column(String(500))
     stock_quantity = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Catalog-wide, monotonically increasing row version (see assign_product_versions)
+    version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
     
     # Relationship with cart items
     cart_items = relationship("CartItem", back_populates="product")
     order_items = relationship("OrderItem", back_populates="product")
+    category_ref = relationship("Category", back_populates="products")
+
+class ProductTombstone(Base):
+    __tablename__ = "product_tombstones"
+    
+    product_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+class CatalogSequence(Base):
+    """Single-row counter handing out product row versions"""
+    __tablename__ = "catalog_sequence"
+    
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+event.listen(
+    CatalogSequence.__table__,
+    "after_create",
+    DDL("INSERT INTO catalog_sequence (id, value) VALUES (1, 0)")
+)
 
 class Cart(Base):
     __tablename__ = "carts"
@@ -35,7 +85,10 @@ class Cart(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(255), unique=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Last activity; indexed for abandoned-cart collection
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Bumped with every change to the cart or its items; cached cart reads are checked against it
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationship with cart items
     items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
@@ -44,7 +97,7 @@ class CartItem(Base):
     __tablename__ = "cart_items"
     
     id = Column(Integer, primary_key=True, index=True)
-    cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False)
+    cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False, default=1)
     
@@ -78,11 +131,17 @@ class Order(Base):
     # Relationship with order items
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
+# Order history by customer or status, newest first, without a table scan or sort
+Index("ix_orders_customer_email_created_at", Order.customer_email, Order.created_at.desc())
+Index("ix_orders_status_created_at", Order.status, Order.created_at.desc())
+# Date-range exports in creation order
+Index("ix_orders_created_at", Order.created_at)
+
 class OrderItem(Base):
     __tablename__ = "order_items"
     
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
     price = Column(Float, nullable=False)  # Price at the time of order
@@ -90,3 +149,139 @@ class OrderItem(Base):
     # Relationships
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
+
+class OrderEvent(Base):
+    """Outbox of order lifecycle events, appended in the transaction that changed the order"""
+    __tablename__ = "order_events"
+    __table_args__ = (
+        # Per-customer (and per-agent) feeds resume from the last event id seen
+        Index("ix_order_events_customer_email_id", "customer_email", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True)  # feed position; clients resume after it
+    order_id = Column(Integer, nullable=False)
+    order_number = Column(String(100), nullable=False)
+    customer_email = Column(String(255), nullable=False)
+    event_type = Column(String(50), nullable=False)  # order.created, order.status_changed
+    status = Column(String(50), nullable=True)
+    previous_status = Column(String(50), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SalesDailyProduct(Base):
+    """Per-day, per-product sales rollup, folded in from the order event outbox"""
+    __tablename__ = "sales_daily_products"
+    
+    day = Column(Date, primary_key=True)  # day the order was placed (UTC)
+    product_id = Column(Integer, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+class SalesDailyPaymentMethod(Base):
+    """Per-day, per-payment-method sales rollup, folded in from the order event outbox"""
+    __tablename__ = "sales_daily_payment_methods"
+    
+    day = Column(Date, primary_key=True)
+    payment_method = Column(String(50), primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+class RollupCheckpoint(Base):
+    """Last order event folded into a rollup; advanced in the same transaction as the rollup rows"""
+    __tablename__ = "rollup_checkpoints"
+    
+    name = Column(String(50), primary_key=True)
+    last_event_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class StockReservation(Base):
+    """Stock held for a checkout in progress; released by the sweeper if not claimed before expires_at"""
+    __tablename__ = "stock_reservations"
+    
+    id = Column(Integer, primary_key=True)
+    reference = Column(String(255), nullable=False, index=True)  # cart:<session_id> for finalize/quote holds, or an x402 checkout attempt
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """Outcome of a request made with an Idempotency-Key header, replayed to retries"""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("scope", "key", name="uq_idempotency_keys_scope_key"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(100), nullable=False)  # endpoint the key was used on
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)  # sha256 of the request
+    status = Column(String(20), nullable=False, default="in_progress")  # in_progress, pending, completed
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    locked_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+@event.listens_for(Session, "before_flush")
+def assign_product_categories(session, flush_context, instances):
+    """Keep Product.category_id in sync with the free-text Product.category"""
+    pending = {}
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Product):
+            continue
+        state = inspect(obj)
+        if not state.pending and not state.attrs.category.history.has_changes():
+            continue
+        
+        normalized = normalize_category(obj.category)
+        if normalized is None:
+            obj.category_ref = None
+            continue
+        
+        category = pending.get(normalized)
+        if category is None:
+            with session.no_autoflush:
+                category = session.query(Category).filter(Category.name == normalized).first()
+            if category is None:
+                category = Category(name=normalized, display_name=obj.category.strip())
+                session.add(category)
+            pending[normalized] = category
+        obj.category_ref = category
+
+def reserve_catalog_versions(session, count: int = 1) -> int:
+    """
+    Allocate `count` consecutive catalog versions and return the first one.
+    The UPDATE holds the sequence row lock until commit, so versions become
+    visible in the order they were handed out.
+    """
+    sequence = CatalogSequence.__table__
+    result = session.execute(
+        update(sequence).where(sequence.c.id == 1).values(value=sequence.c.value + count)
+    )
+    if result.rowcount == 0:
+        session.execute(insert(sequence).values(id=1, value=count))
+    last = session.execute(select(sequence.c.value).where(sequence.c.id == 1)).scalar_one()
+    return last - count + 1
+
+@event.listens_for(Session, "before_flush")
+def assign_product_versions(session, flush_context, instances):
+    """Stamp every inserted, updated or deleted product with a new catalog version"""
+    changed = [
+        obj for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Product) and session.is_modified(obj, include_collections=False)
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Product)]
+    if not changed and not deleted:
+        return
+    
+    now = datetime.utcnow()
+    with session.no_autoflush:
+        version = reserve_catalog_versions(session, len(changed) + len(deleted))
+        for obj in changed:
+            obj.version = version
+            if not inspect(obj).pending:
+                obj.updated_at = now
+            version += 1
+        for obj in deleted:
+            session.merge(ProductTombstone(product_id=obj.id, version=version, deleted_at=now))
+            version += 1
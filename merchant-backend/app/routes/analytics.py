@@ -0,0 +1,45 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional
+import os
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.database.database import get_db
+from app.schemas import SalesSummary
+from app.services.sales_rollup import sales_summary
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+SALES_SUMMARY_MAX_DAYS = int(os.getenv("SALES_SUMMARY_MAX_DAYS", "366"))
+
+@router.get("/sales", response_model=SalesSummary, response_model_exclude_none=True)
+def get_sales(
+    group_by: Literal["product", "payment_method"] = "product",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Daily sales per product or per payment method, served from the rollup tables.
+    Defaults to the last 30 days (UTC); as_of_event_id and pending_events tell how current the rollups are.
+    """
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=29)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    if (date_to - date_from).days >= SALES_SUMMARY_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range is limited to {SALES_SUMMARY_MAX_DAYS} days"
+        )
+    return sales_summary(db, group_by, date_from, date_to, product_id)
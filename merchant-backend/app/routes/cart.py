@@ -6,38 +6,66 @@
 #
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 from app.database.database import get_db
 from app.models.models import (
     Cart as CartModel, 
     CartItem as CartItemModel, 
-    Product as ProductModel,
-    Order as OrderModel,
-    OrderItem as OrderItemModel
+    Product as ProductModel
 )
 from app.schemas import (
-    CartCreate, Cart, CartItemCreate, CartItemUpdate,
+    CartCreate, Cart, CartItemCreate, CartItemUpdate, CartItemBatch,
     CartFinalizeRequest, CartFinalizeResponse, 
     CartFulfillRequest, CartFulfillResponse, Message
 )
+from app.services.cart_pricing import price_cart
+from app.services.ttl_store import create_ttl_store
+from app.services.idempotency import (
+    ClaimLost, OutcomePending, commit_with_response, idempotent_request, request_fingerprint,
+    run_idempotent, run_idempotent_async
+)
+from app.services.inventory import (
+    InsufficientStock, reserve_stock, hold_stock, claim_hold, release_hold, replace_hold, cart_hold_reference
+)
+from app.services.orders import place_order
+from app.services.cart_cache import mark_cart_changed, read_cart, touch_cart
+from app.services.order_events import agent_email
+from app.services.facilitator import facilitator_client, SettlementDeclined
+from app.services.http_client import CircuitOpenError
+from app.services.payments import payment_processor, PaymentDeclined, PaymentProcessorUnavailable
+from app.services.solana_quotes import (
+    SOLANA_PAYMENT_NETWORK, solana_quote_client, SolanaQuoteRejected, SolanaQuoteUnavailable
+)
+from anyio import from_thread
 import uuid
 import os
-import requests
+import logging
+import hashlib
+import httpx
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional
 from pydantic import BaseModel, EmailStr
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/cart", tags=["cart"])
 
-SOLANA_PAYMENT_API = os.getenv("SOLANA_PAYMENT_API", "https://api.projectsienna.xyz/api/payment")
-SOLANA_PAYMENT_NETWORK = os.getenv("SOLANA_PAYMENT_NETWORK", "devnet")
-SOLANA_PAYMENT_QUOTES: Dict[str, dict] = {}
+SOLANA_QUOTE_TTL = timedelta(minutes=10)
+FINALIZED_CART_TTL = timedelta(minutes=int(os.getenv("FINALIZED_CART_TTL_MINUTES", "30")))
+# Upper bound on how long stock stays held if an x402 settlement never returns
+X402_HOLD_TTL = timedelta(minutes=5)
 
+# Shared between workers when TTL_STORE_BACKEND=sqlite
+SOLANA_PAYMENT_QUOTES = create_ttl_store("solana_quotes")
+FINALIZED_CARTS = create_ttl_store("finalized_carts")
 
-def calculate_cart_totals(cart):
-    """Calculate subtotal, shipping, tax, and total for a cart"""
-    if not cart.items:
+
+def calculate_cart_totals(pricing):
+    """Calculate subtotal, shipping, tax, and total for a priced cart (see price_cart)"""
+    if not pricing["lines"]:
         return {
             "subtotal": 0.0,
             "shipping": 0.0,
@@ -45,7 +73,7 @@ def calculate_cart_totals(cart):
             "total": 0.0,
         }
 
-    subtotal = sum(item.product.price * item.quantity for item in cart.items)
+    subtotal = pricing["subtotal"]
     shipping_cost = 9.99 if subtotal < 50 else 0.0
     tax_amount = subtotal * 0.08
     total_amount = subtotal + shipping_cost + tax_amount
@@ -58,54 +86,20 @@ def calculate_cart_totals(cart):
     }
 
 def request_solana_payment(amount, currency="USDC", metadata=None):
-    """Request Solana payment details from external service"""
-    params = {
-        "network": SOLANA_PAYMENT_NETWORK,
-        "amount": amount,
-    }
-    if currency:
-        params["currency"] = currency
-
-    headers = {}
-    api_key = os.getenv("SOLANA_PAYMENT_API_KEY")
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-
+    """
+    Request Solana payment details from the external service, from a sync route.
+    Identical concurrent quotes share one upstream call and are briefly cached.
+    """
     try:
-        response = requests.get(SOLANA_PAYMENT_API, params=params, headers=headers, timeout=30)
-        response.raise_for_status()
-        payment_data = response.json().get("payment")
-        if not payment_data:
-            raise ValueError("Invalid response from Solana payment API")
-
-        payment_data["amountUSDC"] = payment_data.get("amountUSDC") or amount
-        payment_data["network"] = SOLANA_PAYMENT_NETWORK
-
-        if metadata:
-            payment_data["metadata"] = metadata
-
-        return payment_data
-    except requests.HTTPError as http_err:
-        status_code = http_err.response.status_code
-        content = http_err.response.text
-        raise HTTPException(
-            status_code=status_code,
-            detail=f"Solana payment API error: {content}"
-        )
-    except requests.RequestException as req_err:
-        raise HTTPException(status_code=503, detail=f"Solana payment service unavailable: {str(req_err)}")
-    except Exception as err:
-        raise HTTPException(status_code=500, detail=f"Failed to request Solana payment: {str(err)}")
-
+        payment_data = from_thread.run(solana_quote_client.quote, amount, currency)
+    except SolanaQuoteRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=f"Solana payment API error: {e.detail}")
+    except SolanaQuoteUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Solana payment service unavailable: {e}")
 
-def cleanup_expired_solana_quotes():
-    """Remove expired Solana payment quotes from memory"""
-    if not SOLANA_PAYMENT_QUOTES:
-        return
-    now = datetime.utcnow()
-    expired_ids = [quote_id for quote_id, data in SOLANA_PAYMENT_QUOTES.items() if data["expires_at"] < now]
-    for quote_id in expired_ids:
-        SOLANA_PAYMENT_QUOTES.pop(quote_id, None)
+    if metadata:
+        payment_data["metadata"] = metadata
+    return payment_data
 
 
 class SolanaCheckoutRequest(BaseModel):
@@ -122,11 +116,52 @@ class SolanaConfirmRequest(BaseModel):
     payer_wallet: Optional[str] = None
 
 
-def generate_order_number():
-    """Generate a unique order number"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    random_suffix = uuid.uuid4().hex[:6].upper()
-    return f"ORD-{timestamp}-{random_suffix}"
+def charge_card(card: dict, amount: float, idempotency_key: Optional[str] = None) -> dict:
+    """
+    Authorize and capture through the payment processor from a sync route.
+    The processor call runs on the event loop, sharing its concurrency pool,
+    while this worker thread waits. A retry with the same idempotency_key is
+    charged only once.
+    """
+    try:
+        return from_thread.run(payment_processor.charge, card, amount, idempotency_key)
+    except PaymentDeclined as e:
+        raise HTTPException(status_code=400, detail=f"Payment failed: {str(e)}")
+    except PaymentProcessorUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Payment processor unavailable: {str(e)}")
+
+def refund_card(payment_result: dict, amount: float):
+    """Give back a charge whose order could not be placed"""
+    try:
+        from_thread.run(payment_processor.refund, payment_result['transaction_id'], amount)
+    except Exception as e:
+        logger.error(f"❌ Refund of {amount:.2f} for {payment_result['transaction_id']} failed, needs manual refund: {e}")
+
+@contextmanager
+def refunded_on_failure(db: Session, payment_result: dict, amount: float):
+    """
+    Refund a charge if placing its order fails for any reason before the order is committed.
+    A request whose claim a retry took over leaves the charge alone: the retry shares it.
+    """
+    try:
+        yield
+    except ClaimLost:
+        raise
+    except BaseException:
+        db.rollback()
+        refund_card(payment_result, amount)
+        raise
+
+def processor_idempotency_key(db: Session) -> Optional[str]:
+    """
+    Processor-side key for the card charge of the Idempotency-Key request being served.
+    A retry taking over an interrupted attempt gets the same key, and so that attempt's
+    charge; once a failed (and refunded) attempt has released the client's key, the
+    next one is charged afresh.
+    """
+    request = idempotent_request(db)
+    return f"{request.scope}:{request.key}:{request.claim_id}" if request else None
+
 
 @router.post("/", response_model=Cart)
 def create_cart(db: Session = Depends(get_db)):
@@ -140,11 +175,15 @@ def create_cart(db: Session = Depends(get_db)):
 
 @router.get("/{session_id}", response_model=Cart)
 def get_cart(session_id: str, db: Session = Depends(get_db)):
-    """Get cart by session ID"""
-    cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
-    if not cart:
+    """Get cart by session ID; polls of an unchanged cart are served from the cart cache"""
+    return cart_response(db, session_id)
+
+def cart_response(db: Session, session_id: str) -> Response:
+    """Serialized cart as a ready-made JSON response (already shaped by the Cart schema)"""
+    payload = read_cart(db, session_id)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Cart not found")
-    return cart
+    return Response(content=payload, media_type="application/json")
 
 @router.post("/{session_id}/items", response_model=Cart)
 def add_item_to_cart(
@@ -184,9 +223,88 @@ def add_item_to_cart(
         )
         db.add(cart_item)
     
+    # Record activity so the cart is not collected as abandoned
+    touch_cart(cart)
+    mark_cart_changed(db, session_id)
+    db.commit()
+    return cart_response(db, session_id)
+
+@router.patch("/{session_id}/items", response_model=Cart)
+def update_cart_items(
+    session_id: str,
+    batch: CartItemBatch,
+    db: Session = Depends(get_db)
+):
+    """
+    Apply a list of add / set / remove operations to the cart in one transaction.
+    Operations run in order: "add" increases a quantity, "set" replaces it (0 removes
+    the item) and "remove" drops the item if present. Unknown products reject the
+    whole batch.
+    """
+    # Get or create cart
+    cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
+    if not cart:
+        cart = CartModel(session_id=session_id)
+        db.add(cart)
+        db.flush()
+
+    for operation in batch.operations:
+        if operation.op == "add" and operation.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity to add must be positive")
+        if operation.op == "set" and operation.quantity < 0:
+            raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+
+    # Validate every referenced product with one query
+    product_ids = {operation.product_id for operation in batch.operations}
+    added_ids = {operation.product_id for operation in batch.operations if operation.op != "remove"}
+    known_ids = {
+        product_id for (product_id,) in
+        db.query(ProductModel.id).filter(ProductModel.id.in_(added_ids))
+    } if added_ids else set()
+    unknown_ids = sorted(added_ids - known_ids)
+    if unknown_ids:
+        raise HTTPException(status_code=404, detail=f"Products not found: {unknown_ids}")
+
+    # Fold the operations over the current quantities
+    existing = {
+        product_id: (item_id, quantity) for item_id, product_id, quantity in
+        db.query(CartItemModel.id, CartItemModel.product_id, CartItemModel.quantity).filter(
+            CartItemModel.cart_id == cart.id,
+            CartItemModel.product_id.in_(product_ids)
+        )
+    }
+    quantities = {product_id: quantity for product_id, (_, quantity) in existing.items()}
+    for operation in batch.operations:
+        if operation.op == "add":
+            quantities[operation.product_id] = quantities.get(operation.product_id, 0) + operation.quantity
+        elif operation.op == "set":
+            quantities[operation.product_id] = operation.quantity
+        else:
+            quantities[operation.product_id] = 0
+
+    # Write the net changes as at most one DELETE, one UPDATE and one INSERT batch
+    removed, updated, inserted = [], [], []
+    for product_id, quantity in quantities.items():
+        if product_id in existing:
+            item_id, current = existing[product_id]
+            if quantity <= 0:
+                removed.append(item_id)
+            elif quantity != current:
+                updated.append({"id": item_id, "quantity": quantity})
+        elif quantity > 0:
+            inserted.append({"cart_id": cart.id, "product_id": product_id, "quantity": quantity})
+
+    if removed:
+        db.query(CartItemModel).filter(CartItemModel.id.in_(removed)).delete(synchronize_session=False)
+    if updated:
+        db.execute(update(CartItemModel), updated)
+    if inserted:
+        db.execute(insert(CartItemModel), inserted)
+    touch_cart(cart)
+    mark_cart_changed(db, session_id)
     db.commit()
-    db.refresh(cart)
-    return cart
+
+    return cart_response(db, session_id)
 
 @router.put("/{session_id}/items/{product_id}", response_model=Cart)
 def update_cart_item(
@@ -214,9 +332,10 @@ def update_cart_item(
     else:
         cart_item.quantity = item_update.quantity
     
+    touch_cart(cart)
+    mark_cart_changed(db, session_id)
     db.commit()
-    db.refresh(cart)
-    return cart
+    return cart_response(db, session_id)
 
 @router.delete("/{session_id}/items/{product_id}", response_model=Message)
 def remove_item_from_cart(
@@ -238,6 +357,8 @@ def remove_item_from_cart(
         raise HTTPException(status_code=404, detail="Item not found in cart")
     
     db.delete(cart_item)
+    touch_cart(cart)
+    mark_cart_changed(db, session_id)
     db.commit()
     
     return Message(message="Item removed from cart successfully")
@@ -251,6 +372,8 @@ def clear_cart(session_id: str, db: Session = Depends(get_db)):
     
     # Delete all cart items
     db.query(CartItemModel).filter(CartItemModel.cart_id == cart.id).delete()
+    touch_cart(cart)
+    mark_cart_changed(db, session_id)
     db.commit()
     
     return Message(message="Cart cleared successfully")
@@ -259,128 +382,28 @@ def clear_cart(session_id: str, db: Session = Depends(get_db)):
 def checkout_cart(
     session_id: str,
     checkout_data: dict,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """Checkout cart and create an order with payment processing"""
-    from app.models.models import Order as OrderModel, OrderItem as OrderItemModel
-    from datetime import datetime
-    import uuid
-    import re
-    
+    return run_idempotent(
+        db, response, "checkout_cart", idempotency_key,
+        request_fingerprint(session_id, checkout_data),
+        lambda: _checkout_cart(session_id, checkout_data, db)
+    )
 
-    
-    def generate_order_number():
-        """Generate a unique order number"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_id = str(uuid.uuid4())[:8].upper()
-        return f"ORD-{timestamp}-{unique_id}"
-    
-    def detect_card_brand(card_number):
-        """Detect card brand from card number"""
-        card_number = re.sub(r'\D', '', card_number)  # Remove non-digits
-        
-        if card_number.startswith('4'):
-            return 'Visa'
-        elif card_number.startswith(('51', '52', '53', '54', '55')) or card_number.startswith('2'):
-            return 'Mastercard'
-        elif card_number.startswith(('34', '37')):
-            return 'American Express'
-        elif card_number.startswith('6'):
-            return 'Discover'
-        else:
-            return 'Unknown'
-    
-    def validate_card_number(card_number):
-        """Basic Luhn algorithm validation"""
-        card_number = re.sub(r'\D', '', card_number)
-        if len(card_number) < 13 or len(card_number) > 19:
-            return False
-        
-        # Luhn algorithm
-        def luhn_checksum(card_num):
-            def digits_of(n):
-                return [int(d) for d in str(n)]
-            digits = digits_of(card_num)
-            odd_digits = digits[-1::-2]
-            even_digits = digits[-2::-2]
-            checksum = sum(odd_digits)
-            for d in even_digits:
-                checksum += sum(digits_of(d*2))
-            return checksum % 10
-        
-        return luhn_checksum(card_number) == 0
-    
-    def validate_expiry(expiry_date):
-        """Validate expiry date format MM/YY or MM/YYYY"""
-        if not expiry_date:
-            return False
-        
-        try:
-            if '/' in expiry_date:
-                month, year = expiry_date.split('/')
-                month = int(month)
-                year = int(year)
-                
-                # Convert 2-digit year to 4-digit
-                if year < 100:
-                    year += 2000
-                
-                # Basic validation
-                if month < 1 or month > 12:
-                    return False
-                
-                # Check if card is not expired
-                from datetime import datetime
-                current_date = datetime.now()
-                if year < current_date.year or (year == current_date.year and month < current_date.month):
-                    return False
-                
-                return True
-        except (ValueError, IndexError):
-            return False
-        
-        return False
-    
-    def process_payment(card_data, amount):
-        """
-        Mock payment processing function
-        In production, this would integrate with a real payment processor like Stripe, Square, etc.
-        """
-        card_number = card_data.get('card_number', '')
-        expiry_date = card_data.get('expiry_date', '')
-        cvv = card_data.get('cvv', '')
-        
-        # Validate card number
-        if not validate_card_number(card_number):
-            return {"success": False, "error": "Invalid card number"}
-        
-        # Validate expiry date
-        if not validate_expiry(expiry_date):
-            return {"success": False, "error": "Invalid or expired card"}
-        
-        # Validate CVV
-        if not cvv or len(cvv) < 3 or len(cvv) > 4:
-            return {"success": False, "error": "Invalid CVV"}
-        
-        # Mock payment processing - always succeeds for demo
-        # In production, make API call to payment processor here
-        return {
-            "success": True,
-            "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
-            "card_brand": detect_card_brand(card_number),
-            "last_four": card_number[-4:]
-        }
-    
-    # Get cart by session_id
-    cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
-    if not cart:
+def _checkout_cart(session_id: str, checkout_data: dict, db: Session):
+    # Get cart with current prices by session_id
+    pricing = price_cart(db, session_id)
+    if not pricing:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    if not cart.items:
+    if not pricing["lines"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
     
     # Calculate total amount
-    total_amount = sum(item.product.price * item.quantity for item in cart.items)
+    total_amount = pricing["subtotal"]
     
     # Extract required fields from checkout_data
     customer_email = checkout_data.get('customer_email')
@@ -430,19 +453,12 @@ def checkout_cart(
                 detail="Complete payment information is required (card number, expiry date, CVV)"
             )
         
-        # Process payment
-        payment_result = process_payment(payment_data, total_amount)
-        
-        if not payment_result['success']:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Payment failed: {payment_result['error']}"
-            )
+        # Charge before touching the database, so no write lock is held while the processor responds
+        payment_result = charge_card(payment_data, total_amount, processor_idempotency_key(db))
     
     elif payment_method == 'cash':
         # Cash on delivery - no payment processing needed
         payment_result = {
-            "success": True,
             "transaction_id": f"cash_{uuid.uuid4().hex[:12]}",
             "card_brand": "Cash",
             "last_four": "CASH"
@@ -462,7 +478,6 @@ def checkout_cart(
         # In production, verify the transaction on-chain
         # For now, accept the signature
         payment_result = {
-            "success": True,
             "transaction_id": payment_signature,
             "card_brand": "x402 Solana",
             "last_four": payment_signature[-4:] if payment_signature else "X402"
@@ -474,156 +489,133 @@ def checkout_cart(
             detail=f"Unsupported payment method: {payment_method}"
         )
     
-    # Handle shipping address - handle both string and object formats
-    shipping_address = checkout_data.get('shipping_address', {})
-    if isinstance(shipping_address, str):
-        shipping_address_str = shipping_address
-    elif isinstance(shipping_address, dict):
-        shipping_address_str = f"{shipping_address.get('street', '')}, {shipping_address.get('city', '')}, {shipping_address.get('state', '')} {shipping_address.get('zip', '')}, {shipping_address.get('country', '')}"
-    else:
-        shipping_address_str = "No shipping address provided"
-    
-    # Create order with all the form data
-    order = OrderModel(
-        order_number=generate_order_number(),
-        customer_email=customer_email,
-        customer_name=customer_name,
-        total_amount=total_amount,
-        status="confirmed",  # Set to confirmed since payment succeeded
-        shipping_address=shipping_address_str,
-        phone=checkout_data.get('customer_phone'),
-        special_instructions=checkout_data.get('special_instructions'),
-        billing_address=checkout_data.get('billing_address', shipping_address_str),
-        payment_method=checkout_data.get('payment_method', {}).get('type', 'credit_card') if isinstance(checkout_data.get('payment_method'), dict) else checkout_data.get('payment_method', 'credit_card'),
-        billing_different=checkout_data.get('billing_different', False),
-        # Store payment information securely
-        card_last_four=payment_result['last_four'],
-        card_brand=payment_result['card_brand'],
-        payment_status="processed"
-    )
-    
-    db.add(order)
-    db.commit()
-    db.refresh(order)
-    
-    # Create order items from cart items
-    for cart_item in cart.items:
-        order_item = OrderItemModel(
-            order_id=order.id,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            price=cart_item.product.price
+    # Until the order is committed, any failure gives the card charge back
+    charged = payment_method in ('visa', 'credit_card')
+    with refunded_on_failure(db, payment_result, total_amount) if charged else nullcontext():
+        # Take the stock; it is committed together with the order
+        try:
+            reserve_stock(db, pricing["lines"])
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    
+        # Handle shipping address - handle both string and object formats
+        shipping_address = checkout_data.get('shipping_address', {})
+        if isinstance(shipping_address, str):
+            shipping_address_str = shipping_address
+        elif isinstance(shipping_address, dict):
+            shipping_address_str = f"{shipping_address.get('street', '')}, {shipping_address.get('city', '')}, {shipping_address.get('state', '')} {shipping_address.get('zip', '')}, {shipping_address.get('country', '')}"
+        else:
+            shipping_address_str = "No shipping address provided"
+    
+        # Create order and items and clear the cart in the transaction holding the stock
+        mark_cart_changed(db, session_id)
+        order = place_order(
+            db,
+            pricing["lines"],
+            cart_id=pricing["cart_id"],
+            customer_email=customer_email,
+            customer_name=customer_name,
+            total_amount=total_amount,
+            status="confirmed",  # Set to confirmed since payment succeeded
+            shipping_address=shipping_address_str,
+            phone=checkout_data.get('customer_phone'),
+            special_instructions=checkout_data.get('special_instructions'),
+            billing_address=checkout_data.get('billing_address', shipping_address_str),
+            payment_method=checkout_data.get('payment_method', {}).get('type', 'credit_card') if isinstance(checkout_data.get('payment_method'), dict) else checkout_data.get('payment_method', 'credit_card'),
+            billing_different=checkout_data.get('billing_different', False),
+            # Store payment information securely
+            card_last_four=payment_result['last_four'],
+            card_brand=payment_result['card_brand'],
+            payment_status="processed",
+            commit=False
         )
-        db.add(order_item)
-    
-    # Clear cart after successful checkout
-    from app.models.models import CartItem as CartItemModel
-    db.query(CartItemModel).filter(CartItemModel.cart_id == cart.id).delete()
-    
-    db.commit()
-    db.refresh(order)
-    
-    # Reload order with all relationships to ensure product data is available
-    from sqlalchemy.orm import joinedload
-    order = db.query(OrderModel).options(
-        joinedload(OrderModel.items).joinedload(OrderItemModel.product)
-    ).filter(OrderModel.id == order.id).first()
-    
 
-    
-    # Build items with complete product information
-    order_items = []
-    for item in order.items:
-        # If product relationship is None, fetch it explicitly
-        if item.product is None:
-            product = db.query(ProductModel).filter(ProductModel.id == item.product_id).first()
-        else:
-            product = item.product
-            
-        # Build item with complete product data
-        order_item = {
-            "id": item.id,
-            "product_id": item.product_id,
-            "product_name": product.name if product else f'Product {item.product_id}',
-            "quantity": item.quantity,
-            "price": float(item.price),  # Frontend expects 'price', not 'unit_price'
-            "unit_price": float(item.price),
-            "total_price": float(item.price * item.quantity),
-            "product": {
-                "id": product.id if product else item.product_id,
-                "name": product.name if product else f'Product {item.product_id}',
-                "price": float(product.price) if product else float(item.price),
-                "image_url": (product.image_url if product and product.image_url else "/placeholder/150/150"),
-                "description": (product.description if product and product.description else "")
+        # Build items with complete product information from the placed order
+        order_items = []
+        for item in order["items"]:
+            order_item = {
+                "id": item["id"],
+                "product_id": item["product_id"],
+                "product_name": item["product_name"],
+                "quantity": item["quantity"],
+                "price": item["unit_price"],  # Frontend expects 'price', not 'unit_price'
+                "unit_price": item["unit_price"],
+                "total_price": item["total_price"],
+                "product": {
+                    "id": item["product_id"],
+                    "name": item["product_name"],
+                    "price": item["unit_price"],
+                    "image_url": item["image_url"] or "/placeholder/150/150",
+                    "description": item["description"] or ""
+                }
             }
-        }
-        order_items.append(order_item)
-    
-    # Calculate order totals for response
-    subtotal = sum(item.price * item.quantity for item in order.items)
-    tax_amount = subtotal * 0.08  # 8% tax
-    shipping_cost = 15.00 if subtotal < 50 else 0.00  # Free shipping over $50
-    
-    return {
-        "message": "Order created and payment processed successfully",
-        "data": {
+            order_items.append(order_item)
+    
+        # Calculate order totals for response
+        subtotal = pricing["subtotal"]
+        tax_amount = subtotal * 0.08  # 8% tax
+        shipping_cost = 15.00 if subtotal < 50 else 0.00  # Free shipping over $50
+    
+        return commit_with_response(db, {
+            "message": "Order created and payment processed successfully",
+            "data": {
+                "order": {
+                    "id": order["id"],
+                    "order_number": order["order_number"],
+                    "customer_name": order["customer_name"],
+                    "customer_email": order["customer_email"],
+                    "total_amount": float(order["total_amount"]),
+                    "subtotal": float(subtotal),
+                    "tax_amount": float(tax_amount),
+                    "shipping_cost": float(shipping_cost),
+                    "status": order["status"],
+                    "payment_status": order["payment_status"],
+                    "created_at": order["created_at"].isoformat(),
+                    "items": order_items
+                },
+                "payment": {
+                    "method": checkout_data.get('payment_method', {}).get('type', 'credit_card') if isinstance(checkout_data.get('payment_method'), dict) else checkout_data.get('payment_method', 'credit_card'),
+                    "transaction_id": payment_result.get('transaction_id'),
+                    "amount_charged": float(order["total_amount"]),
+                    "status": "processed",
+                    "card_brand": order["card_brand"],
+                    "last_four": order["card_last_four"]
+                }
+            },
+            # Keep MCP-compatible fields for backward compatibility
+            "status": "success",
             "order": {
-                "id": order.id,
-                "order_number": order.order_number,
-                "customer_name": order.customer_name,
-                "customer_email": order.customer_email,
-                "total_amount": float(order.total_amount),
+                "id": order["id"],
+                "order_number": order["order_number"],
+                "customer_name": order["customer_name"],
+                "customer_email": order["customer_email"],
+                "total_amount": float(order["total_amount"]),
                 "subtotal": float(subtotal),
                 "tax_amount": float(tax_amount),
                 "shipping_cost": float(shipping_cost),
-                "status": order.status,
-                "payment_status": order.payment_status,
-                "created_at": order.created_at.isoformat(),
-                "items": order_items
+                "status": order["status"],
+                "created_at": order["created_at"].isoformat(),
+                "items": [{
+                    "product_id": line["product_id"],
+                    "product_name": line["product_name"],
+                    "quantity": line["quantity"],
+                    "unit_price": float(line["unit_price"]),
+                    "total_price": float(line["total_price"])
+                } for line in pricing["lines"]]
             },
             "payment": {
                 "method": checkout_data.get('payment_method', {}).get('type', 'credit_card') if isinstance(checkout_data.get('payment_method'), dict) else checkout_data.get('payment_method', 'credit_card'),
                 "transaction_id": payment_result.get('transaction_id'),
-                "amount_charged": float(order.total_amount),
-                "status": "processed",
-                "card_brand": order.card_brand,
-                "last_four": order.card_last_four
+                "amount_charged": float(order["total_amount"]),
+                "status": "processed"
+            },
+            "fulfillment": {
+                "tracking_number": f"TRK{uuid.uuid4().hex[:10].upper()}",
+                "shipping_carrier": "Standard Shipping",
+                "estimated_delivery": "5-7 business days",
+                "status": "processing"
             }
-        },
-        # Keep MCP-compatible fields for backward compatibility
-        "status": "success",
-        "order": {
-            "id": order.id,
-            "order_number": order.order_number,
-            "customer_name": order.customer_name,
-            "customer_email": order.customer_email,
-            "total_amount": float(order.total_amount),
-            "subtotal": float(subtotal),
-            "tax_amount": float(tax_amount),
-            "shipping_cost": float(shipping_cost),
-            "status": order.status,
-            "created_at": order.created_at.isoformat(),
-            "items": [{
-                "product_id": item.product_id,
-                "product_name": item.product.name,
-                "quantity": item.quantity,
-                "unit_price": float(item.price),
-                "total_price": float(item.price * item.quantity)
-            } for item in order.items]
-        },
-        "payment": {
-            "method": checkout_data.get('payment_method', {}).get('type', 'credit_card') if isinstance(checkout_data.get('payment_method'), dict) else checkout_data.get('payment_method', 'credit_card'),
-            "transaction_id": payment_result.get('transaction_id'),
-            "amount_charged": float(order.total_amount),
-            "status": "processed"
-        },
-        "fulfillment": {
-            "tracking_number": f"TRK{uuid.uuid4().hex[:10].upper()}",
-            "shipping_carrier": "Standard Shipping",
-            "estimated_delivery": "5-7 business days",
-            "status": "processing"
-        }
-    }
+        })
 
 @router.post("/{session_id}/finalize", status_code=402, response_model=CartFinalizeResponse)
 def finalize_cart(
@@ -635,12 +627,12 @@ def finalize_cart(
     Finalize cart with shipping, tax, coupons etc and return 402 Payment Required
     This endpoint implements the x402 protocol for payment processing
     """
-    # Get cart by session_id
-    cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
-    if not cart:
+    # Get cart with current prices by session_id
+    pricing = price_cart(db, session_id)
+    if not pricing:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    if not cart.items:
+    if not pricing["lines"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
     
     # Extract shipping and billing information
@@ -649,7 +641,7 @@ def finalize_cart(
     customer_info = finalize_data.customer_info
     
     # Calculate base amount
-    subtotal = sum(item.product.price * item.quantity for item in cart.items)
+    subtotal = pricing["subtotal"]
     
     # Calculate shipping (simplified logic - in production this would be more complex)
     shipping_cost = 0.0
@@ -697,20 +689,24 @@ def finalize_cart(
         'coupon_code': coupon_code,
         'items': [
             {
-                'product_id': item.product_id,
-                'product_name': item.product.name,
-                'quantity': item.quantity,
-                'unit_price': item.product.price,
-                'total_price': item.product.price * item.quantity
-            } for item in cart.items
+                'product_id': line['product_id'],
+                'product_name': line['product_name'],
+                'quantity': line['quantity'],
+                'unit_price': line['unit_price'],
+                'total_price': line['total_price']
+            } for line in pricing['lines']
         ]
     }
     
-    # In production, store this in Redis or database with expiration
-    # For now, we'll use a simple in-memory store (not production ready)
-    if not hasattr(finalize_cart, '_finalized_carts'):
-        finalize_cart._finalized_carts = {}
-    finalize_cart._finalized_carts[payment_session_id] = finalized_cart_data
+    # Hold the stock until the payment session expires, replacing the cart's earlier finalize or quote
+    try:
+        replace_hold(db, cart_hold_reference(session_id), pricing['lines'], FINALIZED_CART_TTL)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    db.commit()
+    
+    # Keep it until the payment session expires so any worker can fulfill it
+    FINALIZED_CARTS.set(payment_session_id, finalized_cart_data, FINALIZED_CART_TTL.total_seconds())
     
     # Build payment methods list (credit card + Solana USDC)
     payment_methods = [
@@ -787,27 +783,33 @@ def request_solana_quote(
     db: Session = Depends(get_db)
 ):
     """Generate Solana USDC payment instructions for the current cart"""
-    cleanup_expired_solana_quotes()
-
-    cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
-    if not cart:
+    pricing = price_cart(db, session_id)
+    if not pricing:
         raise HTTPException(status_code=404, detail="Cart not found")
 
-    if not cart.items:
+    if not pricing["lines"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
-    totals = calculate_cart_totals(cart)
+    totals = calculate_cart_totals(pricing)
     if totals["total"] <= 0:
         raise HTTPException(status_code=400, detail="Cart total must be greater than zero for Solana checkout")
 
     payment_data = request_solana_payment(totals["total"])
 
     quote_id = str(uuid.uuid4())
-    expires_at = datetime.utcnow() + timedelta(minutes=10)
+    created_at = datetime.utcnow()
+    expires_at = created_at + SOLANA_QUOTE_TTL
+
+    # Hold the stock while the customer sends the payment, replacing the cart's earlier finalize or quote
+    try:
+        replace_hold(db, cart_hold_reference(session_id), pricing["lines"], SOLANA_QUOTE_TTL)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    db.commit()
 
-    SOLANA_PAYMENT_QUOTES[quote_id] = {
+    SOLANA_PAYMENT_QUOTES.set(quote_id, {
         "session_id": session_id,
-        "cart_id": cart.id,
+        "cart_id": pricing["cart_id"],
         "totals": totals,
         "payment": payment_data,
         "customer": {
@@ -817,9 +819,9 @@ def request_solana_quote(
         },
         "shipping_address": solana_request.shipping_address,
         "metadata": solana_request.metadata or {},
-        "created_at": datetime.utcnow(),
-        "expires_at": expires_at,
-    }
+        "created_at": created_at.isoformat(),
+        "expires_at": expires_at.isoformat(),
+    }, SOLANA_QUOTE_TTL.total_seconds())
 
     return {
         "quote_id": quote_id,
@@ -843,11 +845,18 @@ def request_solana_quote(
 def confirm_solana_payment(
     session_id: str,
     confirm_request: SolanaConfirmRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """Confirm Solana payment by recording transaction signature and creating the order"""
-    cleanup_expired_solana_quotes()
+    return run_idempotent(
+        db, response, "confirm_solana_payment", idempotency_key,
+        request_fingerprint(session_id, confirm_request),
+        lambda: _confirm_solana_payment(session_id, confirm_request, db)
+    )
 
+def _confirm_solana_payment(session_id: str, confirm_request: SolanaConfirmRequest, db: Session):
     quote_data = SOLANA_PAYMENT_QUOTES.get(confirm_request.quote_id)
     if not quote_data:
         raise HTTPException(status_code=404, detail="Solana payment quote not found or expired")
@@ -855,15 +864,11 @@ def confirm_solana_payment(
     if quote_data["session_id"] != session_id:
         raise HTTPException(status_code=400, detail="Quote does not match the provided cart session")
 
-    if quote_data["expires_at"] < datetime.utcnow():
-        SOLANA_PAYMENT_QUOTES.pop(confirm_request.quote_id, None)
-        raise HTTPException(status_code=410, detail="Solana payment quote has expired. Please request a new quote.")
-
-    cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
-    if not cart:
+    pricing = price_cart(db, session_id)
+    if not pricing:
         raise HTTPException(status_code=404, detail="Cart not found")
 
-    if not cart.items:
+    if not pricing["lines"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
     totals = quote_data["totals"]
@@ -871,9 +876,17 @@ def confirm_solana_payment(
     customer_info = quote_data["customer"]
     shipping_address = quote_data.get("shipping_address") or "Digital Delivery - Solana Checkout"
 
-    # Create order
-    order = OrderModel(
-        order_number=generate_order_number(),
+    try:
+        claim_hold(db, cart_hold_reference(session_id), pricing["lines"])
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    # Create order and items and clear the cart in the transaction claiming the stock
+    mark_cart_changed(db, session_id)
+    order = place_order(
+        db,
+        pricing["lines"],
+        cart_id=pricing["cart_id"],
         customer_email=customer_info["email"],
         customer_name=customer_info["name"],
         total_amount=totals["total"],
@@ -884,48 +897,28 @@ def confirm_solana_payment(
         payment_status="processed",
         card_last_four=None,
         card_brand="solana_usdc",
-        special_instructions=f"Solana transaction signature: {confirm_request.transaction_signature}"
+        special_instructions=f"Solana transaction signature: {confirm_request.transaction_signature}",
+        commit=False
     )
 
-    db.add(order)
-    db.commit()
-    db.refresh(order)
-
-    # Create order items
-    for cart_item in cart.items:
-        order_item = OrderItemModel(
-            order_id=order.id,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            price=cart_item.product.price
-        )
-        db.add(order_item)
-
-    # Clear cart
-    db.query(CartItemModel).filter(CartItemModel.cart_id == cart.id).delete()
-    db.commit()
-
-    # Remove quote after successful processing
-    SOLANA_PAYMENT_QUOTES.pop(confirm_request.quote_id, None)
-
     tracking_number = f"TRK{uuid.uuid4().hex[:10].upper()}"
 
-    return {
+    body = commit_with_response(db, {
         "status": "success",
         "message": "Solana payment confirmed and order created",
         "order": {
-            "id": order.id,
-            "order_number": order.order_number,
-            "customer_name": order.customer_name,
-            "customer_email": order.customer_email,
-            "total_amount": float(order.total_amount),
+            "id": order["id"],
+            "order_number": order["order_number"],
+            "customer_name": order["customer_name"],
+            "customer_email": order["customer_email"],
+            "total_amount": float(order["total_amount"]),
             "subtotal": totals["subtotal"],
             "tax_amount": totals["tax"],
             "shipping_cost": totals["shipping"],
-            "status": order.status,
-            "payment_method": order.payment_method,
-            "payment_status": order.payment_status,
-            "created_at": order.created_at.isoformat(),
+            "status": order["status"],
+            "payment_method": order["payment_method"],
+            "payment_status": order["payment_status"],
+            "created_at": order["created_at"].isoformat(),
         },
         "payment": {
             "method": "solana_usdc",
@@ -950,37 +943,39 @@ def confirm_solana_payment(
             "shipping_carrier": "Standard Shipping",
             "status": "processing"
         }
-    }
+    })
+
+    # Remove quote after successful processing
+    SOLANA_PAYMENT_QUOTES.pop(confirm_request.quote_id)
+    return body
 
 @router.post("/{session_id}/fulfill", response_model=CartFulfillResponse)
 def fulfill_cart(
     session_id: str,
     payment_data: CartFulfillRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """
     Fulfill cart after payment confirmation
     This endpoint completes the x402 protocol flow
     """
-    from app.models.models import Order as OrderModel, OrderItem as OrderItemModel
-    from datetime import datetime
-    import uuid
-    
-    def generate_order_number():
-        """Generate a unique order number"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_id = str(uuid.uuid4())[:8].upper()
-        return f"ORD-{timestamp}-{unique_id}"
-    
+    return run_idempotent(
+        db, response, "fulfill_cart", idempotency_key,
+        request_fingerprint(session_id, payment_data),
+        lambda: _fulfill_cart(session_id, payment_data, db)
+    )
+
+def _fulfill_cart(session_id: str, payment_data: CartFulfillRequest, db: Session):
     # Get payment session ID from request
     payment_session_id = payment_data.payment_session_id
     
     # Retrieve finalized cart data
-    if not hasattr(finalize_cart, '_finalized_carts') or payment_session_id not in finalize_cart._finalized_carts:
+    finalized_data = FINALIZED_CARTS.get(payment_session_id)
+    if finalized_data is None:
         raise HTTPException(status_code=404, detail="Payment session not found or expired")
     
-    finalized_data = finalize_cart._finalized_carts[payment_session_id]
-    
     # Verify cart still exists
     cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
     if not cart:
@@ -992,112 +987,116 @@ def fulfill_cart(
     cvv = payment_data.cvv
     cardholder_name = payment_data.cardholder_name
     
-    # Process payment (mock implementation)
-    def process_payment_with_provider(payment_info, amount):
-        """Mock payment processing - in production, integrate with Stripe, Square, etc."""
-        import re
-        
-        # Basic validation
-        card_clean = re.sub(r'\D', '', payment_info['card_number'])
-        if len(card_clean) < 13 or len(card_clean) > 19:
-            return {"success": False, "error": "Invalid card number"}
-        
-        # Mock successful payment
-        return {
-            "success": True,
-            "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
-            "provider_reference": f"ref_{uuid.uuid4().hex[:8]}",
-            "last_four": card_clean[-4:],
-            "card_brand": "Visa" if card_clean.startswith('4') else "Mastercard"
-        }
-    
     # Process payment
-    payment_result = process_payment_with_provider({
+    payment_result = charge_card({
         'card_number': card_number,
         'expiry_date': expiry_date,
         'cvv': cvv,
         'cardholder_name': cardholder_name
-    }, finalized_data['total_amount'])
+    }, finalized_data['total_amount'], processor_idempotency_key(db))
     
-    if not payment_result['success']:
-        raise HTTPException(status_code=400, detail=f"Payment failed: {payment_result['error']}")
-    
-    # Create order
-    customer_info = finalized_data['customer_info']
-    order = OrderModel(
-        order_number=generate_order_number(),
-        customer_email=customer_info.get('email'),
-        customer_name=customer_info.get('name'),
-        total_amount=finalized_data['total_amount'],
-        status="confirmed",
-        shipping_address=str(finalized_data['shipping_address']),
-        billing_address=str(finalized_data['billing_address']),
-        phone=customer_info.get('phone'),
-        payment_method="credit_card",
-        card_last_four=payment_result['last_four'],
-        card_brand=payment_result['card_brand'],
-        payment_status="processed"
-    )
-    
-    db.add(order)
-    db.commit()
-    db.refresh(order)
-    
-    # Create order items
-    for item_data in finalized_data['items']:
-        order_item = OrderItemModel(
-            order_id=order.id,
-            product_id=item_data['product_id'],
-            quantity=item_data['quantity'],
-            price=item_data['unit_price']
+    # Until the order is committed, any failure gives the card charge back
+    with refunded_on_failure(db, payment_result, finalized_data['total_amount']):
+        # Convert the stock held at finalize into the sale
+        try:
+            claim_hold(db, cart_hold_reference(finalized_data['session_id']), finalized_data['items'])
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    
+        # Create order and items and clear the cart in the transaction claiming the stock
+        customer_info = finalized_data['customer_info']
+        mark_cart_changed(db, session_id)
+        order = place_order(
+            db,
+            finalized_data['items'],
+            cart_id=cart.id,
+            customer_email=customer_info.get('email'),
+            customer_name=customer_info.get('name'),
+            total_amount=finalized_data['total_amount'],
+            status="confirmed",
+            shipping_address=str(finalized_data['shipping_address']),
+            billing_address=str(finalized_data['billing_address']),
+            phone=customer_info.get('phone'),
+            payment_method="credit_card",
+            card_last_four=payment_result['last_four'],
+            card_brand=payment_result['card_brand'],
+            payment_status="processed",
+            commit=False
         )
-        db.add(order_item)
     
-    # Clear cart after successful fulfillment
-    from app.models.models import CartItem as CartItemModel
-    db.query(CartItemModel).filter(CartItemModel.cart_id == cart.id).delete()
+        # Generate tracking number (mock)
+        tracking_number = f"TRK{uuid.uuid4().hex[:10].upper()}"
     
-    db.commit()
+        body = commit_with_response(db, {
+            "status": "fulfilled",
+            "message": "Order completed successfully",
+            "order": {
+                "id": order["id"],
+                "order_number": order["order_number"],
+                "status": order["status"],
+                "total_amount": order["total_amount"],
+                "created_at": order["created_at"]
+            },
+            "payment": {
+                "transaction_id": payment_result['transaction_id'],
+                "provider_reference": payment_result['provider_reference'],
+                "status": "completed"
+            },
+            "fulfillment": {
+                "tracking_number": tracking_number,
+                "estimated_delivery": "5-7 business days",
+                "shipping_carrier": "Standard Shipping"
+            }
+        })
     
     # Clean up payment session data
-    del finalize_cart._finalized_carts[payment_session_id]
-    
-    # Generate tracking number (mock)
-    tracking_number = f"TRK{uuid.uuid4().hex[:10].upper()}"
-    
-    return {
-        "status": "fulfilled",
-        "message": "Order completed successfully",
-        "order": {
-            "id": order.id,
-            "order_number": order.order_number,
-            "status": order.status,
-            "total_amount": order.total_amount,
-            "created_at": order.created_at
-        },
-        "payment": {
-            "transaction_id": payment_result['transaction_id'],
-            "provider_reference": payment_result['provider_reference'],
-            "status": "completed"
-        },
-        "fulfillment": {
-            "tracking_number": tracking_number,
-            "estimated_delivery": "5-7 business days",
-            "shipping_carrier": "Standard Shipping"
-        }
-    }
+    FINALIZED_CARTS.pop(payment_session_id)
+    return body
 
 
 @router.post("/{session_id}/x402/checkout")
 async def x402_checkout(
     session_id: str,
     checkout_data: dict,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """
     Machine-to-machine x402 checkout endpoint
     Accepts delegation token as payment and settles through Payment Facilitator
     """
+    return await run_idempotent_async(
+        db, response, "x402_checkout", idempotency_key,
+        request_fingerprint(session_id, checkout_data),
+        lambda: _x402_checkout(session_id, checkout_data, db)
+    )
+
+async def settle_x402(settlement_request: dict, settlement_key: str, sent: bool = False) -> Optional[dict]:
+    """
+    Settle through the shared async facilitator client so the event loop keeps serving.
+    If the settlement may have reached the facilitator but no usable answer came back,
+    it is sent once more under the same key, which the facilitator answers with the
+    original outcome. Returns None if the outcome is still unknown after that.
+    Raises SettlementDeclined, and httpx.HTTPError / CircuitOpenError when the
+    settlement was never sent; pass `sent` if an earlier request may have sent it.
+    """
+    for _ in range(2):
+        try:
+            settlement = await facilitator_client.settle(settlement_request, idempotency_key=settlement_key)
+            settlement["transaction_receipt"]["receipt_id"]
+            return settlement
+        except SettlementDeclined:
+            raise
+        except (CircuitOpenError, httpx.ConnectError, httpx.ConnectTimeout):
+            if not sent:
+                raise
+        except Exception as e:
+            sent = True
+            logger.warning(f"⚠️ Outcome of x402 settlement {settlement_key} unknown: {e}")
+    return None
+
+async def _x402_checkout(session_id: str, checkout_data: dict, db: Session):
     try:
         # Extract delegation token and agent info
         delegation_token = checkout_data.get('delegation_token')
@@ -1109,30 +1108,31 @@ async def x402_checkout(
                 detail="delegation_token and agent_id are required for x402 checkout"
             )
         
-        # Get cart by session_id
-        cart = db.query(CartModel).filter(CartModel.session_id == session_id).first()
-        if not cart:
+        # Get cart with current prices by session_id
+        pricing = price_cart(db, session_id)
+        if not pricing:
             raise HTTPException(status_code=404, detail="Cart not found")
         
-        if not cart.items:
+        if not pricing["lines"]:
             raise HTTPException(status_code=400, detail="Cart is empty")
         
         # Calculate totals
-        subtotal = sum(item.quantity * item.product.price for item in cart.items)
+        subtotal = pricing["subtotal"]
         shipping_cost = 15.00  # Standard shipping
         tax_rate = 0.0875  # 8.75% tax
         tax_amount = subtotal * tax_rate
         total_amount = subtotal + shipping_cost + tax_amount
         
         # Prepare items for settlement request
-        items = []
-        for cart_item in cart.items:
-            items.append({
-                "product_id": cart_item.product_id,
-                "name": cart_item.product.name,
-                "quantity": cart_item.quantity,
-                "price": float(cart_item.product.price)
-            })
+        items = [
+            {
+                "product_id": line["product_id"],
+                "name": line["product_name"],
+                "quantity": line["quantity"],
+                "price": float(line["unit_price"])
+            }
+            for line in pricing["lines"]
+        ]
         
         # Prepare settlement request to Payment Facilitator
         merchant_id = "merchant_123"  # Your merchant ID
@@ -1161,38 +1161,50 @@ async def x402_checkout(
             "merchant_signature": merchant_signature
         }
         
-        # Call Payment Facilitator to settle payment
-        import requests
-        facilitator_url = "http://localhost:8001"
+        # Hold the stock while the payment settles. A retry with the same Idempotency-Key
+        # reuses the hold and settles under the same facilitator key, so it is charged once.
+        request = idempotent_request(db)
+        if request:
+            hold_reference = f"x402:{hashlib.sha256(request.key.encode('utf-8')).hexdigest()}"
+        else:
+            hold_reference = f"x402:{uuid.uuid4()}"
+        try:
+            resumed = hold_stock(db, hold_reference, pricing["lines"], X402_HOLD_TTL)
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        db.commit()
         
         try:
-            settlement_response = requests.post(
-                f"{facilitator_url}/x402/settle",
-                json=settlement_request,
-                headers={"Content-Type": "application/json"},
-                timeout=30
+            settlement_data = await settle_x402(settlement_request, hold_reference, sent=resumed)
+        except SettlementDeclined as e:
+            release_hold(db, hold_reference)
+            db.commit()
+            raise HTTPException(
+                status_code=402,  # Payment Required
+                detail=f"Payment settlement failed: {str(e)}"
             )
-            
-            if settlement_response.status_code != 200:
-                error_detail = settlement_response.text
-                raise HTTPException(
-                    status_code=402,  # Payment Required
-                    detail=f"Payment settlement failed: {error_detail}"
-                )
-            
-            settlement_data = settlement_response.json()
-            receipt = settlement_data["transaction_receipt"]
-            
-        except requests.RequestException as e:
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            release_hold(db, hold_reference)
+            db.commit()
             raise HTTPException(
                 status_code=503,
                 detail=f"Payment Facilitator unavailable: {str(e)}"
             )
+        if settlement_data is None:
+            # The payment may have gone through, so the stock stays held for the retry that reconciles it
+            raise OutcomePending(
+                "Payment outcome unknown; retry with the same Idempotency-Key to complete the checkout"
+            )
+        receipt = settlement_data["transaction_receipt"]
         
         # Payment settled successfully, create order
-        order = OrderModel(
-            order_number=generate_order_number(),
-            customer_email=f"agent_{agent_id}@system.local",
+        claim_hold(db, hold_reference, pricing["lines"])
+        mark_cart_changed(db, session_id)
+        order = place_order(
+            db,
+            pricing["lines"],
+            cart_id=pricing["cart_id"],
+            customer_email=agent_email(agent_id),
             customer_name=f"Agent {agent_id}",
             total_amount=total_amount,
             status="confirmed",
@@ -1200,58 +1212,39 @@ async def x402_checkout(
             payment_status="processed",
             # Store x402 payment details
             card_last_four=None,  # Not applicable for x402
-            card_brand="x402_token"  # Indicate x402 payment
+            card_brand="x402_token",  # Indicate x402 payment
+            commit=False
         )
         
-        db.add(order)
-        db.commit()
-        db.refresh(order)
-        
-        # Create order items from cart
-        for cart_item in cart.items:
-            order_item = OrderItemModel(
-                order_id=order.id,
-                product_id=cart_item.product_id,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
-            )
-            db.add(order_item)
-        
-        # Clear cart after successful checkout
-        from app.models.models import CartItem as CartItemModel
-        db.query(CartItemModel).filter(CartItemModel.cart_id == cart.id).delete()
-        
-        db.commit()
-        
         # Generate tracking number
         tracking_number = f"TRK{uuid.uuid4().hex[:10].upper()}"
         
         # Return comprehensive order details to agent
-        return {
+        return commit_with_response(db, {
             "status": "success",
             "message": "x402 checkout completed successfully",
             "order": {
-                "id": order.id,
-                "order_number": order.order_number,
-                "customer_name": order.customer_name,
-                "customer_email": order.customer_email,
-                "total_amount": float(order.total_amount),
+                "id": order["id"],
+                "order_number": order["order_number"],
+                "customer_name": order["customer_name"],
+                "customer_email": order["customer_email"],
+                "total_amount": float(order["total_amount"]),
                 "subtotal": float(subtotal),
                 "tax_amount": float(tax_amount),
                 "shipping_cost": float(shipping_cost),
-                "status": order.status,
-                "payment_method": order.payment_method,
-                "payment_status": order.payment_status,
-                "created_at": order.created_at.isoformat(),
+                "status": order["status"],
+                "payment_method": order["payment_method"],
+                "payment_status": order["payment_status"],
+                "created_at": order["created_at"].isoformat(),
                 "items": [
                     {
-                        "product_id": item.product_id,
-                        "product_name": item.product.name,
-                        "quantity": item.quantity,
-                        "unit_price": float(item.price),
-                        "total_price": float(item.quantity * item.price)
+                        "product_id": line["product_id"],
+                        "product_name": line["product_name"],
+                        "quantity": line["quantity"],
+                        "unit_price": float(line["unit_price"]),
+                        "total_price": float(line["total_price"])
                     }
-                    for item in order.items
+                    for line in pricing["lines"]
                 ]
             },
             "payment": {
@@ -1274,7 +1267,7 @@ async def x402_checkout(
                 "shipping_carrier": "Standard Shipping",
                 "status": "processing"
             }
-        }
+        })
         
     except HTTPException:
         raise
@@ -6,24 +6,37 @@
 #
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, true
+from sqlalchemy.orm import Session, selectinload, sessionmaker
 from app.database.database import get_db
 from app.models.models import (
     Order as OrderModel, 
     OrderItem as OrderItemModel
 )
-from app.schemas import Order, OrderList, Message
-import uuid
+from app.schemas import Order, OrderList, Message, OrderStatusBulkRequest, OrderStatusBulkResponse
+from app.services.orders import iter_order_export, bulk_update_status, generate_order_number
+from app.services.order_archive import archived_orders, count_archived_orders, find_archived_order, find_archived_orders
+from app.services.order_events import (
+    ORDER_EVENTS_POLL_INTERVAL, ORDER_STATUS_CHANGED, OrderEventHub, agent_email, fetch_order_events, format_sse,
+    order_event_hub, record_order_events
+)
+import asyncio
+import os
+import time
 from datetime import datetime
+from typing import List, Optional
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
-def generate_order_number():
-    """Generate a unique order number"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    unique_id = str(uuid.uuid4())[:8].upper()
-    return f"ORD-{timestamp}-{unique_id}"
+# Idle event streams send a comment this often so proxies keep them open
+ORDER_EVENTS_HEARTBEAT = float(os.getenv("ORDER_EVENTS_HEARTBEAT", "15"))
+
+def with_items(query):
+    """Load the items (and their products) of every order in the result with one query each"""
+    return query.options(selectinload(OrderModel.items).selectinload(OrderItemModel.product))
 
 # Checkout functionality moved to /cart/{session_id}/checkout
 
@@ -33,34 +46,164 @@ def get_orders(
     status: str = None,
     limit: int = 20,
     offset: int = 0,
+    include_archived: bool = Query(False, description="Also list finished orders moved to the archive"),
     db: Session = Depends(get_db)
 ):
-    """Get orders with optional filtering"""
+    """
+    Get orders with optional filtering, newest first.
+    Only live orders are listed unless `include_archived` is set: delivered and
+    cancelled orders past the archival horizon live in the archive, and paging
+    through both costs a read of `offset + limit` rows from each.
+    """
     query = db.query(OrderModel)
+    archived = true()
     
     if customer_email:
         query = query.filter(OrderModel.customer_email == customer_email)
+        archived = and_(archived, archived_orders.c.customer_email == customer_email)
     
     if status:
         query = query.filter(OrderModel.status == status)
+        archived = and_(archived, archived_orders.c.status == status)
     
     total = query.count()
-    orders = query.order_by(OrderModel.created_at.desc()).offset(offset).limit(limit).all()
+    if not include_archived:
+        orders = with_items(query).order_by(OrderModel.created_at.desc()).offset(offset).limit(limit).all()
+        return OrderList(orders=orders, total=total)
     
-    return OrderList(orders=orders, total=total)
+    total += count_archived_orders(db, archived)
+    newest = with_items(query).order_by(OrderModel.created_at.desc()).limit(offset + limit).all()
+    newest += find_archived_orders(db, archived, order_by=(archived_orders.c.created_at.desc(),), limit=offset + limit)
+    newest.sort(key=lambda order: order.created_at, reverse=True)
+    return OrderList(orders=newest[offset:offset + limit], total=total)
+
+@router.get("/export")
+def export_orders(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    created_from: Optional[datetime] = Query(None, description="Inclusive lower bound on created_at"),
+    created_to: Optional[datetime] = Query(None, description="Exclusive upper bound on created_at"),
+    status: Optional[List[str]] = Query(None, description="Only orders in these statuses (repeatable)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream every matching order with its items, oldest first, for reconciliation;
+    archived orders are included.
+    NDJSON yields one order per line; CSV yields one row per order item.
+    """
+    # The request session is closed once the handler returns, so the stream opens its own
+    session_factory = sessionmaker(bind=db.get_bind(), autocommit=False, autoflush=False)
+    stream = iter_order_export(session_factory, format, created_from, created_to, status)
+    if format == "csv":
+        return StreamingResponse(
+            stream,
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="orders.csv"'}
+        )
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+@router.get("/events")
+async def order_events(
+    request: Request,
+    customer_email: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    since: Optional[int] = Query(None, description="Last event id already seen"),
+    timeout: float = Query(25.0, gt=0, le=60, description="Long-poll: seconds to wait for an event"),
+    limit: Optional[int] = Query(None, ge=1, description="Stream: close after this many events"),
+    db: Session = Depends(get_db)
+):
+    """
+    Order lifecycle events (order.created, order.status_changed), oldest first.
+    With `Accept: text/event-stream` the connection stays open and events are pushed
+    as Server-Sent Events, resuming after Last-Event-ID. Otherwise this long-polls:
+    it returns as soon as there are events after `since`, or empty after `timeout`.
+    Filter with `customer_email`, or `agent_id` for orders placed by an x402 agent.
+    """
+    email = agent_email(agent_id) if agent_id else customer_email
+    last_event_id = request.headers.get("last-event-id")
+    after = since if since is not None else int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    # Outbox reads open short sessions of their own; the request session closes with the handler
+    session_factory = sessionmaker(bind=db.get_bind(), autocommit=False, autoflush=False)
+    hub = order_event_hub(db.get_bind())
+    
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_order_events(request, hub, session_factory, after, email, limit),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    subscription = await run_in_threadpool(hub.subscribe, email, asyncio.get_running_loop())
+    try:
+        # Catch up from the outbox once; after that the hub hands over new events
+        events = await run_in_threadpool(fetch_order_events, session_factory, after, email, 100, subscription.horizon)
+        deadline = time.monotonic() + timeout
+        while not events and (remaining := deadline - time.monotonic()) > 0:
+            events = await subscription.next(after, remaining)
+    finally:
+        subscription.close()
+    return {"events": events, "last_event_id": events[-1]["id"] if events else after}
+
+async def stream_order_events(
+    request: Request, hub: OrderEventHub, session_factory, after: int, email: Optional[str], limit: Optional[int]
+):
+    """Push events as they are committed, with heartbeat comments while idle"""
+    subscription = await run_in_threadpool(hub.subscribe, email, asyncio.get_running_loop())
+    sent = 0
+    try:
+        yield f"retry: {int(ORDER_EVENTS_POLL_INTERVAL * 1000)}\n\n"
+        # Catch up from the outbox; after that the hub hands over new events
+        while limit is None or sent < limit:
+            events = await run_in_threadpool(fetch_order_events, session_factory, after, email, 100, subscription.horizon)
+            for order_event in events[:None if limit is None else limit - sent]:
+                yield format_sse(order_event)
+                after = order_event["id"]
+                sent += 1
+            if len(events) < 100:
+                break
+        idle_since = time.monotonic()
+        while limit is None or sent < limit:
+            events = await subscription.next(after, ORDER_EVENTS_POLL_INTERVAL)
+            for order_event in events[:None if limit is None else limit - sent]:
+                yield format_sse(order_event)
+                after = order_event["id"]
+                sent += 1
+                idle_since = time.monotonic()
+            if events:
+                continue
+            if await request.is_disconnected():
+                break
+            if time.monotonic() - idle_since >= ORDER_EVENTS_HEARTBEAT:
+                yield ": keep-alive\n\n"
+                idle_since = time.monotonic()
+    finally:
+        subscription.close()
+
+def status_changed_event(order: OrderModel, status: str) -> dict:
+    return {
+        "order_id": order.id,
+        "order_number": order.order_number,
+        "customer_email": order.customer_email,
+        "event_type": ORDER_STATUS_CHANGED,
+        "status": status,
+        "previous_status": order.status
+    }
 
 @router.get("/{order_id}", response_model=Order)
 def get_order(order_id: int, db: Session = Depends(get_db)):
-    """Get a specific order by ID"""
-    order = db.query(OrderModel).filter(OrderModel.id == order_id).first()
+    """Get a specific order by ID, from the archive if it has been archived"""
+    order = with_items(db.query(OrderModel)).filter(OrderModel.id == order_id).first()
+    if not order:
+        order = find_archived_order(db, archived_orders.c.id == order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
 @router.get("/number/{order_number}", response_model=Order)
 def get_order_by_number(order_number: str, db: Session = Depends(get_db)):
-    """Get a specific order by order number"""
-    order = db.query(OrderModel).filter(OrderModel.order_number == order_number).first()
+    """Get a specific order by order number, from the archive if it has been archived"""
+    order = with_items(db.query(OrderModel)).filter(OrderModel.order_number == order_number).first()
+    if not order:
+        order = find_archived_order(db, archived_orders.c.order_number == order_number)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
@@ -83,6 +226,8 @@ def update_order_status(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    if order.status != status:
+        record_order_events(db, [status_changed_event(order, status)])
     order.status = status
     order.updated_at = datetime.utcnow()
     
@@ -91,6 +236,20 @@ def update_order_status(
     
     return order
 
+@router.post("/status:bulk", response_model=OrderStatusBulkResponse)
+def bulk_update_order_status(request: OrderStatusBulkRequest, db: Session = Depends(get_db)):
+    """
+    Apply many status changes in one transaction, e.g. a warehouse marking orders shipped.
+    Each change must follow the order lifecycle (pending -> confirmed -> shipped -> delivered,
+    with cancellation from pending or confirmed); invalid changes are reported per order
+    and do not block the others.
+    """
+    results = bulk_update_status(db, [(update.order_number, update.status) for update in request.updates])
+    return OrderStatusBulkResponse(
+        updated=sum(1 for outcome in results if outcome["result"] == "updated"),
+        results=results
+    )
+
 @router.delete("/{order_id}", response_model=Message)
 def cancel_order(order_id: int, db: Session = Depends(get_db)):
     """Cancel an order (only if status is pending or confirmed)"""
@@ -104,6 +263,7 @@ def cancel_order(order_id: int, db: Session = Depends(get_db)):
             detail="Order cannot be cancelled. Only pending or confirmed orders can be cancelled."
         )
     
+    record_order_events(db, [status_changed_event(order, "cancelled")])
     order.status = "cancelled"
     order.updated_at = datetime.utcnow()
     
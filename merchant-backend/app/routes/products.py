@@ -7,24 +7,89 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, sessionmaker
 from typing import Optional
-import requests
+import httpx
 import logging
+import time
 from app.database.database import get_db
-from app.models.models import Product as ProductModel
+from app.models.models import Product as ProductModel, Category as CategoryModel, normalize_category
 from app.schemas import Product, ProductList, ProductSearch, ProductCreate
-from sqlalchemy import and_, or_
+from app.services.catalog import (
+    compute_facets, facet_cache, current_catalog_version, iter_catalog_changes
+)
+from app.services.facilitator import facilitator_client, DelegationRejected, PAYMENT_FACILITATOR_URL
+from app.services.http_client import CircuitOpenError
+from app.services.search_index import search_index
+from sqlalchemy import and_, or_, select
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/products", tags=["products"])
 
+PREMIUM_SEARCH_PRICE = 0.50
+
+def category_filters(category: Optional[str] = None, category_prefix: Optional[str] = None):
+    """
+    Build category filters against the normalized categories table.
+    Both resolve to category_id lookups so that, combined with a price range,
+    the (category_id, price) index can be used as a range scan.
+    """
+    filters = []
+    
+    normalized = normalize_category(category)
+    if normalized:
+        filters.append(
+            ProductModel.category_id == select(CategoryModel.id)
+            .where(CategoryModel.name == normalized)
+            .scalar_subquery()
+        )
+    
+    prefix = normalize_category(category_prefix)
+    if prefix:
+        # Half-open range instead of LIKE so the unique index on categories.name is used
+        upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        filters.append(
+            ProductModel.category_id.in_(
+                select(CategoryModel.id).where(
+                    CategoryModel.name >= prefix,
+                    CategoryModel.name < upper_bound
+                )
+            )
+        )
+    
+    return filters
+
+def text_filters(query: Optional[str] = None):
+    """Build name/description search filters"""
+    if not query:
+        return []
+    return [
+        or_(
+            ProductModel.name.ilike(f"%{query}%"),
+            ProductModel.description.ilike(f"%{query}%")
+        )
+    ]
+
+def price_filters(min_price: Optional[float] = None, max_price: Optional[float] = None):
+    """Build price range filters"""
+    filters = []
+    
+    if min_price is not None:
+        filters.append(ProductModel.price >= min_price)
+    
+    if max_price is not None:
+        filters.append(ProductModel.price <= max_price)
+    
+    return filters
+
 @router.get("/", response_model=ProductList)
 def search_products(
     query: Optional[str] = Query(None, description="Search query for product name or description"),
-    category: Optional[str] = Query(None, description="Filter by category"),
+    category: Optional[str] = Query(None, description="Filter by category (exact, case-insensitive)"),
+    category_prefix: Optional[str] = Query(None, description="Filter by category name prefix"),
     min_price: Optional[float] = Query(None, description="Minimum price filter"),
     max_price: Optional[float] = Query(None, description="Maximum price filter"),
     limit: int = Query(20, ge=1, le=100, description="Number of products to return"),
@@ -34,48 +99,147 @@ def search_products(
     """Search and filter products"""
     
     # Build query
+    filters = text_filters(query)
+    filters.extend(category_filters(category, category_prefix))
+    filters.extend(price_filters(min_price, max_price))
+    
+    # Apply filters
+    query_obj = db.query(ProductModel)
+    if filters:
+        query_obj = query_obj.filter(and_(*filters))
+    
+    # Get total count
+    total = query_obj.count()
+    
+    # Apply pagination and get results
+    products = query_obj.offset(offset).limit(limit).all()
+    
+    return ProductList(
+        products=products,
+        total=total,
+        limit=limit,
+        offset=offset
+    )
+
+@router.get("/facets")
+def product_facets(
+    query: Optional[str] = Query(None, description="Search query for product name or description"),
+    category: Optional[str] = Query(None, description="Filter by category (exact, case-insensitive)"),
+    category_prefix: Optional[str] = Query(None, description="Filter by category name prefix"),
+    min_price: Optional[float] = Query(None, description="Minimum price filter"),
+    max_price: Optional[float] = Query(None, description="Maximum price filter"),
+    bucket_size: float = Query(25.0, gt=0, description="Width of each price histogram bucket"),
+    db: Session = Depends(get_db)
+):
+    """Category counts, price histogram and stock availability for a filter set"""
+    signature = (
+        query,
+        normalize_category(category),
+        normalize_category(category_prefix),
+        min_price,
+        max_price,
+        bucket_size
+    )
+    version = current_catalog_version(db)
+    
+    facets = facet_cache.get(signature, version)
+    if facets is None:
+        filters = text_filters(query)
+        filters.extend(category_filters(category, category_prefix))
+        filters.extend(price_filters(min_price, max_price))
+        
+        facets = compute_facets(db, filters, bucket_size)
+        facet_cache.set(signature, version, facets)
+    
+    return facets
+
+@router.get("/changes")
+def product_changes(
+    since: int = Query(0, ge=0, description="Return changes after this catalog version"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of changes to return"),
+    db: Session = Depends(get_db)
+):
+    """
+    Incremental catalog sync feed.
+    Streams changed and deleted products after `since` as NDJSON, ending with
+    a checkpoint line whose version is the `since` to use for the next call.
+    """
+    # The request session is closed once the handler returns, so the stream opens its own
+    session_factory = sessionmaker(bind=db.get_bind(), autocommit=False, autoflush=False)
+    return StreamingResponse(
+        iter_catalog_changes(session_factory, since, limit),
+        media_type="application/x-ndjson",
+        headers={"X-Catalog-Version": str(current_catalog_version(db))}
+    )
+
+def _premium_search(
+    db: Session,
+    query: Optional[str],
+    category: Optional[str],
+    category_prefix: Optional[str],
+    min_price: Optional[float],
+    max_price: Optional[float],
+    limit: int,
+    offset: int
+):
+    """Run the premium product query (blocking; called from a worker thread)"""
+    if query and search_index.ready:
+        # Typo tolerant ranked search over the in-memory trigram index
+        product_ids, scores = search_index.search(
+            query,
+            category=category,
+            category_prefix=category_prefix,
+            min_price=min_price,
+            max_price=max_price
+        )
+        page_ids = [int(product_id) for product_id in product_ids[offset:offset + limit]]
+        page_scores = [float(score) for score in scores[offset:offset + limit]]
+        
+        rows = db.query(ProductModel).filter(ProductModel.id.in_(page_ids)).all() if page_ids else []
+        by_id = {product.id: product for product in rows}
+        products = [
+            Product.model_validate(by_id[product_id])
+            for product_id in page_ids if product_id in by_id
+        ]
+        return products, len(product_ids), page_scores
+    
+    # Build enhanced query with premium features
     filters = []
     
     if query:
         filters.append(
             or_(
                 ProductModel.name.ilike(f"%{query}%"),
-                ProductModel.description.ilike(f"%{query}%")
+                ProductModel.description.ilike(f"%{query}%"),
+                ProductModel.category.ilike(f"%{query}%")  # Also search in category
             )
         )
     
-    if category:
-        filters.append(ProductModel.category.ilike(f"%{category}%"))
-    
-    if min_price is not None:
-        filters.append(ProductModel.price >= min_price)
-    
-    if max_price is not None:
-        filters.append(ProductModel.price <= max_price)
+    filters.extend(category_filters(category, category_prefix))
+    filters.extend(price_filters(min_price, max_price))
     
-    # Apply filters
+    # Apply filters with premium sorting
     query_obj = db.query(ProductModel)
     if filters:
         query_obj = query_obj.filter(and_(*filters))
     
+    # Premium feature: Sort by relevance and popularity
+    query_obj = query_obj.order_by(ProductModel.stock_quantity.desc(), ProductModel.price.asc())
+    
     # Get total count
     total = query_obj.count()
     
-    # Apply pagination and get results
+    # Apply pagination
     products = query_obj.offset(offset).limit(limit).all()
     
-    return ProductList(
-        products=products,
-        total=total,
-        limit=limit,
-        offset=offset
-    )
+    return [Product.model_validate(product) for product in products], total, []
 
 @router.get("/premium/search")
-def premium_search_products(
+async def premium_search_products(
     request: Request,
     query: Optional[str] = Query(None, description="Search query for product name or description"),
-    category: Optional[str] = Query(None, description="Filter by category"),
+    category: Optional[str] = Query(None, description="Filter by category (exact, case-insensitive)"),
+    category_prefix: Optional[str] = Query(None, description="Filter by category name prefix"),
     min_price: Optional[float] = Query(None, description="Minimum price filter"),
     max_price: Optional[float] = Query(None, description="Maximum price filter"),
     limit: int = Query(20, ge=1, le=100, description="Number of products to return"),
@@ -93,10 +257,10 @@ def premium_search_products(
             "message": "This premium search endpoint requires payment via x402 delegation token",
             "payment_required": True,
             "payment_details": {
-                "amount": 0.50,  # $0.50 for premium search
+                "amount": PREMIUM_SEARCH_PRICE,  # $0.50 for premium search
                 "currency": "USD",
                 "payment_type": "x402_delegation",
-                "payment_facilitator_url": "http://localhost:8001",
+                "payment_facilitator_url": PAYMENT_FACILITATOR_URL,
                 "service_description": "Premium Product Search with Enhanced Features",
                 "features": [
                     "Advanced search algorithms",
@@ -111,36 +275,22 @@ def premium_search_products(
             content=payment_details
         )
     
-    # Verify delegation token with Payment Facilitator
+    # Verify delegation token with Payment Facilitator (cached while the verification is valid)
     try:
-        pf_response = requests.post(
-            "http://localhost:8001/verify-delegation",
-            json={
-                "delegation_token": delegate_token,
-                "amount": 0.50,
-                "merchant_id": "merchant_123",
-                "service": "premium_search"
-            },
-            timeout=5
+        verification_result = await facilitator_client.verify_delegation(
+            delegate_token,
+            amount=PREMIUM_SEARCH_PRICE,
+            merchant_id="merchant_123",
+            service="premium_search"
         )
-        
-        if pf_response.status_code != 200:
-            logger.error(f"Payment Facilitator verification failed: {pf_response.status_code}")
-            raise HTTPException(
-                status_code=402, 
-                detail="Invalid or expired delegation token"
-            )
-            
-        verification_result = pf_response.json()
-        if not verification_result.get("valid", False):
-            raise HTTPException(
-                status_code=402, 
-                detail="Delegation token verification failed"
-            )
-            
         logger.info(f"✅ Delegation token verified for premium search: {verification_result}")
         
-    except requests.RequestException as e:
+    except DelegationRejected as e:
+        raise HTTPException(
+            status_code=402, 
+            detail=str(e)
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
         logger.error(f"Failed to verify delegation token: {e}")
         raise HTTPException(
             status_code=502, 
@@ -150,41 +300,11 @@ def premium_search_products(
     # Token verified, proceed with premium search
     logger.info(f"🔍 Premium search authorized for query: '{query}'")
     
-    # Build enhanced query with premium features
-    filters = []
-    
-    if query:
-        # Enhanced search with stemming and fuzzy matching (premium feature)
-        filters.append(
-            or_(
-                ProductModel.name.ilike(f"%{query}%"),
-                ProductModel.description.ilike(f"%{query}%"),
-                ProductModel.category.ilike(f"%{query}%")  # Also search in category
-            )
-        )
-    
-    if category:
-        filters.append(ProductModel.category.ilike(f"%{category}%"))
-    
-    if min_price is not None:
-        filters.append(ProductModel.price >= min_price)
-    
-    if max_price is not None:
-        filters.append(ProductModel.price <= max_price)
-    
-    # Apply filters with premium sorting
-    query_obj = db.query(ProductModel)
-    if filters:
-        query_obj = query_obj.filter(and_(*filters))
-    
-    # Premium feature: Sort by relevance and popularity
-    query_obj = query_obj.order_by(ProductModel.stock_quantity.desc(), ProductModel.price.asc())
-    
-    # Get total count
-    total = query_obj.count()
-    
-    # Apply pagination
-    products = query_obj.offset(offset).limit(limit).all()
+    started = time.perf_counter()
+    products, total, scores = await run_in_threadpool(
+        _premium_search, db, query, category, category_prefix, min_price, max_price, limit, offset
+    )
+    search_time_ms = (time.perf_counter() - started) * 1000
     
     # Premium response with enhanced data
     return {
@@ -201,8 +321,8 @@ def premium_search_products(
         "search_analytics": {
             "query_processed": query,
             "results_found": len(products),
-            "search_time_ms": 45,  # Simulated faster response
-            "relevance_score": 0.95
+            "search_time_ms": round(search_time_ms, 2),
+            "relevance_score": round(max(scores), 4) if scores else None
         }
     }
 
@@ -7,6 +7,7 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 # Standard library imports
+import asyncio
 import json
 import base64
 import os
@@ -18,8 +19,9 @@ import requests
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 
+from app.services.solana_rpc import blockhash_prefetcher, solana_rpc_pool
+
 # Solana imports (lazy loaded in functions)
-# from solana.rpc.api import Client
 # from solders.keypair import Keypair
 # from solders.pubkey import Pubkey
 # from solders.transaction import Transaction
@@ -30,8 +32,6 @@ router = APIRouter()
 # Constants
 CLIENT_JSON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '..', 'client.json')
 SIENNA_API_BASE = "https://api.projectsienna.xyz"
-SOLANA_MAINNET_RPC = "https://api.mainnet-beta.solana.com"
-SOLANA_DEVNET_RPC = "https://api.devnet.solana.com"
 
 # Pydantic models
 class SiennaPaymentRequest(BaseModel):
@@ -56,6 +56,44 @@ def get_quote_url(amount: float, network: Optional[str] = None) -> str:
         return f"{SIENNA_API_BASE}/api/payment?network={network}&amount={amount}"
     return f"{SIENNA_API_BASE}/api/payment?amount={amount}"
 
+async def latest_blockhash(connection):
+    """(blockhash, last_valid_block_height) read from `connection`"""
+    response = await connection.get_latest_blockhash()
+    return response.value.blockhash, response.value.last_valid_block_height
+
+async def preflight_reads(connection, payer_token_account, recipient_token_account, recent_blockhash=None):
+    """
+    Read the payer's token balance and the recipient token account concurrently
+    on a Solana AsyncClient, together with a recent blockhash: `recent_blockhash`
+    if given (an awaitable of (blockhash, last_valid_block_height), e.g. from the
+    prefetcher), otherwise read from `connection`.
+    Returns (payer balance or None if the payer token account can't be read,
+    whether the recipient token account exists, (blockhash, last_valid_block_height)).
+    """
+    balance_response, account_response, blockhash = await asyncio.gather(
+        connection.get_token_account_balance(payer_token_account),
+        connection.get_account_info(recipient_token_account),
+        recent_blockhash if recent_blockhash is not None else latest_blockhash(connection),
+        return_exceptions=True
+    )
+    if isinstance(blockhash, BaseException):
+        raise blockhash
+    
+    balance_info = None
+    if isinstance(balance_response, BaseException):
+        print(f"  ⚠️ Could not check payer balance: {balance_response}")
+    else:
+        # RPC error replies (e.g. no such account) carry no value
+        balance_info = getattr(balance_response, "value", None)
+    
+    recipient_account_exists = False
+    if isinstance(account_response, BaseException):
+        print(f"  ⚠️ Could not check recipient account: {account_response}")
+    else:
+        recipient_account_exists = bool(getattr(account_response, "value", None))
+    
+    return balance_info, recipient_account_exists, blockhash
+
 def get_explorer_url(signature: str, network: str) -> str:
     """Generate Solana explorer URL for a transaction"""
     cluster_param = "" if network == "mainnet" else "?cluster=devnet"
@@ -127,7 +165,6 @@ async def execute_sienna_payment(payment_request: SiennaPaymentRequest):
         
         try:
             # Import Solana libraries (lazy import for better startup time)
-            from solana.rpc.api import Client
             from solders.keypair import Keypair
             from solders.pubkey import Pubkey
             from solders.transaction import Transaction
@@ -141,11 +178,10 @@ async def execute_sienna_payment(payment_request: SiennaPaymentRequest):
                 create_idempotent_associated_token_account,
             )
             
-            # Create connection based on cluster from API response
+            # Borrow a pooled connection for the cluster from the API response
             api_cluster = extra.get('cluster', 'mainnet')
             actual_network = api_cluster
-            rpc_url = SOLANA_MAINNET_RPC if actual_network == "mainnet" else SOLANA_DEVNET_RPC
-            connection = Client(rpc_url, "confirmed")
+            connection = solana_rpc_pool.client(actual_network)
             print(f"  Connected to Solana {actual_network}")
             
             # Create payer keypair from client.json
@@ -166,55 +202,36 @@ async def execute_sienna_payment(payment_request: SiennaPaymentRequest):
             print(f"  Recipient: {recipient_token_account}")
             print(f"  Amount: {amount_required} smallest units")
             
-            # Get or create payer's associated token account (following client-1-usdc.ts)
-            print(f"\n  Checking/creating payer token account...")
-            
-            # Get associated token address
+            # Pre-flight reads are independent: issue them together, one round trip on the critical path.
+            # The blockhash normally comes from memory, kept warm by the prefetcher.
             payer_token_account = get_associated_token_address(payer.pubkey(), mint)
             print(f"  Payer Token Account: {payer_token_account}")
+            print(f"\n  Checking payer balance and recipient token account...")
+            balance_info, recipient_account_exists, (recent_blockhash, last_valid_block_height) = await preflight_reads(
+                connection, payer_token_account, recipient_token_account,
+                recent_blockhash=blockhash_prefetcher.latest(actual_network)
+            )
             
-            # Check if account exists - always try to create it idempotently
-            # The create_idempotent instruction will only create if it doesn't exist
-            payer_account_exists = False
-            try:
-                balance_info = connection.get_token_account_balance(payer_token_account)
-                if balance_info.value:
-                    payer_account_exists = True
-                    print(f"  ✅ Payer token account exists for this mint")
-                else:
-                    print(f"  ⚠️ Payer token account doesn't exist, will create it")
-            except Exception as e:
-                print(f"  ⚠️ Payer token account doesn't exist, will create it")
-            
-            # Check if payer has enough USDC
-            try:
-                balance_info = connection.get_token_account_balance(payer_token_account)
-                balance = int(balance_info.value.amount)
-                balance_ui = float(balance_info.value.ui_amount_string)
+            # The create_idempotent instruction is only needed if the payer token account doesn't exist
+            payer_account_exists = balance_info is not None
+            if payer_account_exists:
+                print(f"  ✅ Payer token account exists for this mint")
+                balance = int(balance_info.amount)
+                balance_ui = float(balance_info.ui_amount_string)
                 print(f"  Current Balance: {balance_ui} USDC")
                 
                 if balance < amount_required:
                     print(f"  ⚠️ Insufficient balance: Have {balance_ui} USDC, Need {extra['amountUSDC']} USDC")
-            except Exception as e:
-                print(f"  ⚠️ Could not check balance (account may not exist yet): {e}")
+            else:
+                print(f"  ⚠️ Payer token account doesn't exist, will create it")
             
-            # Check if recipient token account exists
-            print(f"\n  Checking recipient token account...")
-            recipient_account_exists = False
-            try:
-                account_info = connection.get_account_info(recipient_token_account)
-                if account_info.value:
-                    recipient_account_exists = True
-                    print(f"  ✅ Recipient token account exists")
-                else:
-                    print(f"  ⚠️ Recipient token account doesn't exist")
-            except Exception as e:
-                print(f"  ⚠️ Could not check recipient account: {e}")
+            if recipient_account_exists:
+                print(f"  ✅ Recipient token account exists")
+            else:
+                print(f"  ⚠️ Recipient token account doesn't exist")
             
             # Build transaction (following client-1-usdc.ts exactly)
             print(f"\n  Building transaction...")
-            recent_blockhash_response = connection.get_latest_blockhash()
-            recent_blockhash = recent_blockhash_response.value.blockhash
             instructions = []
             
             # Add create payer account instruction if needed
@@ -268,13 +285,15 @@ async def execute_sienna_payment(payment_request: SiennaPaymentRequest):
             print(f"\n📤 Submitting transaction to Solana {network}...")
             try:
                 # Send the transaction
-                tx_response = connection.send_raw_transaction(bytes(tx))
+                tx_response = await connection.send_raw_transaction(bytes(tx))
                 signature = tx_response.value
                 print(f"  ✅ Transaction submitted: {signature}")
                 
-                # Wait for confirmation
+                # Wait for confirmation; past the blockhash's last valid height it can no longer land
                 print(f"  ⏳ Waiting for confirmation...")
-                connection.confirm_transaction(signature, commitment="confirmed")
+                await connection.confirm_transaction(
+                    signature, commitment="confirmed", last_valid_block_height=last_valid_block_height
+                )
                 print(f"  ✅ Transaction confirmed!")
                 
                 # Create explorer URL
@@ -297,6 +316,8 @@ async def execute_sienna_payment(payment_request: SiennaPaymentRequest):
                 
             except Exception as submit_error:
                 print(f"  ⚠️ Transaction submission failed: {submit_error}")
+                if "blockhash" in str(submit_error).lower():
+                    blockhash_prefetcher.invalidate(actual_network)
                 print(f"  Falling back to simulation for testing...")
                 
                 # Fallback to simulation if submission fails
@@ -6,9 +6,9 @@
 #
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional
+from datetime import date, datetime
 
 # Product schemas
 class ProductBase(BaseModel):
@@ -25,6 +25,8 @@ class ProductCreate(ProductBase):
 class Product(ProductBase):
     id: int
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    version: int = 0
     
     class Config:
         from_attributes = True
@@ -40,6 +42,15 @@ class CartItemCreate(CartItemBase):
 class CartItemUpdate(BaseModel):
     quantity: int
 
+class CartItemOperation(BaseModel):
+    """One step of a batch cart update: add to, set, or remove a product's quantity"""
+    op: Literal["add", "set", "remove"]
+    product_id: int
+    quantity: int = 1
+
+class CartItemBatch(BaseModel):
+    operations: List[CartItemOperation] = Field(..., min_length=1, max_length=500)
+
 class CartItem(CartItemBase):
     id: int
     product: Product
@@ -202,6 +213,44 @@ class OrderList(BaseModel):
     orders: List[Order]
     total: int
 
+class OrderStatusUpdate(BaseModel):
+    order_number: str
+    status: str
+
+class OrderStatusBulkRequest(BaseModel):
+    updates: List[OrderStatusUpdate] = Field(..., min_length=1, max_length=10000)
+
+class OrderStatusOutcome(BaseModel):
+    """Result for one order: updated, unchanged, not_found, invalid_status, invalid_transition, duplicate or conflict"""
+    order_number: str
+    result: str
+    previous_status: Optional[str] = None
+    status: Optional[str] = None
+    detail: Optional[str] = None
+
+class OrderStatusBulkResponse(BaseModel):
+    updated: int
+    results: List[OrderStatusOutcome]
+
+# Analytics schemas
+class SalesRollupRow(BaseModel):
+    day: date
+    product_id: Optional[int] = None
+    payment_method: Optional[str] = None
+    orders: int
+    units: Optional[int] = None
+    revenue: float
+
+class SalesSummary(BaseModel):
+    group_by: str
+    date_from: date
+    date_to: date
+    rows: List[SalesRollupRow]
+    revenue: float
+    orders: Optional[int] = None  # only when grouped by payment method, where each order is counted once
+    as_of_event_id: Optional[int] = None  # last order event folded in; None until the first rollup run
+    pending_events: int
+
 # Message schemas
 class Message(BaseModel):
     message: str
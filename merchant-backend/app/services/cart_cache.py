@@ -0,0 +1,122 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Serialized cart reads, cached per session id.
+
+Each read first fetches the cart's version from the database: the cart row's
+own version, bumped by every change to it or its items (touch_cart), and the
+catalog version, which moves with every product change. Both come from one
+primary key read, so an unchanged cart is served without touching its items.
+Changes committed by any worker, to the cart or to a product, are never served
+stale; the price is that any catalog change refreshes every cached cart.
+Mutations in this process also invalidate their session once committed.
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, selectinload
+
+from app.models.models import Cart as CartModel, CartItem as CartItemModel, CatalogSequence as CatalogSequenceModel
+from app.schemas import Cart
+from app.services.catalog import CatalogCache
+
+CART_CACHE_MAX_ENTRIES = int(os.getenv("CART_CACHE_MAX_ENTRIES", "10000"))
+
+class CartCache:
+    """
+    JSON cart payloads keyed by session id.
+    A read that overlapped an invalidation does not fill the cache, so a
+    payload loaded before a commit cannot outlive it.
+    """
+    
+    def __init__(self, max_entries: int = CART_CACHE_MAX_ENTRIES):
+        self._entries = CatalogCache(max_entries)
+        self._epoch = 0
+        self._lock = threading.Lock()
+    
+    def get(self, session_id: str, version: tuple) -> Optional[bytes]:
+        return self._entries.get(session_id, version)
+    
+    def snapshot(self, version: tuple) -> Tuple[tuple, int]:
+        """Take before loading a cart, with the version read beforehand; pass to fill() afterwards"""
+        return version, self._epoch
+    
+    def fill(self, session_id: str, snapshot: Tuple[tuple, int], payload: bytes):
+        version, epoch = snapshot
+        with self._lock:
+            if epoch == self._epoch:
+                self._entries.set(session_id, version, payload)
+    
+    def invalidate(self, session_ids: Iterable[str]):
+        with self._lock:
+            self._epoch += 1
+            for session_id in session_ids:
+                self._entries.discard(session_id)
+    
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+cart_cache = CartCache()
+
+def touch_cart(cart: CartModel):
+    """Record activity on `cart` and bump its version; call with every change to the cart or its items"""
+    cart.updated_at = datetime.utcnow()
+    cart.version = CartModel.version + 1
+
+def mark_cart_changed(session: Session, session_id: str):
+    """Invalidate the cached cart for `session_id` when `session` commits"""
+    session.info.setdefault("cart_changes", set()).add(session_id)
+
+@event.listens_for(Session, "after_commit")
+def _publish_cart_changes(session):
+    changed = session.info.pop("cart_changes", None)
+    if changed:
+        cart_cache.invalidate(changed)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cart_changes(session):
+    session.info.pop("cart_changes", None)
+
+def load_cart(db: Session, session_id: str) -> Optional[CartModel]:
+    """Cart with its items and their products, loaded up front"""
+    return db.query(CartModel).options(
+        selectinload(CartModel.items).selectinload(CartItemModel.product)
+    ).filter(CartModel.session_id == session_id).first()
+
+def cart_version(db: Session, session_id: str) -> Optional[tuple]:
+    """The cart's version with the catalog version, by one indexed read; None if there is no such cart"""
+    carts, sequence = CartModel.__table__, CatalogSequenceModel.__table__
+    catalog_version = select(sequence.c.value).where(sequence.c.id == 1).scalar_subquery()
+    row = db.execute(
+        select(carts.c.version, catalog_version).where(carts.c.session_id == session_id)
+    ).first()
+    return tuple(row) if row is not None else None
+
+def read_cart(db: Session, session_id: str) -> Optional[bytes]:
+    """The cart serialized as the Cart schema's JSON, from cache when unchanged"""
+    version = cart_version(db, session_id)
+    if version is None:
+        return None
+    payload = cart_cache.get(session_id, version)
+    if payload is not None:
+        return payload
+    
+    snapshot = cart_cache.snapshot(version)
+    cart = load_cart(db, session_id)
+    if cart is None:
+        return None
+    payload = Cart.model_validate(cart).model_dump_json().encode()
+    cart_cache.fill(session_id, snapshot, payload)
+    return payload
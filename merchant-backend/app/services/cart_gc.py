@@ -0,0 +1,157 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, select
+from sqlalchemy.orm import Session
+
+from app.models.models import Cart as CartModel, CartItem as CartItemModel
+from app.services.cart_cache import mark_cart_changed
+
+logger = logging.getLogger(__name__)
+
+CART_IDLE_HOURS = float(os.getenv("CART_IDLE_HOURS", "168"))
+CART_GC_INTERVAL = float(os.getenv("CART_GC_INTERVAL", "600"))
+CART_GC_BATCH = int(os.getenv("CART_GC_BATCH", "200"))
+# Upper bound on rows deleted per second, so collection never crowds out checkout writes
+CART_GC_MAX_ROWS_PER_SECOND = float(os.getenv("CART_GC_MAX_ROWS_PER_SECOND", "2000"))
+
+def delete_idle_carts(db: Session, cutoff: datetime, batch_size: int) -> Tuple[int, int]:
+    """
+    Delete up to `batch_size` carts idle since before `cutoff`, with their items.
+    Returns (carts, items) deleted. The caller commits.
+    
+    Items go first so the cart_items foreign key holds on every backend, and the
+    ids are fetched up front because MySQL rejects a LIMIT inside IN (...).
+    """
+    carts = CartModel.__table__
+    items = CartItemModel.__table__
+    idle_ids = db.execute(
+        select(carts.c.id).where(carts.c.updated_at < cutoff)
+        .order_by(carts.c.updated_at).limit(batch_size).with_for_update()
+    ).scalars().all()
+    if not idle_ids:
+        return 0, 0
+    
+    # Re-check the cutoff in both DELETEs, so a cart touched meanwhile survives with its items
+    still_idle = and_(carts.c.id.in_(idle_ids), carts.c.updated_at < cutoff)
+    item_count = db.execute(
+        delete(items).where(items.c.cart_id.in_(select(carts.c.id).where(still_idle)))
+    ).rowcount
+    deleted = db.execute(
+        delete(carts).where(still_idle).returning(carts.c.id, carts.c.session_id)
+    ).all()
+    for _, session_id in deleted:
+        mark_cart_changed(db, session_id)
+    return len(deleted), item_count
+
+class CartCollector:
+    """
+    Background job that deletes abandoned carts.
+    Each batch is its own short transaction, and batches are paced to stay
+    under max_rows_per_second.
+    """
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        idle_after: timedelta = timedelta(hours=CART_IDLE_HOURS),
+        interval: float = CART_GC_INTERVAL,
+        batch_size: int = CART_GC_BATCH,
+        max_rows_per_second: float = CART_GC_MAX_ROWS_PER_SECOND,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.session_factory = session_factory
+        self.idle_after = idle_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self.sleep = sleep
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "runs": 0,
+            "batches": 0,
+            "carts_deleted": 0,
+            "cart_items_deleted": 0,
+            "last_run_at": None,
+            "last_run_seconds": None,
+            "last_run_carts_deleted": 0,
+        }
+    
+    def metrics(self) -> Dict:
+        with self._metrics_lock:
+            return dict(self._metrics)
+    
+    def _pace(self, rows: int, elapsed: float):
+        if self.max_rows_per_second <= 0:
+            return
+        delay = rows / self.max_rows_per_second - elapsed
+        if delay > 0:
+            self.sleep(delay)
+    
+    def run_once(self) -> Tuple[int, int]:
+        """Collect every cart that is idle now; returns (carts, items) deleted"""
+        started = time.monotonic()
+        cutoff = datetime.utcnow() - self.idle_after
+        total_carts = total_items = batches = 0
+        
+        while not self._stop.is_set():
+            batch_started = time.monotonic()
+            db = self.session_factory()
+            try:
+                carts, items = delete_idle_carts(db, cutoff, self.batch_size)
+                db.commit()
+            finally:
+                db.close()
+            if carts:
+                batches += 1
+                total_carts += carts
+                total_items += items
+            if carts < self.batch_size:
+                break
+            self._pace(carts + items, time.monotonic() - batch_started)
+        
+        with self._metrics_lock:
+            self._metrics["runs"] += 1
+            self._metrics["batches"] += batches
+            self._metrics["carts_deleted"] += total_carts
+            self._metrics["cart_items_deleted"] += total_items
+            self._metrics["last_run_at"] = datetime.utcnow().isoformat()
+            self._metrics["last_run_seconds"] = round(time.monotonic() - started, 3)
+            self._metrics["last_run_carts_deleted"] = total_carts
+        if total_carts:
+            logger.info(f"🧹 Collected {total_carts} abandoned carts ({total_items} items) in {batches} batches")
+        return total_carts, total_items
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Abandoned cart collection failed: {e}")
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cart-collector", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,74 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    Cart as CartModel,
+    CartItem as CartItemModel,
+    Product as ProductModel
+)
+
+
+def price_cart(db: Session, session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a cart, its line items and their current product data in one query.
+    
+    Returns None if the cart does not exist, otherwise a dict with the cart id,
+    a `lines` snapshot (product fields, quantity, unit and line totals) and the
+    subtotal. Callers never touch CartItem.product, so there are no per-item
+    lazy loads.
+    """
+    rows = db.execute(
+        select(
+            CartModel.id.label("cart_id"),
+            CartItemModel.id.label("item_id"),
+            CartItemModel.product_id,
+            CartItemModel.quantity,
+            ProductModel.name,
+            ProductModel.price,
+            ProductModel.description,
+            ProductModel.image_url,
+            ProductModel.stock_quantity
+        )
+        .select_from(CartModel)
+        .outerjoin(CartItemModel, CartItemModel.cart_id == CartModel.id)
+        .outerjoin(ProductModel, ProductModel.id == CartItemModel.product_id)
+        .where(CartModel.session_id == session_id)
+        .order_by(CartItemModel.id)
+    ).all()
+    
+    if not rows:
+        return None
+    
+    lines: List[Dict[str, Any]] = []
+    for row in rows:
+        if row.item_id is None or row.price is None:
+            # Empty cart, or an item whose product no longer exists
+            continue
+        lines.append({
+            "item_id": row.item_id,
+            "product_id": row.product_id,
+            "product_name": row.name,
+            "quantity": row.quantity,
+            "unit_price": row.price,
+            "total_price": row.price * row.quantity,
+            "description": row.description,
+            "image_url": row.image_url,
+            "stock_quantity": row.stock_quantity
+        })
+    
+    return {
+        "cart_id": rows[0].cart_id,
+        "session_id": session_id,
+        "lines": lines,
+        "subtotal": sum(line["total_price"] for line in lines)
+    }
@@ -0,0 +1,203 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Catalog-wide helpers: change tracking, the incremental sync feed and facet aggregation.
+"""
+
+import heapq
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+
+from sqlalchemy import and_, case, cast, func, Integer, select
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    Product as ProductModel,
+    Category as CategoryModel,
+    ProductTombstone as ProductTombstoneModel,
+    CatalogSequence as CatalogSequenceModel
+)
+
+class CatalogCache:
+    """
+    Small LRU cache whose entries are only valid for the catalog version they were
+    built at. Versions come from the shared catalog sequence (current_catalog_version),
+    so a product change committed by any worker invalidates every worker's entries.
+    """
+    
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key: Hashable, version: int, value: Any):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+facet_cache = CatalogCache()
+
+def compute_facets(db: Session, filters: List, bucket_size: float) -> Dict[str, Any]:
+    """
+    Aggregate category counts, a price histogram and stock availability in one
+    grouped query, then fold the (small) grouped result set in Python.
+    """
+    bucket = cast(ProductModel.price / bucket_size, Integer).label("bucket")
+    in_stock = case((ProductModel.stock_quantity > 0, 1), else_=0).label("in_stock")
+    
+    statement = (
+        select(
+            CategoryModel.id,
+            CategoryModel.display_name,
+            bucket,
+            in_stock,
+            func.count().label("count"),
+            func.min(ProductModel.price),
+            func.max(ProductModel.price),
+        )
+        .select_from(ProductModel)
+        .outerjoin(CategoryModel, ProductModel.category_id == CategoryModel.id)
+        .group_by(CategoryModel.id, CategoryModel.display_name, bucket, in_stock)
+    )
+    if filters:
+        statement = statement.where(and_(*filters))
+    
+    categories: Dict[Optional[int], Dict[str, Any]] = {}
+    histogram: Dict[int, int] = {}
+    availability = {"in_stock": 0, "out_of_stock": 0}
+    total = 0
+    min_price = None
+    max_price = None
+    
+    for category_id, display_name, bucket_index, stocked, count, group_min, group_max in db.execute(statement):
+        total += count
+        
+        category = categories.setdefault(
+            category_id, {"id": category_id, "name": display_name, "count": 0}
+        )
+        category["count"] += count
+        
+        histogram[bucket_index] = histogram.get(bucket_index, 0) + count
+        availability["in_stock" if stocked else "out_of_stock"] += count
+        
+        min_price = group_min if min_price is None else min(min_price, group_min)
+        max_price = group_max if max_price is None else max(max_price, group_max)
+    
+    return {
+        "total": total,
+        "categories": sorted(categories.values(), key=lambda c: (-c["count"], c["name"] or "")),
+        "price_histogram": [
+            {
+                "min": round(index * bucket_size, 2),
+                "max": round((index + 1) * bucket_size, 2),
+                "count": histogram[index]
+            }
+            for index in sorted(histogram)
+        ],
+        "availability": availability,
+        "price_range": {"min": min_price, "max": max_price},
+        "bucket_size": bucket_size,
+    }
+
+CHANGE_FEED_COLUMNS = (
+    ProductModel.id,
+    ProductModel.name,
+    ProductModel.description,
+    ProductModel.price,
+    ProductModel.category,
+    ProductModel.image_url,
+    ProductModel.stock_quantity,
+    ProductModel.updated_at,
+    ProductModel.version,
+)
+
+def current_catalog_version(db: Session) -> int:
+    """Latest catalog version handed out"""
+    value = db.execute(
+        select(CatalogSequenceModel.value).where(CatalogSequenceModel.id == 1)
+    ).scalar()
+    return value or 0
+
+def _dumps(payload: dict) -> str:
+    return json.dumps(payload, separators=(",", ":"), default=str) + "\n"
+
+def iter_catalog_changes(
+    session_factory: Callable[[], Session],
+    since: int,
+    limit: int,
+    batch_size: int = 500
+) -> Iterator[str]:
+    """
+    Yield NDJSON lines for products changed or deleted after `since`, in
+    version order, followed by a checkpoint line carrying the version to
+    resume from. Rows are streamed from server-side cursors in batches.
+    """
+    db = session_factory()
+    try:
+        upserts = db.execute(
+            select(*CHANGE_FEED_COLUMNS)
+            .where(ProductModel.version > since)
+            .order_by(ProductModel.version)
+            .limit(limit)
+            .execution_options(yield_per=batch_size)
+        )
+        deletes = db.execute(
+            select(ProductTombstoneModel.product_id, ProductTombstoneModel.version)
+            .where(ProductTombstoneModel.version > since)
+            .order_by(ProductTombstoneModel.version)
+            .limit(limit)
+            .execution_options(yield_per=batch_size)
+        )
+        
+        changes = heapq.merge(
+            ((row.version, "upsert", row) for row in upserts),
+            ((row.version, "delete", row) for row in deletes),
+            key=lambda change: change[0]
+        )
+        
+        checkpoint = since
+        emitted = 0
+        for version, op, row in changes:
+            if emitted == limit:
+                break
+            if op == "upsert":
+                product = row._asdict()
+                product["updated_at"] = product["updated_at"].isoformat() if product["updated_at"] else None
+                yield _dumps({"op": "upsert", "version": version, "product": product})
+            else:
+                yield _dumps({"op": "delete", "version": version, "id": row.product_id})
+            checkpoint = version
+            emitted += 1
+        
+        yield _dumps({"op": "checkpoint", "version": checkpoint, "has_more": emitted == limit})
+    finally:
+        db.close()
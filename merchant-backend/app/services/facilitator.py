@@ -0,0 +1,171 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+from app.services.http_client import ServiceClient, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_FACILITATOR_URL = os.getenv("X402_FACILITATOR_URL", "http://localhost:8001")
+# Used when the facilitator does not report how long a verification stays valid
+DELEGATION_CACHE_TTL = float(os.getenv("DELEGATION_CACHE_TTL", "60"))
+DELEGATION_CACHE_MAX_TTL = float(os.getenv("DELEGATION_CACHE_MAX_TTL", "900"))
+# Total time a settlement may take, including retries of attempts that never reached the facilitator
+X402_SETTLE_DEADLINE = float(os.getenv("X402_SETTLE_DEADLINE", "15"))
+
+class DelegationRejected(Exception):
+    """The facilitator answered but did not accept the delegation token"""
+
+class SettlementDeclined(Exception):
+    """The facilitator answered but refused to settle the payment"""
+
+def _json_object(response: httpx.Response) -> dict:
+    """The response's JSON object body; a body that is not one is an upstream failure (httpx.DecodingError)"""
+    try:
+        body = response.json()
+    except ValueError as e:
+        raise httpx.DecodingError(f"Facilitator returned a non-JSON body: {e}", request=response.request)
+    if not isinstance(body, dict):
+        raise httpx.DecodingError("Facilitator returned JSON that is not an object", request=response.request)
+    return body
+
+def _validity_seconds(verification: dict) -> float:
+    """Seconds a positive verification may be reused, from the facilitator's expires_at if given"""
+    expires_at = verification.get("expires_at")
+    ttl = DELEGATION_CACHE_TTL
+    if expires_at:
+        try:
+            if isinstance(expires_at, (int, float)):
+                expiry = float(expires_at)
+            else:
+                parsed = datetime.fromisoformat(str(expires_at).replace("Z", "+00:00"))
+                if parsed.tzinfo is None:
+                    parsed = parsed.replace(tzinfo=timezone.utc)
+                expiry = parsed.timestamp()
+            ttl = expiry - time.time()
+        except ValueError:
+            logger.warning(f"Unparseable delegation expires_at: {expires_at}")
+    return max(0.0, min(ttl, DELEGATION_CACHE_MAX_TTL))
+
+class FacilitatorClient:
+    """Client for the x402 Payment Facilitator"""
+    
+    def __init__(self, service: ServiceClient, max_cached_verifications: int = 10_000):
+        self.service = service
+        self.max_cached_verifications = max_cached_verifications
+        self._verifications: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _cached_verification(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            entry = self._verifications.get(key)
+            if entry is None:
+                return None
+            expires_at, verification = entry
+            if expires_at <= time.monotonic():
+                del self._verifications[key]
+                return None
+            return verification
+    
+    def _cache_verification(self, key: tuple, verification: dict):
+        ttl = _validity_seconds(verification)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._verifications[key] = (time.monotonic() + ttl, verification)
+            while len(self._verifications) > self.max_cached_verifications:
+                self._verifications.popitem(last=False)
+    
+    async def verify_delegation(self, delegation_token: str, amount: float, merchant_id: str, service: str) -> dict:
+        """
+        Verify a delegation token, reusing a cached positive verification while it is valid.
+        Raises DelegationRejected when the token is not accepted, and
+        httpx.HTTPError / CircuitOpenError when the facilitator is unreachable
+        or its answer is unreadable.
+        """
+        key = (delegation_token, amount, merchant_id, service)
+        cached = self._cached_verification(key)
+        if cached is not None:
+            return cached
+        
+        response = await self.service.post(
+            "/verify-delegation",
+            json={
+                "delegation_token": delegation_token,
+                "amount": amount,
+                "merchant_id": merchant_id,
+                "service": service
+            },
+            idempotent=True  # read-only check, safe to retry
+        )
+        
+        if response.status_code >= 500:
+            # Upstream failure, not a verdict on the token
+            response.raise_for_status()
+        
+        if response.status_code != 200:
+            logger.error(f"Payment Facilitator verification failed: {response.status_code}")
+            raise DelegationRejected("Invalid or expired delegation token")
+        
+        verification = _json_object(response)
+        if not verification.get("valid", False):
+            raise DelegationRejected("Delegation token verification failed")
+        
+        self._cache_verification(key, verification)
+        return verification
+    
+    async def settle(self, settlement_request: dict, idempotency_key: Optional[str] = None) -> dict:
+        """
+        Settle an x402 payment and return the facilitator's settlement.
+        Only attempts that never reached the facilitator are retried, so a payment
+        is not settled twice. Raises SettlementDeclined when the facilitator refuses,
+        and httpx.HTTPError / CircuitOpenError when it is unreachable.
+        """
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        response = await self.service.post(
+            "/x402/settle",
+            json=settlement_request,
+            headers=headers,
+            deadline=X402_SETTLE_DEADLINE,
+            idempotent=False
+        )
+        
+        if response.status_code >= 500:
+            response.raise_for_status()
+        
+        if response.status_code != 200:
+            logger.error(f"Payment Facilitator settlement failed: {response.status_code}")
+            raise SettlementDeclined(response.text)
+        
+        return _json_object(response)
+    
+    def clear_cache(self):
+        with self._lock:
+            self._verifications.clear()
+    
+    async def aclose(self):
+        await self.service.aclose()
+
+facilitator_client = FacilitatorClient(
+    ServiceClient(
+        PAYMENT_FACILITATOR_URL,
+        timeout=float(os.getenv("X402_FACILITATOR_TIMEOUT", "5")),
+        deadline=float(os.getenv("X402_FACILITATOR_DEADLINE", "10")),
+        retries=int(os.getenv("X402_FACILITATOR_RETRIES", "2")),
+        breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+    )
+)
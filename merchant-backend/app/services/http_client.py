@@ -0,0 +1,219 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the upstream circuit is open"""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed -> open after `failure_threshold` failures; after `reset_timeout`
+    seconds a single trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+    
+    def release(self):
+        """Give up a half-open trial slot without recording an outcome (e.g. cancellation)"""
+        self._trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class ServiceClient:
+    """
+    Process-wide async HTTP client for one upstream service.
+    Connections are pooled and kept alive across requests; every call goes
+    through the circuit breaker so a dead upstream fails fast.
+    
+    Each call has a deadline covering all of its attempts. Failed attempts are
+    retried with exponentially growing, fully jittered pauses: requests that
+    never reached the upstream (connect errors) always, anything else only
+    when the call is idempotent.
+    """
+    
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+    
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        deadline: Optional[float] = None,
+        retries: int = 0,
+        backoff_base: float = 0.1,
+        backoff_max: float = 2.0,
+    ):
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self.transport = transport
+        self.deadline = deadline if deadline is not None else timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self.transport
+            )
+        return self._client
+    
+    def _attempt_timeout(self, remaining: float, idempotent: bool) -> httpx.Timeout:
+        """
+        Timeouts for one attempt. Idempotent attempts keep the client's timeout so
+        a slow one leaves time for a retry; other attempts are not retried once they
+        reach the upstream, so they wait for the answer until the call's deadline.
+        """
+        connect = min(self.timeout.connect, remaining)
+        if idempotent:
+            return httpx.Timeout(min(self.timeout.read, remaining), connect=connect)
+        return httpx.Timeout(remaining, connect=connect)
+    
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    async def _attempt(self, method: str, path: str, **kwargs) -> httpx.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.base_url}")
+        
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+    
+    async def request(
+        self,
+        method: str,
+        path: str,
+        deadline: Optional[float] = None,
+        retries: Optional[int] = None,
+        idempotent: Optional[bool] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """
+        Send a request, raising CircuitOpenError or httpx.HTTPError on failure.
+        A 5xx response is returned once retries are exhausted.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        retries = self.retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        give_up_at = time.monotonic() + deadline
+        
+        attempt = 0
+        while True:
+            remaining = give_up_at - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                response = await asyncio.wait_for(
+                    self._attempt(method, path, timeout=self._attempt_timeout(remaining, idempotent), **kwargs),
+                    remaining
+                )
+            except asyncio.TimeoutError:
+                # wait_for cancelled the attempt, which only released the breaker
+                if remaining > 0:
+                    self.breaker.record_failure()
+                error = httpx.TimeoutException(f"{method} {self.base_url}{path} exceeded its {deadline}s deadline")
+                retryable = idempotent
+                response = None
+            except httpx.TransportError as e:
+                error = e
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                response = None
+            else:
+                if response.status_code < 500 or not idempotent:
+                    return response
+                error = None
+                retryable = True
+            
+            pause = self._backoff(attempt)
+            if not retryable or attempt >= retries or time.monotonic() + pause >= give_up_at:
+                if response is not None:
+                    return response
+                raise error
+            
+            attempt += 1
+            logger.warning(f"🔁 Retrying {method} {self.base_url}{path} (attempt {attempt + 1}) in {pause:.2f}s")
+            await asyncio.sleep(pause)
+    
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+    
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+    
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,307 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.models.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+# How long a duplicate waits for the first request to finish before giving up with 409
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+# An in-progress claim older than this is treated as abandoned (e.g. the worker died)
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "120"))
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+# Keys (and their stored responses) are forgotten this long after first use
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Session.info key under which the request being served is kept
+IDEMPOTENT_REQUEST = "idempotent_request"
+
+def request_fingerprint(session_id: str, payload: Any) -> str:
+    """Stable hash of the request a key was first used with"""
+    canonical = json.dumps(
+        {"session_id": session_id, "payload": jsonable_encoder(payload)},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class OutcomePending(HTTPException):
+    """
+    The request's side effect may or may not have happened, e.g. a payment that
+    timed out after it was sent. The 202 is not stored for replay: the next retry
+    with the same key runs the request again so it can reconcile the outcome.
+    """
+    
+    def __init__(self, detail: Any):
+        super().__init__(status_code=202, detail=detail)
+
+class ClaimLost(HTTPException):
+    """
+    A retry took the claim over while this request was still running (it outlived
+    IDEMPOTENCY_LOCK_TIMEOUT). Its writes are rolled back; the retry owns the outcome.
+    """
+    
+    def __init__(self):
+        super().__init__(status_code=409, detail="A retry with this Idempotency-Key took over the request")
+
+class IdempotentRequest:
+    """
+    One request made with an Idempotency-Key.
+    
+    claim() either hands ownership to the caller (returns None) or returns the
+    stored outcome of an earlier request with the same key, waiting while that
+    request is still running. The owner must finish with complete(), defer() or
+    release().
+    Records are written in their own short transactions so the claim is visible
+    to other workers while the endpoint runs; complete() can instead join the
+    handler's transaction, so the response is stored atomically with its effect.
+    Every write is conditional on the claim still being ours.
+    """
+    
+    def __init__(self, db: Session, scope: str, key: str, fingerprint: str):
+        self.session_factory = sessionmaker(bind=db.get_bind(), autoflush=False)
+        self.scope = scope
+        self.key = key
+        self.fingerprint = fingerprint
+        # Stays the same when an abandoned or pending claim is taken over, changes after release()
+        self.claim_id: Optional[int] = None
+        # locked_at as stored when we claimed; a takeover changes it
+        self.locked_at: Optional[datetime] = None
+        self.completed = False
+    
+    def _lookup(self, session: Session) -> Optional[IdempotencyKey]:
+        return session.query(IdempotencyKey).filter(
+            IdempotencyKey.scope == self.scope,
+            IdempotencyKey.key == self.key
+        ).first()
+    
+    def _own(self, session: Session, claim_id: int):
+        self.claim_id = claim_id
+        self.locked_at = session.query(IdempotencyKey.locked_at).filter(IdempotencyKey.id == claim_id).scalar()
+    
+    def _owned(self, session: Session):
+        return session.query(IdempotencyKey).filter(
+            IdempotencyKey.id == self.claim_id,
+            IdempotencyKey.locked_at == self.locked_at
+        )
+    
+    def _try_claim(self) -> Optional[IdempotencyKey]:
+        """Insert the claim, or return the existing record if there is one"""
+        with self.session_factory() as session:
+            claim = IdempotencyKey(
+                scope=self.scope, key=self.key, fingerprint=self.fingerprint, status="in_progress"
+            )
+            session.add(claim)
+            try:
+                session.commit()
+                self._own(session, claim.id)
+                return None
+            except IntegrityError:
+                session.rollback()
+            
+            record = self._lookup(session)
+            if record is None:
+                # Released between our INSERT and SELECT; try again
+                return self._try_claim()
+            if record.fingerprint != self.fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used with a different request"
+                )
+            stale_before = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+            if record.status == "pending" or (record.status == "in_progress" and record.locked_at < stale_before):
+                # Take over a deferred or abandoned claim; the WHERE on locked_at lets only one waiter win
+                taken = session.query(IdempotencyKey).filter(
+                    IdempotencyKey.id == record.id,
+                    IdempotencyKey.locked_at == record.locked_at
+                ).update({"status": "in_progress", "locked_at": datetime.utcnow()}, synchronize_session=False)
+                session.commit()
+                if taken:
+                    if record.status == "in_progress":
+                        logger.warning(f"⚠️ Taking over abandoned idempotent request {self.scope}:{self.key}")
+                    self._own(session, record.id)
+                    return None
+            session.expunge(record)
+            return record
+    
+    def claim(self) -> Optional[IdempotencyKey]:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            record = self._try_claim()
+            if record is None or record.status == "completed":
+                return record
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still being processed"
+                )
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+    
+    def complete(self, status_code: int, body: Any, db: Optional[Session] = None):
+        """
+        Store the response for replay. Given the handler's session `db`, the record is
+        written in its transaction and the caller commits; ClaimLost if it is no longer ours.
+        """
+        values = {"status": "completed", "response_status": status_code, "response_body": json.dumps(body)}
+        if db is not None:
+            if not self._owned(db).update(values, synchronize_session=False):
+                raise ClaimLost()
+            return
+        with self.session_factory() as session:
+            self._owned(session).update(values, synchronize_session=False)
+            session.commit()
+    
+    def defer(self):
+        """Keep the claim but let the next retry take it over straight away"""
+        with self.session_factory() as session:
+            self._owned(session).update({"status": "pending"}, synchronize_session=False)
+            session.commit()
+    
+    def release(self):
+        """Drop the claim so a retry runs the request again"""
+        with self.session_factory() as session:
+            self._owned(session).delete(synchronize_session=False)
+            session.commit()
+
+def idempotent_request(db: Session) -> Optional[IdempotentRequest]:
+    """The Idempotency-Key request the handler using `db` is serving, if any"""
+    return db.info.get(IDEMPOTENT_REQUEST)
+
+def commit_with_response(db: Session, body: Any) -> Any:
+    """
+    Commit the handler's transaction together with the response a retry with the
+    same Idempotency-Key will be given, so a crash can never leave the effect
+    (e.g. a placed order) without its stored response. Returns the encoded body.
+    """
+    body = jsonable_encoder(body)
+    request = idempotent_request(db)
+    if request is not None:
+        request.complete(200, body, db)
+    db.commit()
+    if request is not None:
+        request.completed = True
+    return body
+
+def purge_expired_keys(db: Session, batch_size: int, now: Optional[datetime] = None) -> int:
+    """Forget up to `batch_size` keys older than IDEMPOTENCY_KEY_TTL_HOURS; returns how many. The caller commits."""
+    expired_before = (now or datetime.utcnow()) - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    expired_ids = [key_id for (key_id,) in db.query(IdempotencyKey.id).filter(
+        IdempotencyKey.created_at < expired_before
+    ).order_by(IdempotencyKey.created_at).limit(batch_size)]
+    if expired_ids:
+        db.query(IdempotencyKey).filter(IdempotencyKey.id.in_(expired_ids)).delete(synchronize_session=False)
+    return len(expired_ids)
+
+def _replay(record: IdempotencyKey, response: Response):
+    body = json.loads(record.response_body)
+    if record.response_status >= 400:
+        raise HTTPException(
+            status_code=record.response_status,
+            detail=body.get("detail"),
+            headers={REPLAYED_HEADER: "true"}
+        )
+    response.headers[REPLAYED_HEADER] = "true"
+    return body
+
+def _finish(
+    db: Session,
+    request: IdempotentRequest,
+    outcome: Any = None,
+    error: Optional[BaseException] = None
+):
+    """
+    Store the outcome for replay. Client errors are stored as well, so a retry
+    sees the same rejection; server errors release the key for another attempt,
+    and a pending outcome leaves it for the retry to reconcile.
+    """
+    if error is None:
+        if request.completed:
+            # Stored by commit_with_response in the handler's transaction
+            return outcome
+        body = jsonable_encoder(outcome)
+        request.complete(200, body)
+        return body
+    # Discard the failed request's uncommitted writes (and their locks) first
+    db.rollback()
+    if isinstance(error, ClaimLost):
+        pass  # the retry that took over owns the record now
+    elif isinstance(error, OutcomePending):
+        request.defer()
+    elif isinstance(error, HTTPException) and error.status_code < 500:
+        request.complete(error.status_code, {"detail": jsonable_encoder(error.detail)})
+    else:
+        request.release()
+    raise error
+
+def run_idempotent(
+    db: Session,
+    response: Response,
+    scope: str,
+    key: Optional[str],
+    fingerprint: str,
+    handler: Callable[[], Any]
+):
+    """Run a sync endpoint body at most once per Idempotency-Key"""
+    if not key:
+        return handler()
+    
+    request = IdempotentRequest(db, scope, key, fingerprint)
+    record = request.claim()
+    if record is not None:
+        logger.info(f"🔁 Replaying idempotent response for {scope}:{key}")
+        return _replay(record, response)
+    
+    db.info[IDEMPOTENT_REQUEST] = request
+    try:
+        outcome = handler()
+    except BaseException as error:
+        _finish(db, request, error=error)
+    finally:
+        db.info.pop(IDEMPOTENT_REQUEST, None)
+    return _finish(db, request, outcome)
+
+async def run_idempotent_async(
+    db: Session,
+    response: Response,
+    scope: str,
+    key: Optional[str],
+    fingerprint: str,
+    handler: Callable[[], Awaitable[Any]]
+):
+    """Async variant of run_idempotent; waiting for a duplicate does not block the event loop"""
+    if not key:
+        return await handler()
+    
+    request = IdempotentRequest(db, scope, key, fingerprint)
+    record = await run_in_threadpool(request.claim)
+    if record is not None:
+        logger.info(f"🔁 Replaying idempotent response for {scope}:{key}")
+        return _replay(record, response)
+    
+    db.info[IDEMPOTENT_REQUEST] = request
+    try:
+        outcome = await handler()
+    except BaseException as error:
+        await run_in_threadpool(_finish, db, request, None, error)
+    finally:
+        db.info.pop(IDEMPOTENT_REQUEST, None)
+    return await run_in_threadpool(_finish, db, request, outcome)
@@ -0,0 +1,230 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models.models import Product as ProductModel, StockReservation, reserve_catalog_versions
+from app.services.idempotency import purge_expired_keys
+from app.services.search_index import record_stock_changes
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+
+class InsufficientStock(Exception):
+    """Some products in the order do not have enough stock left"""
+    
+    def __init__(self, product_ids: List[int]):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stock for products: {product_ids}")
+
+def _quantities(lines: Iterable[dict]) -> Dict[int, int]:
+    """Total quantity per product for order lines ({"product_id", "quantity"} dicts)"""
+    quantities: Dict[int, int] = defaultdict(int)
+    for line in lines:
+        quantities[line["product_id"]] += line["quantity"]
+    return {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+
+def _adjust_stock(db: Session, deltas: Dict[int, int], require_available: bool) -> Dict[int, int]:
+    """
+    Apply per-product stock deltas with one UPDATE and return the new stock of the rows it changed.
+    With require_available, rows that would go negative are left untouched, so
+    the check and the decrement are a single atomic statement.
+    """
+    if not deltas:
+        return {}
+    products = ProductModel.__table__
+    product_ids = list(deltas)
+    first_version = reserve_catalog_versions(db, len(product_ids))
+    delta = case(deltas, value=products.c.id)
+    
+    statement = update(products).where(products.c.id.in_(product_ids))
+    if require_available:
+        statement = statement.where(products.c.stock_quantity + delta >= 0)
+    statement = statement.values(
+        stock_quantity=products.c.stock_quantity + delta,
+        version=case(
+            {product_id: first_version + i for i, product_id in enumerate(product_ids)},
+            value=products.c.id
+        ),
+        updated_at=datetime.utcnow()
+    ).returning(products.c.id, products.c.stock_quantity)
+    
+    stock = {product_id: quantity for product_id, quantity in db.execute(statement)}
+    if stock:
+        record_stock_changes(db, stock)
+    return stock
+
+def reserve_stock(db: Session, lines: Iterable[dict]):
+    """
+    Take stock for order lines, all or nothing. Raises InsufficientStock
+    (and leaves stock unchanged) if any product cannot cover its quantity.
+    The caller commits.
+    """
+    quantities = _quantities(lines)
+    taken = _adjust_stock(db, {product_id: -quantity for product_id, quantity in quantities.items()}, True)
+    short = sorted(set(quantities) - set(taken))
+    if short:
+        # Put back what the statement did take; none of it was visible outside this transaction
+        _adjust_stock(db, {product_id: quantities[product_id] for product_id in taken}, False)
+        raise InsufficientStock(short)
+
+def release_stock(db: Session, lines: Iterable[dict]):
+    """Return stock for order lines"""
+    _adjust_stock(db, _quantities(lines), False)
+
+def hold_stock(db: Session, reference: str, lines: Iterable[dict], ttl: timedelta):
+    """
+    Reserve stock for a checkout that completes later; released by the sweeper after `ttl`.
+    Holding a reference that is still held only extends it, so a retried checkout does not
+    hold twice; returns True in that case.
+    """
+    expires_at = datetime.utcnow() + ttl
+    table = StockReservation.__table__
+    extended = db.execute(
+        update(table).where(table.c.reference == reference).values(expires_at=expires_at)
+    ).rowcount
+    if extended:
+        return True
+    lines = list(lines)
+    reserve_stock(db, lines)
+    rows = [
+        {"reference": reference, "product_id": product_id, "quantity": quantity, "expires_at": expires_at}
+        for product_id, quantity in _quantities(lines).items()
+    ]
+    if rows:
+        db.execute(insert(StockReservation), rows)
+    return False
+
+def cart_hold_reference(session_id: str) -> str:
+    """Reservation reference for the stock held by a cart's pending checkout (finalize or Solana quote)"""
+    return f"cart:{session_id}"
+
+def replace_hold(db: Session, reference: str, lines: Iterable[dict], ttl: timedelta):
+    """
+    Hold `lines` under `reference` in place of whatever it held before, so a
+    cart finalized or quoted again holds its stock once rather than competing
+    with its own earlier hold. The caller commits.
+    """
+    release_hold(db, reference)
+    hold_stock(db, reference, lines, ttl)
+
+def _take_reservations(db: Session, condition) -> List[dict]:
+    table = StockReservation.__table__
+    deleted = db.execute(
+        delete(table).where(condition).returning(table.c.product_id, table.c.quantity)
+    )
+    return [{"product_id": product_id, "quantity": quantity} for product_id, quantity in deleted]
+
+def claim_hold(db: Session, reference: str, lines: Iterable[dict]):
+    """
+    Turn a hold into a sale of `lines`. Deleting the reservation rows is the
+    claim, so a hold is never both sold and released by the sweeper. If the
+    hold has already expired, or `lines` differ from it, the difference is
+    reserved or released now (InsufficientStock if it cannot be reserved).
+    The caller commits.
+    """
+    held = _quantities(_take_reservations(db, StockReservation.__table__.c.reference == reference))
+    wanted = _quantities(lines)
+    
+    missing = [
+        {"product_id": product_id, "quantity": quantity - held.get(product_id, 0)}
+        for product_id, quantity in wanted.items() if quantity > held.get(product_id, 0)
+    ]
+    surplus = [
+        {"product_id": product_id, "quantity": quantity - wanted.get(product_id, 0)}
+        for product_id, quantity in held.items() if quantity > wanted.get(product_id, 0)
+    ]
+    reserve_stock(db, missing)
+    release_stock(db, surplus)
+
+def release_hold(db: Session, reference: str):
+    """Give a hold's stock back (e.g. when payment fails). The caller commits."""
+    release_stock(db, _take_reservations(db, StockReservation.__table__.c.reference == reference))
+
+def release_expired_holds(db: Session, batch_size: int = RESERVATION_SWEEP_BATCH, now: Optional[datetime] = None) -> int:
+    """Release up to `batch_size` expired reservations, oldest first; returns how many were released"""
+    table = StockReservation.__table__
+    expired_ids = select(table.c.id).where(
+        table.c.expires_at <= (now or datetime.utcnow())
+    ).order_by(table.c.expires_at).limit(batch_size).scalar_subquery()
+    
+    released = _take_reservations(db, table.c.id.in_(expired_ids))
+    release_stock(db, released)
+    return len(released)
+
+class ReservationSweeper:
+    """
+    Background thread that periodically releases expired stock reservations
+    and forgets expired Idempotency-Keys
+    """
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        interval: float = RESERVATION_SWEEP_INTERVAL,
+        batch_size: int = RESERVATION_SWEEP_BATCH
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def _in_batches(self, step: Callable[[Session, int], int]) -> int:
+        """Run `step` in committed batches until one comes back short"""
+        total = 0
+        while True:
+            db = self.session_factory()
+            try:
+                done = step(db, self.batch_size)
+                db.commit()
+            finally:
+                db.close()
+            total += done
+            if done < self.batch_size:
+                return total
+    
+    def sweep(self) -> int:
+        """Release every expired reservation, one committed batch at a time; returns how many"""
+        total = self._in_batches(release_expired_holds)
+        if total:
+            logger.info(f"♻️ Released {total} expired stock reservations")
+        purged = self._in_batches(purge_expired_keys)
+        if purged:
+            logger.info(f"♻️ Purged {purged} expired idempotency keys")
+        return total
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"❌ Stock reservation sweep failed: {e}")
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stock-reservation-sweeper", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
@@ -0,0 +1,228 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Hot/cold archival of finished orders.
+
+Delivered and cancelled orders older than a horizon are moved, with their
+items, into an archive SQLite database ATTACHed to every connection of the
+main engine, so the live orders tables and their indexes only hold the
+working set. Lookups, listings (with include_archived) and the export read
+the archive alongside the live tables. Each batch is copied and deleted in one transaction; SQLite
+commits attached databases atomically unless the main database is in WAL
+mode, and copying with INSERT OR REPLACE keeps a re-run batch harmless then.
+"""
+
+import logging
+import os
+import threading
+import weakref
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, event, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models.models import (
+    Order as OrderModel,
+    OrderItem as OrderItemModel,
+    Product as ProductModel,
+)
+
+logger = logging.getLogger(__name__)
+
+# Empty disables archival
+ORDER_ARCHIVE_PATH = os.getenv("ORDER_ARCHIVE_PATH", "./merchant_archive.db")
+ORDER_ARCHIVE_AFTER_DAYS = float(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "180"))
+ORDER_ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL", "3600"))
+ORDER_ARCHIVE_BATCH = int(os.getenv("ORDER_ARCHIVE_BATCH", "500"))
+
+ARCHIVE_SCHEMA = "archive"
+ARCHIVED_STATUSES = ("delivered", "cancelled")
+
+def _archive_table(table: Table, metadata: MetaData) -> Table:
+    """Same columns as the live table, without foreign keys into the main database"""
+    return Table(
+        table.name, metadata,
+        *(Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in table.columns),
+        schema=ARCHIVE_SCHEMA
+    )
+
+archive_metadata = MetaData()
+archived_orders = _archive_table(OrderModel.__table__, archive_metadata)
+archived_order_items = _archive_table(OrderItemModel.__table__, archive_metadata)
+Index("ix_archive_orders_order_number", archived_orders.c.order_number, unique=True)
+Index("ix_archive_order_items_order_id", archived_order_items.c.order_id)
+Index("ix_archive_orders_created_at", archived_orders.c.created_at)
+
+_attached_engines: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+def attach_archive(engine: Engine, path: str):
+    """ATTACH the archive database to every connection of `engine` and create its tables"""
+    if engine in _attached_engines:
+        return
+    
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (str(path),))
+    
+    # Pooled connections predate the listener
+    engine.dispose()
+    archive_metadata.create_all(bind=engine)
+    # create_all only adds indexes along with a new table
+    for table in archive_metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    _attached_engines.add(engine)
+    logger.info(f"🗄️ Order archive attached at {path}")
+
+def archive_attached(engine: Engine) -> bool:
+    return engine in _attached_engines
+
+def archive_orders(db: Session, cutoff: datetime, batch_size: int) -> int:
+    """
+    Move up to `batch_size` finished orders placed before `cutoff`, with their
+    items, into the archive. Returns the number of orders moved. The caller commits.
+    """
+    orders = OrderModel.__table__
+    items = OrderItemModel.__table__
+    eligible = (
+        orders.c.status.in_(ARCHIVED_STATUSES),
+        orders.c.created_at < cutoff,
+        # The newest order stays live so SQLite never hands its id (or its items' ids) out again
+        orders.c.id < select(func.max(orders.c.id)).scalar_subquery(),
+    )
+    order_ids = db.execute(
+        select(orders.c.id).where(*eligible).order_by(orders.c.created_at).limit(batch_size)
+    ).scalars().all()
+    if not order_ids:
+        return 0
+    
+    db.execute(
+        insert(archived_orders).prefix_with("OR REPLACE").from_select(
+            [c.name for c in orders.columns],
+            select(*orders.columns).where(orders.c.id.in_(order_ids))
+        )
+    )
+    db.execute(
+        insert(archived_order_items).prefix_with("OR REPLACE").from_select(
+            [c.name for c in items.columns],
+            select(*items.columns).where(items.c.order_id.in_(order_ids))
+        )
+    )
+    db.execute(delete(items).where(items.c.order_id.in_(order_ids)))
+    return db.execute(delete(orders).where(orders.c.id.in_(order_ids))).rowcount
+
+def find_archived_orders(db: Session, condition, order_by=(), limit: Optional[int] = None) -> List[OrderModel]:
+    """
+    Load archived orders matching `condition` (on archived_orders columns) as
+    detached Orders with their items and their products, with one query each.
+    """
+    if not archive_attached(db.get_bind()):
+        return []
+    rows = db.execute(
+        select(archived_orders).where(condition).order_by(*order_by).limit(limit)
+    ).mappings().all()
+    if not rows:
+        return []
+    
+    orders = [OrderModel(**row) for row in rows]
+    item_rows = db.execute(
+        select(archived_order_items)
+        .where(archived_order_items.c.order_id.in_([order.id for order in orders]))
+        .order_by(archived_order_items.c.id)
+    ).mappings().all()
+    products = {
+        product.id: product
+        for product in db.query(ProductModel).filter(
+            ProductModel.id.in_({item["product_id"] for item in item_rows})
+        )
+    }
+    items_by_order = {order.id: [] for order in orders}
+    for item_row in item_rows:
+        item = OrderItemModel(**item_row)
+        # Set without events, so the persistent product does not pull the item into the session
+        set_committed_value(item, "product", products.get(item.product_id))
+        items_by_order[item.order_id].append(item)
+    for order in orders:
+        set_committed_value(order, "items", items_by_order[order.id])
+    return orders
+
+def find_archived_order(db: Session, condition) -> Optional[OrderModel]:
+    """The archived order matching `condition`, or None"""
+    orders = find_archived_orders(db, condition, limit=1)
+    return orders[0] if orders else None
+
+def count_archived_orders(db: Session, condition) -> int:
+    if not archive_attached(db.get_bind()):
+        return 0
+    return db.execute(select(func.count()).select_from(archived_orders).where(condition)).scalar_one()
+
+def archive_reaches(db: Session, created_from: Optional[datetime]) -> bool:
+    """Whether the archive holds any order placed at or after `created_from` (any order, if None)"""
+    if not archive_attached(db.get_bind()):
+        return False
+    newest = db.execute(select(func.max(archived_orders.c.created_at))).scalar()
+    return newest is not None and (created_from is None or newest >= created_from)
+
+class OrderArchiver:
+    """Background thread that moves finished orders past the horizon into the archive"""
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        archive_after: timedelta = timedelta(days=ORDER_ARCHIVE_AFTER_DAYS),
+        interval: float = ORDER_ARCHIVE_INTERVAL,
+        batch_size: int = ORDER_ARCHIVE_BATCH
+    ):
+        self.session_factory = session_factory
+        self.archive_after = archive_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def run_once(self) -> int:
+        """Archive every eligible order, one committed batch at a time; returns the orders moved"""
+        cutoff = datetime.utcnow() - self.archive_after
+        total = 0
+        while not self._stop.is_set():
+            db = self.session_factory()
+            try:
+                moved = archive_orders(db, cutoff, self.batch_size)
+                db.commit()
+            finally:
+                db.close()
+            total += moved
+            if moved < self.batch_size:
+                break
+        if total:
+            logger.info(f"🗄️ Archived {total} finished orders")
+        return total
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Order archival failed: {e}")
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="order-archiver", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
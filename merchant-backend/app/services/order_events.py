@@ -0,0 +1,286 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Order event outbox and the feed agents follow instead of polling orders.
+
+Events are inserted with the order change they describe, so a committed
+change always has its event and a rolled back one never does. Feed
+connections follow a per-process OrderEventHub instead of each reading the
+table; committing events wakes the hub, which also re-checks the table
+periodically to pick up events committed by other workers.
+
+Readers follow the outbox by id. Where transactions commit out of id order
+(PostgreSQL, MySQL) a reader that moved past a gap would skip the event that
+later fills it, so cursors only advance over settled rows (see settled_events).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import weakref
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.models.models import OrderEvent as OrderEventModel
+
+logger = logging.getLogger(__name__)
+
+# The hub re-checks the outbox this often for events committed by other workers
+ORDER_EVENTS_POLL_INTERVAL = float(os.getenv("ORDER_EVENTS_POLL_INTERVAL", "2"))
+# Longest a transaction may take between inserting an event and committing it; an id gap is final after this
+ORDER_EVENTS_SETTLE_SECONDS = float(os.getenv("ORDER_EVENTS_SETTLE_SECONDS", "10"))
+
+ORDER_CREATED = "order.created"
+ORDER_STATUS_CHANGED = "order.status_changed"
+
+def agent_email(agent_id: str) -> str:
+    """Customer email recorded on orders placed by an x402 agent"""
+    return f"agent_{agent_id}@system.local"
+
+def record_order_events(db: Session, events: Iterable[Dict[str, Any]]):
+    """
+    Append events to the outbox in the caller's transaction.
+    Each event needs order_id, order_number, customer_email and event_type, and
+    may carry status and previous_status.
+    """
+    now = datetime.utcnow()
+    rows = [
+        {"status": None, "previous_status": None, **event_fields, "created_at": now}
+        for event_fields in events
+    ]
+    if not rows:
+        return
+    db.execute(insert(OrderEventModel), rows)
+    db.info["order_events"] = True
+
+class OrderEventSubscription:
+    """One feed connection's share of the hub's events: all of them, or one customer's"""
+    
+    def __init__(self, hub: "OrderEventHub", customer_email: Optional[str], loop: asyncio.AbstractEventLoop):
+        self.hub = hub
+        self.customer_email = customer_email
+        self.loop = loop
+        self.signal = asyncio.Event()
+        # Set by the hub: events up to here are read from the outbox, later ones delivered
+        self.horizon = 0
+        self._events: Deque[Dict[str, Any]] = deque()
+    
+    def deliver(self, events: List[Dict[str, Any]]):
+        """Called from the hub's thread"""
+        self._events.extend(events)
+        try:
+            self.loop.call_soon_threadsafe(self.signal.set)
+        except RuntimeError:
+            # Loop already closed; the connection is gone with it
+            self.close()
+    
+    def _drain(self, after: int) -> List[Dict[str, Any]]:
+        events = []
+        while self._events:
+            order_event = self._events.popleft()
+            if order_event["id"] > after:
+                events.append(order_event)
+        return events
+    
+    async def next(self, after: int, timeout: float) -> List[Dict[str, Any]]:
+        """Delivered events past `after`, waiting up to `timeout` seconds if there are none yet"""
+        self.signal.clear()
+        events = self._drain(after)
+        if events or timeout <= 0:
+            return events
+        try:
+            await asyncio.wait_for(self.signal.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._drain(after)
+    
+    def close(self):
+        self.hub.unsubscribe(self)
+
+class OrderEventHub:
+    """
+    Per-process reader of the outbox for the feed. While connections are
+    subscribed, one thread reads the rows committed past its cursor, once for
+    all of them, and fans them out in memory by customer_email. It reads when
+    a commit in this process publishes events, and every poll interval for
+    events committed by other workers.
+    
+    A new subscription catches up with fetch_order_events up to its `horizon`,
+    the hub's cursor when it subscribed; everything past that reaches it
+    through the hub, and duplicates are dropped by id.
+    """
+    
+    def __init__(self, session_factory: Callable[[], Session], poll_interval: Optional[float] = None, batch_size: int = 500):
+        self.session_factory = session_factory
+        self.poll_interval = ORDER_EVENTS_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.batch_size = batch_size
+        # Every event up to here has been handed out; only settled rows move it
+        self.cursor = 0
+        self._subscriptions: Set[OrderEventSubscription] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def subscribe(self, customer_email: Optional[str], loop: asyncio.AbstractEventLoop) -> OrderEventSubscription:
+        """Blocking (it may read the outbox's head); call from a worker thread"""
+        subscription = OrderEventSubscription(self, customer_email or None, loop)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if self._thread is None:
+                self.cursor = latest_settled_order_event_id(self.session_factory)
+                self._thread = threading.Thread(target=self._run, name="order-event-hub", daemon=True)
+                self._thread.start()
+            subscription.horizon = self.cursor
+        return subscription
+    
+    def unsubscribe(self, subscription: OrderEventSubscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+    
+    def wake(self):
+        self._wake.set()
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._thread = None
+                    return
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"❌ Reading order events failed: {e}")
+            self._wake.wait(self.poll_interval)
+    
+    def poll(self):
+        """Read everything past the cursor and hand it to the matching subscriptions"""
+        while True:
+            db = self.session_factory()
+            try:
+                rows = db.execute(
+                    select(OrderEventModel).where(OrderEventModel.id > self.cursor)
+                    .order_by(OrderEventModel.id).limit(self.batch_size)
+                ).scalars().all()
+                events = [_as_event(row) for row in settled_events(rows, self.cursor)]
+            finally:
+                db.close()
+            if not events:
+                return
+            # Set before the subscriptions are listed, so one subscribing meanwhile gets these too
+            self.cursor = events[-1]["id"]
+            by_customer: Dict[str, List[Dict[str, Any]]] = {}
+            for order_event in events:
+                by_customer.setdefault(order_event["customer_email"], []).append(order_event)
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                matching = events if subscription.customer_email is None else by_customer.get(subscription.customer_email)
+                if matching:
+                    subscription.deliver(matching)
+            if len(events) < self.batch_size:
+                return
+
+_hubs: "weakref.WeakKeyDictionary[Any, OrderEventHub]" = weakref.WeakKeyDictionary()
+_hubs_lock = threading.Lock()
+
+def order_event_hub(bind) -> OrderEventHub:
+    """The hub reading the outbox of the database behind `bind` (an Engine)"""
+    with _hubs_lock:
+        hub = _hubs.get(bind)
+        if hub is None:
+            hub = _hubs[bind] = OrderEventHub(sessionmaker(bind=bind, autocommit=False, autoflush=False))
+        return hub
+
+@event.listens_for(Session, "after_commit")
+def _publish_order_events(session):
+    if session.info.pop("order_events", False):
+        with _hubs_lock:
+            hubs = list(_hubs.values())
+        for hub in hubs:
+            hub.wake()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_order_events(session):
+    session.info.pop("order_events", None)
+
+def settled_events(rows: List[Any], after: int) -> List[Any]:
+    """
+    The leading outbox rows (id order, past `after`) no uncommitted event can
+    come before. Reading stops at an id gap until the row after it is older
+    than ORDER_EVENTS_SETTLE_SECONDS: the missing id was taken even earlier, so
+    by then it belongs to a rollback or a skipped sequence value, not to a
+    transaction still running. SQLite serializes writers and reuses rolled back
+    ids, so there it never waits.
+    """
+    settled_before = datetime.utcnow() - timedelta(seconds=ORDER_EVENTS_SETTLE_SECONDS)
+    expected = after + 1
+    for index, row in enumerate(rows):
+        if row.id != expected and row.created_at > settled_before:
+            return rows[:index]
+        expected = row.id + 1
+    return rows
+
+def latest_settled_order_event_id(session_factory: Callable[[], Session]) -> int:
+    """An id no event committed later can fall below: the newest one older than ORDER_EVENTS_SETTLE_SECONDS"""
+    settled_before = datetime.utcnow() - timedelta(seconds=ORDER_EVENTS_SETTLE_SECONDS)
+    db = session_factory()
+    try:
+        return db.execute(
+            select(func.max(OrderEventModel.id)).where(OrderEventModel.created_at <= settled_before)
+        ).scalar() or 0
+    finally:
+        db.close()
+
+def _as_event(row: OrderEventModel) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "type": row.event_type,
+        "order_id": row.order_id,
+        "order_number": row.order_number,
+        "customer_email": row.customer_email,
+        "status": row.status,
+        "previous_status": row.previous_status,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+def fetch_order_events(
+    session_factory: Callable[[], Session],
+    after: int,
+    customer_email: Optional[str] = None,
+    limit: int = 100,
+    until: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Events with id greater than `after` (and at most `until`), oldest first,
+    optionally for one customer. Feed connections read up to their hub
+    subscription's horizon, which only ever covers settled rows.
+    """
+    db = session_factory()
+    try:
+        query = select(OrderEventModel).where(OrderEventModel.id > after)
+        if until is not None:
+            query = query.where(OrderEventModel.id <= until)
+        if customer_email:
+            query = query.where(OrderEventModel.customer_email == customer_email)
+        rows = db.execute(query.order_by(OrderEventModel.id).limit(limit)).scalars().all()
+        return [_as_event(row) for row in rows]
+    finally:
+        db.close()
+
+def format_sse(order_event: Dict[str, Any]) -> str:
+    """One event in text/event-stream framing; its id lets clients resume with Last-Event-ID"""
+    data = json.dumps(order_event, separators=(",", ":"))
+    return f"id: {order_event['id']}\nevent: {order_event['type']}\ndata: {data}\n\n"
@@ -0,0 +1,347 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import csv
+import heapq
+import io
+import json
+import os
+import uuid
+from collections import defaultdict
+from itertools import islice
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    Cart as CartModel,
+    CartItem as CartItemModel,
+    Order as OrderModel,
+    OrderItem as OrderItemModel
+)
+from app.services.order_archive import archive_reaches, archived_order_items, archived_orders
+from app.services.order_events import ORDER_CREATED, ORDER_STATUS_CHANGED, record_order_events
+
+ORDER_EXPORT_BATCH = int(os.getenv("ORDER_EXPORT_BATCH", "1000"))
+
+ORDER_STATUSES = ("pending", "confirmed", "shipped", "delivered", "cancelled")
+# Statuses an order may move to from each status
+ORDER_TRANSITIONS = {
+    "pending": ("confirmed", "cancelled"),
+    "confirmed": ("shipped", "cancelled"),
+    "shipped": ("delivered",),
+    "delivered": (),
+    "cancelled": (),
+}
+# Keeps IN lists well under SQLite's bound parameter limit
+STATUS_UPDATE_CHUNK = 500
+
+EXPORT_ORDER_COLUMNS = (
+    OrderModel.id,
+    OrderModel.order_number,
+    OrderModel.customer_email,
+    OrderModel.customer_name,
+    OrderModel.total_amount,
+    OrderModel.status,
+    OrderModel.payment_method,
+    OrderModel.payment_status,
+    OrderModel.created_at,
+    OrderModel.updated_at,
+)
+
+EXPORT_ITEM_COLUMNS = (
+    OrderItemModel.order_id,
+    OrderItemModel.id,
+    OrderItemModel.product_id,
+    OrderItemModel.quantity,
+    OrderItemModel.price,
+)
+
+CSV_HEADER = (
+    [column.key for column in EXPORT_ORDER_COLUMNS]
+    + ["item_id", "product_id", "quantity", "unit_price"]
+)
+
+def generate_order_number() -> str:
+    """Generate a unique order number"""
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    unique_id = str(uuid.uuid4())[:8].upper()
+    return f"ORD-{timestamp}-{unique_id}"
+
+def place_order(
+    db: Session,
+    lines: Iterable[Dict[str, Any]],
+    cart_id: Optional[int] = None,
+    commit: bool = True,
+    **order_fields
+) -> Dict[str, Any]:
+    """
+    Create an order with its items, clear the cart and record an order.created
+    event, then commit, all as one transaction.
+    
+    `lines` are priced cart lines (see price_cart) or finalized cart items; each
+    needs product_id, quantity and unit_price. Anything else already written in
+    the session (e.g. a stock claim) commits with the order; with commit=False
+    the caller commits, e.g. through commit_with_response. Returns the order
+    as a dict built from what was inserted, so callers need no reload.
+    """
+    lines = list(lines)
+    now = datetime.utcnow()
+    order = {
+        "order_number": generate_order_number(),
+        "status": "confirmed",
+        "created_at": now,
+        "updated_at": now,
+        **order_fields
+    }
+    order["id"] = db.execute(
+        insert(OrderModel).values(**order).returning(OrderModel.id)
+    ).scalar_one()
+    
+    # One multi-row INSERT on every dialect. RETURNING rows need not follow the parameter
+    # order, so ids are matched back to lines by value; lines with equal values are interchangeable
+    inserted = defaultdict(list)
+    if lines:
+        for item_id, product_id, quantity, price in db.execute(
+            insert(OrderItemModel).returning(
+                OrderItemModel.id, OrderItemModel.product_id, OrderItemModel.quantity, OrderItemModel.price
+            ),
+            [
+                {
+                    "order_id": order["id"],
+                    "product_id": line["product_id"],
+                    "quantity": line["quantity"],
+                    "price": line["unit_price"]
+                }
+                for line in lines
+            ]
+        ):
+            inserted[(product_id, quantity, float(price))].append(item_id)
+    item_ids: List[int] = [
+        inserted[(line["product_id"], line["quantity"], float(line["unit_price"]))].pop()
+        for line in lines
+    ]
+    
+    if cart_id is not None:
+        db.execute(delete(CartItemModel.__table__).where(CartItemModel.__table__.c.cart_id == cart_id))
+        # Tells every worker's cart cache that the cart is empty now
+        carts = CartModel.__table__
+        db.execute(update(carts).where(carts.c.id == cart_id).values(updated_at=now, version=carts.c.version + 1))
+    record_order_events(db, [{
+        "order_id": order["id"],
+        "order_number": order["order_number"],
+        "customer_email": order["customer_email"],
+        "event_type": ORDER_CREATED,
+        "status": order["status"]
+    }])
+    if commit:
+        db.commit()
+    
+    order["items"] = [
+        {
+            "id": item_id,
+            "product_id": line["product_id"],
+            "product_name": line.get("product_name"),
+            "quantity": line["quantity"],
+            "unit_price": float(line["unit_price"]),
+            "total_price": float(line["unit_price"] * line["quantity"]),
+            "image_url": line.get("image_url"),
+            "description": line.get("description")
+        }
+        for item_id, line in zip(item_ids, lines)
+    ]
+    return order
+
+def _export_filters(
+    orders,
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    statuses: Optional[List[str]]
+) -> list:
+    filters = []
+    if created_from is not None:
+        filters.append(orders.c.created_at >= created_from)
+    if created_to is not None:
+        filters.append(orders.c.created_at < created_to)
+    if statuses:
+        filters.append(orders.c.status.in_(statuses))
+    return filters
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+def iter_order_batches(
+    db: Session,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    statuses: Optional[List[str]] = None,
+    batch_size: int = ORDER_EXPORT_BATCH
+) -> Iterator[List[tuple]]:
+    """
+    Yield (order row, [item rows]) pairs in batches, oldest first, including
+    archived orders whenever the range reaches back into the archive.
+    Orders come off one server-side cursor per table, merged on created_at, in
+    `batch_size` partitions and each partition's items are fetched with a
+    single IN query per table, so memory is bounded by the batch and nothing
+    has to be sorted.
+    """
+    tables = [(OrderModel.__table__, OrderItemModel.__table__)]
+    if archive_reaches(db, created_from):
+        tables.append((archived_orders, archived_order_items))
+    cursors = [
+        db.execute(
+            select(*(orders.c[column.key] for column in EXPORT_ORDER_COLUMNS))
+            .where(*_export_filters(orders, created_from, created_to, statuses))
+            .order_by(orders.c.created_at, orders.c.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for orders, _ in tables
+    ]
+    merged = heapq.merge(*cursors, key=lambda order: (order.created_at, order.id))
+    while partition := list(islice(merged, batch_size)):
+        order_ids = [order.id for order in partition]
+        items: Dict[int, List[tuple]] = {}
+        for _, order_items in tables:
+            for item in db.execute(
+                select(*(order_items.c[column.key] for column in EXPORT_ITEM_COLUMNS))
+                .where(order_items.c.order_id.in_(order_ids))
+                .order_by(order_items.c.order_id, order_items.c.id)
+            ):
+                items.setdefault(item.order_id, []).append(item)
+        yield [(order, items.get(order.id, [])) for order in partition]
+
+def _ndjson_batch(batch: List[tuple]) -> str:
+    lines = []
+    for order, items in batch:
+        record = order._asdict()
+        record["created_at"] = _iso(record["created_at"])
+        record["updated_at"] = _iso(record["updated_at"])
+        record["items"] = [
+            {"id": item.id, "product_id": item.product_id, "quantity": item.quantity, "unit_price": item.price}
+            for item in items
+        ]
+        lines.append(json.dumps(record, separators=(",", ":")))
+    return "\n".join(lines) + "\n"
+
+def _csv_batch(batch: List[tuple]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for order, items in batch:
+        order_fields = list(order)
+        order_fields[-2:] = [_iso(order.created_at), _iso(order.updated_at)]
+        if not items:
+            writer.writerow(order_fields + [None] * 4)
+        for item in items:
+            writer.writerow(order_fields + [item.id, item.product_id, item.quantity, item.price])
+    return buffer.getvalue()
+
+def iter_order_export(
+    session_factory: Callable[[], Session],
+    export_format: str = "ndjson",
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    statuses: Optional[List[str]] = None,
+    batch_size: int = ORDER_EXPORT_BATCH
+) -> Iterator[str]:
+    """
+    Stream orders with their items as NDJSON (one order per line) or CSV (one
+    row per item, orders without items get one row). Output is produced one
+    batch at a time from its own session.
+    """
+    db = session_factory()
+    try:
+        if export_format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(CSV_HEADER)
+            yield buffer.getvalue()
+        render = _csv_batch if export_format == "csv" else _ndjson_batch
+        for batch in iter_order_batches(db, created_from, created_to, statuses, batch_size):
+            yield render(batch)
+    finally:
+        db.close()
+
+def _chunks(values: List[Any], size: int = STATUS_UPDATE_CHUNK) -> Iterator[List[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def bulk_update_status(db: Session, updates: Iterable[tuple]) -> List[Dict[str, Any]]:
+    """
+    Apply (order_number, status) pairs in one transaction and commit.
+    Current statuses are read with one query per chunk, each requested change is
+    checked against ORDER_TRANSITIONS, and the valid ones are written with one
+    UPDATE per target status, plus one outbox insert for their events. Each UPDATE re-checks the source status, so an order
+    changed concurrently is reported as a conflict rather than overwritten.
+    Returns one outcome per requested pair, in request order.
+    """
+    updates = list(updates)
+    numbers = list({order_number for order_number, _ in updates})
+    current: Dict[str, str] = {}
+    for chunk in _chunks(numbers):
+        current.update(db.execute(
+            select(OrderModel.order_number, OrderModel.status).where(OrderModel.order_number.in_(chunk))
+        ).all())
+    
+    outcomes: List[Dict[str, Any]] = []
+    targets: Dict[str, List[str]] = {}
+    seen = set()
+    for order_number, status in updates:
+        previous = current.get(order_number)
+        outcome = {"order_number": order_number, "previous_status": previous, "status": previous}
+        outcomes.append(outcome)
+        if order_number in seen:
+            outcome.update(result="duplicate", detail="Order appears more than once in the request")
+            continue
+        seen.add(order_number)
+        
+        if status not in ORDER_STATUSES:
+            outcome.update(result="invalid_status", detail=f"Must be one of: {', '.join(ORDER_STATUSES)}")
+        elif previous is None:
+            outcome.update(result="not_found")
+        elif status == previous:
+            outcome.update(result="unchanged")
+        elif status not in ORDER_TRANSITIONS.get(previous, ()):
+            outcome.update(result="invalid_transition", detail=f"Cannot move from {previous} to {status}")
+        else:
+            outcome.update(result="updated", status=status)
+            targets.setdefault(status, []).append(order_number)
+    
+    now = datetime.utcnow()
+    applied = set()
+    events = []
+    for status, order_numbers in targets.items():
+        sources = [source for source, allowed in ORDER_TRANSITIONS.items() if status in allowed]
+        for chunk in _chunks(order_numbers):
+            for order_number, order_id, customer_email in db.execute(
+                update(OrderModel)
+                .where(OrderModel.order_number.in_(chunk), OrderModel.status.in_(sources))
+                .values(status=status, updated_at=now)
+                .returning(OrderModel.order_number, OrderModel.id, OrderModel.customer_email)
+                .execution_options(synchronize_session=False)
+            ):
+                applied.add(order_number)
+                events.append({
+                    "order_id": order_id,
+                    "order_number": order_number,
+                    "customer_email": customer_email,
+                    "event_type": ORDER_STATUS_CHANGED,
+                    "status": status,
+                    "previous_status": current[order_number]
+                })
+    record_order_events(db, events)
+    db.commit()
+    
+    for outcome in outcomes:
+        if outcome["result"] == "updated" and outcome["order_number"] not in applied:
+            outcome.update(
+                result="conflict",
+                status=None,
+                detail="Order status changed while the update was applied"
+            )
+    return outcomes
@@ -0,0 +1,273 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Card payment processing behind a pluggable async interface.
+
+Routes talk to `payment_processor`; the configured implementation decides
+where authorizations and captures go. SimulatedProcessor stands in for a real
+processor locally, with configurable latency and failure rates for load tests.
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import os
+import random
+import re
+import uuid
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from anyio import to_thread
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_PROCESSOR = os.getenv("PAYMENT_PROCESSOR", "simulated")
+# Sync routes wait for the processor in anyio worker threads (40 by default), so no more
+# calls than there are worker threads can be in flight; larger values are clamped to that
+PAYMENT_MAX_CONCURRENCY = int(os.getenv("PAYMENT_MAX_CONCURRENCY", "40"))
+
+class PaymentDeclined(Exception):
+    """The card or the payment was refused; retrying the same request will not help"""
+
+class PaymentProcessorUnavailable(Exception):
+    """The processor could not be reached or failed; the payment did not go through"""
+
+def detect_card_brand(card_number: str) -> str:
+    """Detect card brand from card number"""
+    card_number = re.sub(r'\D', '', card_number)  # Remove non-digits
+    
+    if card_number.startswith('4'):
+        return 'Visa'
+    elif card_number.startswith(('51', '52', '53', '54', '55')) or card_number.startswith('2'):
+        return 'Mastercard'
+    elif card_number.startswith(('34', '37')):
+        return 'American Express'
+    elif card_number.startswith('6'):
+        return 'Discover'
+    else:
+        return 'Unknown'
+
+def validate_card_number(card_number: str) -> bool:
+    """Length check plus Luhn checksum"""
+    digits = [int(d) for d in re.sub(r'\D', '', card_number)]
+    if len(digits) < 13 or len(digits) > 19:
+        return False
+    
+    checksum = sum(digits[-1::-2])
+    for d in digits[-2::-2]:
+        checksum += sum(divmod(d * 2, 10))
+    return checksum % 10 == 0
+
+def validate_expiry(expiry_date: str) -> bool:
+    """Validate expiry date format MM/YY or MM/YYYY and that the card has not expired"""
+    if not expiry_date or '/' not in expiry_date:
+        return False
+    
+    try:
+        month, year = (int(part) for part in expiry_date.split('/'))
+    except ValueError:
+        return False
+    
+    # Convert 2-digit year to 4-digit
+    if year < 100:
+        year += 2000
+    if month < 1 or month > 12:
+        return False
+    
+    current_date = datetime.now()
+    return not (year < current_date.year or (year == current_date.year and month < current_date.month))
+
+def validate_card(card: Dict[str, str]):
+    """Raise PaymentDeclined for card details no processor would accept"""
+    if not validate_card_number(card.get('card_number') or ''):
+        raise PaymentDeclined("Invalid card number")
+    if not validate_expiry(card.get('expiry_date') or ''):
+        raise PaymentDeclined("Invalid or expired card")
+    cvv = card.get('cvv') or ''
+    if len(cvv) < 3 or len(cvv) > 4:
+        raise PaymentDeclined("Invalid CVV")
+
+class PaymentProcessor(ABC):
+    """
+    Async card processor interface.
+    Subclasses implement _authorize, _capture, _void and _refund; the public
+    methods bound how many processor calls are in flight at once.
+    """
+    
+    def __init__(self, max_concurrency: int = PAYMENT_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        # One pool per event loop; a semaphore cannot be shared between loops
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+    
+    def _pool(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = asyncio.Semaphore(self._concurrency())
+        return pool
+    
+    def _concurrency(self) -> int:
+        """max_concurrency, clamped to the worker threads the sync routes wait in"""
+        threads = int(to_thread.current_default_thread_limiter().total_tokens)
+        if self.max_concurrency > threads:
+            logger.warning(
+                f"⚠️ Payment concurrency {self.max_concurrency} exceeds the {threads} worker threads; using {threads}"
+            )
+            return threads
+        return self.max_concurrency
+    
+    async def authorize(self, card: Dict[str, str], amount: float, idempotency_key: Optional[str] = None) -> Dict[str, str]:
+        """
+        Reserve `amount` on the card. Returns authorization_id, card_brand and last_four.
+        Raises PaymentDeclined or PaymentProcessorUnavailable. The processor answers a
+        repeated idempotency_key with the original authorization.
+        """
+        validate_card(card)
+        async with self._pool():
+            return await self._authorize(card, amount, idempotency_key)
+    
+    async def capture(self, authorization_id: str, amount: float, idempotency_key: Optional[str] = None) -> Dict[str, str]:
+        """Collect an authorized amount. Returns transaction_id and provider_reference."""
+        async with self._pool():
+            return await self._capture(authorization_id, amount, idempotency_key)
+    
+    async def void(self, authorization_id: str):
+        """Cancel an authorization that will not be captured, releasing the amount on the card"""
+        async with self._pool():
+            await self._void(authorization_id)
+    
+    async def refund(self, transaction_id: str, amount: float):
+        """Return a captured amount, e.g. when the goods turn out to be unavailable"""
+        async with self._pool():
+            await self._refund(transaction_id, amount)
+    
+    async def charge(self, card: Dict[str, str], amount: float, idempotency_key: Optional[str] = None) -> Dict[str, str]:
+        """
+        Authorize and capture in one go; returns the fields of both.
+        If the capture fails the authorization is voided, so no hold is left on the card.
+        A retry with the same idempotency_key gets the original charge back.
+        """
+        keys = (f"{idempotency_key}:authorize", f"{idempotency_key}:capture") if idempotency_key else (None, None)
+        authorization = await self.authorize(card, amount, keys[0])
+        try:
+            capture = await self.capture(authorization["authorization_id"], amount, keys[1])
+        except Exception:
+            try:
+                await self.void(authorization["authorization_id"])
+            except Exception as e:
+                logger.error(f"❌ Voiding authorization {authorization['authorization_id']} failed: {e}")
+            raise
+        return {**authorization, **capture}
+    
+    @abstractmethod
+    async def _authorize(self, card: Dict[str, str], amount: float, idempotency_key: Optional[str]) -> Dict[str, str]:
+        ...
+    
+    @abstractmethod
+    async def _capture(self, authorization_id: str, amount: float, idempotency_key: Optional[str]) -> Dict[str, str]:
+        ...
+    
+    @abstractmethod
+    async def _void(self, authorization_id: str):
+        ...
+    
+    @abstractmethod
+    async def _refund(self, transaction_id: str, amount: float):
+        ...
+
+class SimulatedProcessor(PaymentProcessor):
+    """
+    Local stand-in for a card processor.
+    Each call waits a log-normally distributed latency (median `latency_ms`,
+    spread `latency_sigma`), then fails with PaymentProcessorUnavailable at
+    `error_rate`; authorizations are additionally declined at `decline_rate`.
+    With the defaults every valid card is approved immediately. Like a real
+    processor it remembers recent idempotency keys and replays their results.
+    """
+    
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        latency_sigma: float = 0.5,
+        decline_rate: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        max_concurrency: int = PAYMENT_MAX_CONCURRENCY,
+    ):
+        super().__init__(max_concurrency)
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self._replies: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+    
+    async def _once(self, idempotency_key: Optional[str], call: Callable[[], Awaitable[Dict[str, str]]]) -> Dict[str, str]:
+        if idempotency_key is not None and idempotency_key in self._replies:
+            return self._replies[idempotency_key]
+        reply = await call()
+        if idempotency_key is not None:
+            self._replies[idempotency_key] = reply
+            while len(self._replies) > 10_000:
+                self._replies.popitem(last=False)
+        return reply
+    
+    async def _simulate_call(self):
+        if self.latency_ms > 0:
+            latency = self.latency_ms * self.random.lognormvariate(0, self.latency_sigma)
+            await asyncio.sleep(latency / 1000)
+        if self.random.random() < self.error_rate:
+            raise PaymentProcessorUnavailable("Simulated processor error")
+    
+    async def _authorize(self, card: Dict[str, str], amount: float, idempotency_key: Optional[str]) -> Dict[str, str]:
+        async def authorize():
+            await self._simulate_call()
+            if self.random.random() < self.decline_rate:
+                raise PaymentDeclined("Card declined")
+            
+            card_number = re.sub(r'\D', '', card['card_number'])
+            return {
+                "authorization_id": f"auth_{uuid.uuid4().hex[:12]}",
+                "card_brand": detect_card_brand(card_number),
+                "last_four": card_number[-4:]
+            }
+        return await self._once(idempotency_key, authorize)
+    
+    async def _capture(self, authorization_id: str, amount: float, idempotency_key: Optional[str]) -> Dict[str, str]:
+        async def capture():
+            await self._simulate_call()
+            return {
+                "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
+                "provider_reference": f"ref_{uuid.uuid4().hex[:8]}"
+            }
+        return await self._once(idempotency_key, capture)
+    
+    async def _void(self, authorization_id: str):
+        await self._simulate_call()
+        logger.info(f"↩️ Voided authorization {authorization_id}")
+    
+    async def _refund(self, transaction_id: str, amount: float):
+        await self._simulate_call()
+        logger.info(f"↩️ Refunded {amount:.2f} for {transaction_id}")
+
+def create_payment_processor() -> PaymentProcessor:
+    """Processor selected by PAYMENT_PROCESSOR"""
+    if PAYMENT_PROCESSOR == "simulated":
+        return SimulatedProcessor(
+            latency_ms=float(os.getenv("PAYMENT_SIM_LATENCY_MS", "0")),
+            latency_sigma=float(os.getenv("PAYMENT_SIM_LATENCY_SIGMA", "0.5")),
+            decline_rate=float(os.getenv("PAYMENT_SIM_DECLINE_RATE", "0")),
+            error_rate=float(os.getenv("PAYMENT_SIM_ERROR_RATE", "0")),
+        )
+    raise ValueError(f"Unknown PAYMENT_PROCESSOR: {PAYMENT_PROCESSOR}")
+
+payment_processor = create_payment_processor()
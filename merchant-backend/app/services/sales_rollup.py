@@ -0,0 +1,316 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Daily sales rollups for analytics.
+
+A background job folds the order event outbox into per-day, per-product and
+per-payment-method totals, so analytics never scan orders or order_items.
+Placed orders are added and cancellations subtracted (and added back if the
+order is reinstated), all on the day the order was placed. The outbox position is checkpointed in the same
+transaction as the rollup rows, so every event is counted exactly once.
+"""
+
+import logging
+import os
+import threading
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, exists, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    Order as OrderModel,
+    OrderEvent as OrderEventModel,
+    OrderItem as OrderItemModel,
+    RollupCheckpoint as RollupCheckpointModel,
+    SalesDailyPaymentMethod as SalesDailyPaymentMethodModel,
+    SalesDailyProduct as SalesDailyProductModel,
+)
+from app.services.order_events import ORDER_CREATED, ORDER_STATUS_CHANGED, settled_events
+
+logger = logging.getLogger(__name__)
+
+SALES_ROLLUP_INTERVAL = float(os.getenv("SALES_ROLLUP_INTERVAL", "30"))
+SALES_ROLLUP_BATCH = int(os.getenv("SALES_ROLLUP_BATCH", "1000"))
+
+SALES_CHECKPOINT = "sales"
+UNKNOWN_PAYMENT_METHOD = "unknown"
+
+# (day, product_id) -> [orders, units, revenue] and (day, payment_method) -> [orders, revenue]
+ProductDeltas = Dict[Tuple[date, int], List[float]]
+MethodDeltas = Dict[Tuple[date, str], List[float]]
+
+def _as_date(value) -> date:
+    """func.date() returns a date on PostgreSQL and an ISO string on SQLite"""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def _add_order_sales(db: Session, condition, sign: int, products: ProductDeltas, methods: MethodDeltas):
+    """Accumulate the sales of orders matching `condition`, times `sign`, with one grouped query per rollup"""
+    day = func.date(OrderModel.created_at)
+    product_rows = db.execute(
+        select(
+            day, OrderItemModel.product_id,
+            func.count(func.distinct(OrderModel.id)),
+            func.sum(OrderItemModel.quantity),
+            func.sum(OrderItemModel.quantity * OrderItemModel.price)
+        ).join(OrderItemModel, OrderItemModel.order_id == OrderModel.id)
+        .where(condition).group_by(day, OrderItemModel.product_id)
+    ).all()
+    for order_day, product_id, orders, units, revenue in product_rows:
+        totals = products.setdefault((_as_date(order_day), product_id), [0, 0, 0.0])
+        totals[0] += sign * orders
+        totals[1] += sign * (units or 0)
+        totals[2] += sign * (revenue or 0.0)
+    
+    method = func.coalesce(OrderModel.payment_method, UNKNOWN_PAYMENT_METHOD)
+    method_rows = db.execute(
+        select(day, method, func.count(OrderModel.id), func.sum(OrderModel.total_amount))
+        .where(condition).group_by(day, method)
+    ).all()
+    for order_day, payment_method, orders, revenue in method_rows:
+        totals = methods.setdefault((_as_date(order_day), payment_method), [0, 0.0])
+        totals[0] += sign * orders
+        totals[1] += sign * (revenue or 0.0)
+
+def _apply_deltas(db: Session, model, key_columns: Tuple[str, ...], value_columns: Tuple[str, ...], deltas: Dict):
+    """Add deltas to existing rollup rows with one batched UPDATE, and insert the missing rows"""
+    if not deltas:
+        return
+    table = model.__table__
+    existing = set(db.execute(
+        select(*(table.c[name] for name in key_columns))
+        .where(table.c.day.in_({key[0] for key in deltas}))
+    ).all())
+    
+    updates, inserts = [], []
+    for key, values in deltas.items():
+        if key in existing:
+            updates.append({
+                **{f"key_{name}": part for name, part in zip(key_columns, key)},
+                **{f"delta_{name}": value for name, value in zip(value_columns, values)},
+            })
+        else:
+            inserts.append({**dict(zip(key_columns, key)), **dict(zip(value_columns, values))})
+    
+    if updates:
+        db.connection().execute(
+            update(table)
+            .where(and_(*(table.c[name] == bindparam(f"key_{name}") for name in key_columns)))
+            .values({name: table.c[name] + bindparam(f"delta_{name}") for name in value_columns}),
+            updates
+        )
+    if inserts:
+        db.execute(insert(table), inserts)
+
+def _apply_sales(db: Session, products: ProductDeltas, methods: MethodDeltas):
+    _apply_deltas(db, SalesDailyProductModel, ("day", "product_id"), ("orders", "units", "revenue"), products)
+    _apply_deltas(db, SalesDailyPaymentMethodModel, ("day", "payment_method"), ("orders", "revenue"), methods)
+
+def backfill_sales(db: Session) -> bool:
+    """
+    Create the sales checkpoint, seeding the rollups with orders placed before
+    the outbox existed (orders without an order.created event).
+    Returns False when the checkpoint already exists. Call it at the start of a
+    transaction, which is rolled back in that case; the caller commits otherwise.
+    """
+    if db.get(RollupCheckpointModel, SALES_CHECKPOINT) is not None:
+        return False
+    try:
+        db.execute(insert(RollupCheckpointModel).values(
+            name=SALES_CHECKPOINT, last_event_id=0, updated_at=datetime.utcnow()
+        ))
+    except IntegrityError:
+        db.rollback()
+        return False
+    
+    def has_event(*conditions):
+        return exists().where(OrderEventModel.order_id == OrderModel.id, *conditions)
+    
+    # Cancelled legacy orders are counted only if their cancellation is in the outbox to subtract them again
+    legacy = and_(
+        ~has_event(OrderEventModel.event_type == ORDER_CREATED),
+        or_(
+            OrderModel.status != "cancelled",
+            has_event(OrderEventModel.event_type == ORDER_STATUS_CHANGED, OrderEventModel.status == "cancelled")
+        )
+    )
+    products: ProductDeltas = {}
+    methods: MethodDeltas = {}
+    _add_order_sales(db, legacy, 1, products, methods)
+    _apply_sales(db, products, methods)
+    return True
+
+def fold_order_events(db: Session, batch_size: int = SALES_ROLLUP_BATCH) -> int:
+    """
+    Fold up to `batch_size` outbox events past the checkpoint into the rollups
+    and advance the checkpoint. Returns the number of events consumed, or 0
+    when another worker advanced the checkpoint first. The caller commits.
+    
+    The checkpoint only moves over settled events, so one whose transaction
+    commits after a later id's is still folded in.
+    """
+    checkpoint = db.execute(
+        select(RollupCheckpointModel.last_event_id).where(RollupCheckpointModel.name == SALES_CHECKPOINT)
+    ).scalar_one()
+    events = settled_events(db.execute(
+        select(
+            OrderEventModel.id, OrderEventModel.order_id, OrderEventModel.event_type,
+            OrderEventModel.status, OrderEventModel.previous_status, OrderEventModel.created_at
+        )
+        .where(OrderEventModel.id > checkpoint)
+        .order_by(OrderEventModel.id).limit(batch_size)
+    ).all(), checkpoint)
+    if not events:
+        return 0
+    
+    # Claim the batch first: the guarded UPDATE fails for a worker that raced us to it
+    claimed = db.execute(
+        update(RollupCheckpointModel)
+        .where(RollupCheckpointModel.name == SALES_CHECKPOINT, RollupCheckpointModel.last_event_id == checkpoint)
+        .values(last_event_id=events[-1].id, updated_at=datetime.utcnow())
+    ).rowcount
+    if not claimed:
+        return 0
+    
+    # Net times each order counts after the batch: placed +1, cancelled -1, reinstated from cancelled +1
+    signs: Dict[int, int] = {}
+    for e in events:
+        if e.event_type == ORDER_CREATED:
+            sign = 1
+        elif e.event_type == ORDER_STATUS_CHANGED and (e.status == "cancelled") != (e.previous_status == "cancelled"):
+            sign = -1 if e.status == "cancelled" else 1
+        else:
+            continue
+        signs[e.order_id] = signs.get(e.order_id, 0) + sign
+    products: ProductDeltas = {}
+    methods: MethodDeltas = {}
+    for sign in set(signs.values()) - {0}:
+        order_ids = [order_id for order_id, net in signs.items() if net == sign]
+        _add_order_sales(db, OrderModel.id.in_(order_ids), sign, products, methods)
+    _apply_sales(db, products, methods)
+    return len(events)
+
+def sales_rollup_status(db: Session) -> Dict[str, Optional[int]]:
+    """Checkpoint position and the number of outbox events not yet folded in"""
+    checkpoint = db.execute(
+        select(RollupCheckpointModel.last_event_id).where(RollupCheckpointModel.name == SALES_CHECKPOINT)
+    ).scalar()
+    latest = db.execute(select(func.max(OrderEventModel.id))).scalar() or 0
+    if checkpoint is None:
+        return {"as_of_event_id": None, "pending_events": latest}
+    return {"as_of_event_id": checkpoint, "pending_events": latest - checkpoint}
+
+class SalesRollupJob:
+    """Background thread that folds new order events into the sales rollups"""
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        interval: float = SALES_ROLLUP_INTERVAL,
+        batch_size: int = SALES_ROLLUP_BATCH
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def run_once(self) -> int:
+        """Fold every pending event, one committed batch at a time; returns the events folded"""
+        db = self.session_factory()
+        try:
+            if backfill_sales(db):
+                db.commit()
+                logger.info("📊 Seeded sales rollups from existing orders")
+        finally:
+            db.close()
+        
+        total = 0
+        while not self._stop.is_set():
+            db = self.session_factory()
+            try:
+                folded = fold_order_events(db, self.batch_size)
+                db.commit()
+            finally:
+                db.close()
+            total += folded
+            if folded < self.batch_size:
+                break
+        if total:
+            logger.info(f"📊 Folded {total} order events into sales rollups")
+        return total
+    
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Sales rollup failed: {e}")
+            if self._stop.wait(self.interval):
+                break
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sales-rollup", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+def sales_summary(
+    db: Session,
+    group_by: str,
+    date_from: date,
+    date_to: date,
+    product_id: Optional[int] = None
+) -> Dict:
+    """
+    Rollup rows for the days in [date_from, date_to], read by primary key range;
+    the cost depends on the range and catalog size, not on order history.
+    """
+    if group_by == "product":
+        model, key = SalesDailyProductModel, SalesDailyProductModel.product_id
+    else:
+        model, key = SalesDailyPaymentMethodModel, SalesDailyPaymentMethodModel.payment_method
+    query = db.query(model).filter(model.day >= date_from, model.day <= date_to)
+    if product_id is not None and group_by == "product":
+        query = query.filter(key == product_id)
+    
+    rows = []
+    for row in query.order_by(model.day, key).all():
+        # Days whose orders were all cancelled keep a zeroed row
+        if not row.orders:
+            continue
+        item = {"day": row.day, "orders": row.orders, "revenue": round(row.revenue, 2)}
+        if group_by == "product":
+            item.update(product_id=row.product_id, units=row.units)
+        else:
+            item["payment_method"] = row.payment_method
+        rows.append(item)
+    
+    summary = {
+        "group_by": group_by,
+        "date_from": date_from,
+        "date_to": date_to,
+        "rows": rows,
+        "revenue": round(sum(row["revenue"] for row in rows), 2),
+        **sales_rollup_status(db),
+    }
+    if group_by == "payment_method":
+        summary["orders"] = sum(row["orders"] for row in rows)
+    return summary
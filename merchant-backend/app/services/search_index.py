@@ -0,0 +1,386 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import re
+from array import array
+from functools import lru_cache
+import threading
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.models import Product as ProductModel, normalize_category
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+@lru_cache(maxsize=100_000)
+def _word_trigrams(word: str) -> Tuple[str, ...]:
+    padded = f"  {word} "
+    return tuple(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def trigrams(text: str) -> List[str]:
+    """Distinct padded character trigrams of each word in `text`"""
+    grams = set()
+    for word in _NON_WORD.split(text.lower()):
+        if word:
+            grams.update(_word_trigrams(word))
+    return list(grams)
+
+class _Postings:
+    """
+    Slots containing one trigram: a bulk-built NumPy base plus a packed int32
+    tail for incremental appends, concatenated (and cached) on demand.
+    """
+    
+    __slots__ = ("base", "tail", "_array")
+    
+    def __init__(self, base: Optional[np.ndarray] = None):
+        self.base = base if base is not None else np.empty(0, dtype=np.int32)
+        self.tail = array("i")
+        self._array: Optional[np.ndarray] = self.base
+    
+    def append(self, slot: int):
+        self.tail.append(slot)
+        self._array = None
+    
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.concatenate((self.base, np.frombuffer(self.tail, dtype=np.int32)))
+        return self._array
+
+def _bulk_postings(gram_column: array, slot_column: array, vocabulary_size: int) -> List[_Postings]:
+    """Group (gram, slot) pairs into per-gram postings with one stable sort"""
+    grams = np.frombuffer(gram_column, dtype=np.int32)
+    slots = np.frombuffer(slot_column, dtype=np.int32)
+    order = np.argsort(grams, kind="stable")
+    sorted_slots = slots[order]
+    boundaries = np.searchsorted(grams[order], np.arange(vocabulary_size + 1))
+    return [
+        _Postings(sorted_slots[boundaries[i]:boundaries[i + 1]].copy())
+        for i in range(vocabulary_size)
+    ]
+
+class TrigramIndex:
+    """
+    In-memory trigram inverted index over product name, category and description.
+    
+    Every indexed product occupies a slot; postings map a trigram to the slots
+    containing it. Updating a product assigns it a fresh slot and tombstones the
+    old one, so an update only appends to postings. Once tombstones outnumber
+    `compact_ratio` of the live slots (and `compact_min_dead`), the index is
+    compacted: live slots are renumbered and postings rewritten without the dead
+    ones, which amortizes to O(1) per update.
+    Candidate scoring is a bincount over the query's postings.
+    """
+    
+    _STATE_FIELDS = (
+        "_vocabulary", "_postings", "_name_postings", "_slot_of", "_product_ids",
+        "_alive", "_gram_counts", "_prices", "_stock", "_categories", "_columns",
+    )
+    
+    def __init__(self, name_weight: float = 2.0, compact_ratio: float = 0.5, compact_min_dead: int = 1024):
+        self.name_weight = name_weight
+        self.compact_ratio = compact_ratio
+        self.compact_min_dead = compact_min_dead
+        self._lock = threading.RLock()
+        self.ready = False
+        # Updates made while build() loads a fresh state, replayed onto it
+        self._pending: Optional[List[Tuple[Callable, tuple]]] = None
+        self._reset()
+    
+    def _reset(self):
+        self._vocabulary: Dict[str, int] = {}
+        self._postings: List[_Postings] = []
+        self._name_postings: List[_Postings] = []
+        self._slot_of: Dict[int, int] = {}
+        self._product_ids: List[int] = []
+        self._alive: List[bool] = []
+        self._gram_counts: List[int] = []
+        self._prices: List[float] = []
+        self._stock: List[int] = []
+        self._categories: List[str] = []
+        self._columns: Optional[Tuple[np.ndarray, ...]] = None
+    
+    def __len__(self) -> int:
+        return len(self._slot_of)
+    
+    def build(self, products: Iterable):
+        """
+        Rebuild the index from scratch.
+        The new state is loaded without holding the lock, so searches and
+        incremental updates keep working meanwhile; updates that arrive
+        during the load are replayed before the new state is swapped in.
+        """
+        with self._lock:
+            self._pending = []
+        
+        fresh = TrigramIndex(self.name_weight, self.compact_ratio, self.compact_min_dead)
+        fresh._bulk_load(products)
+        
+        with self._lock:
+            pending, self._pending = self._pending, None
+            for field in self._STATE_FIELDS:
+                setattr(self, field, getattr(fresh, field))
+            for apply, args in pending:
+                apply(*args)
+            self.ready = True
+        logger.info(f"🔎 Search index built with {len(self)} products")
+    
+    def _bulk_load(self, products: Iterable):
+        gram_column, slot_column = array("i"), array("i")
+        name_gram_column, name_slot_column = array("i"), array("i")
+        
+        for product in products:
+            slot = len(self._product_ids)
+            gram_ids, name_gram_ids = self._register(product)
+            gram_column.extend(gram_ids)
+            slot_column.extend([slot] * len(gram_ids))
+            name_gram_column.extend(name_gram_ids)
+            name_slot_column.extend([slot] * len(name_gram_ids))
+        
+        vocabulary_size = len(self._vocabulary)
+        self._postings = _bulk_postings(gram_column, slot_column, vocabulary_size)
+        self._name_postings = _bulk_postings(name_gram_column, name_slot_column, vocabulary_size)
+    
+    def clear(self):
+        """Drop all entries; searches fall back to SQL until the next build"""
+        with self._lock:
+            self._reset()
+            self.ready = False
+    
+    def upsert(self, product):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._upsert, (product,)))
+            self._upsert(product)
+    
+    def _upsert(self, product):
+        self._remove(product.id)
+        slot = len(self._product_ids)
+        gram_ids, name_gram_ids = self._register(product)
+        
+        while len(self._postings) < len(self._vocabulary):
+            self._postings.append(_Postings())
+            self._name_postings.append(_Postings())
+        for gram_id in gram_ids:
+            self._postings[gram_id].append(slot)
+        for gram_id in name_gram_ids:
+            self._name_postings[gram_id].append(slot)
+    
+    def remove(self, product_id: int):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._remove, (product_id,)))
+            self._remove(product_id)
+    
+    def _remove(self, product_id: int):
+        slot = self._slot_of.pop(product_id, None)
+        if slot is not None:
+            self._alive[slot] = False
+            self._columns = None
+            dead = len(self._product_ids) - len(self._slot_of)
+            if dead >= self.compact_min_dead and dead > self.compact_ratio * len(self._slot_of):
+                self._compact()
+    
+    def _compact(self):
+        """Drop tombstoned slots: renumber the live ones in order and rewrite every posting list"""
+        alive = np.array(self._alive, dtype=bool)
+        renumbered = np.cumsum(alive, dtype=np.int32) - 1
+        renumbered[~alive] = -1
+        
+        def rewrite(postings: _Postings) -> _Postings:
+            slots = renumbered[postings.array()]
+            return _Postings(slots[slots >= 0])
+        
+        self._postings = [rewrite(postings) for postings in self._postings]
+        self._name_postings = [rewrite(postings) for postings in self._name_postings]
+        live_slots = np.flatnonzero(alive).tolist()
+        for field in ("_product_ids", "_gram_counts", "_prices", "_stock", "_categories"):
+            values = getattr(self, field)
+            setattr(self, field, [values[slot] for slot in live_slots])
+        self._alive = [True] * len(live_slots)
+        self._slot_of = {product_id: slot for slot, product_id in enumerate(self._product_ids)}
+        self._columns = None
+    
+    def set_stock(self, stock: Dict[int, int]):
+        """Update stock levels (used for ranking) without re-indexing the products' text"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._set_stock, (stock,)))
+            self._set_stock(stock)
+    
+    def _set_stock(self, stock: Dict[int, int]):
+        for product_id, quantity in stock.items():
+            slot = self._slot_of.get(product_id)
+            if slot is not None:
+                self._stock[slot] = int(quantity)
+                self._columns = None
+    
+    def _register(self, product) -> Tuple[List[int], List[int]]:
+        """Assign the product a new slot and return its (all, name-only) trigram ids"""
+        name_grams = trigrams(product.name or "")
+        grams = set(name_grams)
+        grams.update(trigrams(product.category or ""))
+        grams.update(trigrams(product.description or ""))
+        
+        vocabulary = self._vocabulary
+        for gram in grams.difference(vocabulary):
+            vocabulary[gram] = len(vocabulary)
+        gram_ids = list(map(vocabulary.__getitem__, grams))
+        name_gram_ids = list(map(vocabulary.__getitem__, name_grams))
+        
+        self._slot_of[product.id] = len(self._product_ids)
+        self._product_ids.append(product.id)
+        self._alive.append(True)
+        self._gram_counts.append(len(gram_ids))
+        self._prices.append(float(product.price or 0.0))
+        self._stock.append(int(product.stock_quantity or 0))
+        self._categories.append(normalize_category(product.category) or "")
+        self._columns = None
+        return gram_ids, name_gram_ids
+    
+    def _column_arrays(self) -> Tuple[np.ndarray, ...]:
+        if self._columns is None:
+            self._columns = (
+                np.array(self._product_ids, dtype=np.int64),
+                np.array(self._alive, dtype=bool),
+                np.array(self._gram_counts, dtype=np.float32),
+                np.array(self._prices, dtype=np.float64),
+                np.array(self._stock, dtype=np.int64),
+                np.array(self._categories, dtype=str),
+            )
+        return self._columns
+    
+    def search(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        category_prefix: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_similarity: float = 0.3,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank products by trigram similarity to `query`.
+        Returns (product_ids, scores) ordered best first; ties are broken by
+        stock (desc) then price (asc), matching the SQL premium ordering.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        with self._lock:
+            product_ids, alive, gram_counts, prices, stock, categories = self._column_arrays()
+            slot_count = len(product_ids)
+            
+            query_ids = [self._vocabulary[g] for g in query_grams if g in self._vocabulary]
+            matched = [self._postings[i].array() for i in query_ids]
+            if not matched:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            hits = np.bincount(np.concatenate(matched), minlength=slot_count).astype(np.float32)
+            
+            name_matched = [self._name_postings[i].array() for i in query_ids]
+            name_hits = (
+                np.bincount(np.concatenate(name_matched), minlength=slot_count).astype(np.float32)
+                if name_matched else np.zeros(slot_count, dtype=np.float32)
+            )
+        
+        # Share of the query's trigrams found in the product (typo tolerant recall),
+        # boosted when they appear in the name and damped for very long documents
+        coverage = hits / len(query_grams)
+        name_coverage = name_hits / len(query_grams)
+        length_penalty = 1.0 / (1.0 + np.log1p(np.maximum(gram_counts - hits, 0.0)) * 0.05)
+        scores = (coverage + self.name_weight * name_coverage) / (1.0 + self.name_weight) * length_penalty
+        
+        mask = alive & (coverage >= min_similarity)
+        if min_price is not None:
+            mask &= prices >= min_price
+        if max_price is not None:
+            mask &= prices <= max_price
+        normalized = normalize_category(category)
+        if normalized:
+            mask &= categories == normalized
+        prefix = normalize_category(category_prefix)
+        if prefix:
+            candidates = np.flatnonzero(mask)
+            keep = np.char.startswith(categories[candidates], prefix)
+            mask[:] = False
+            mask[candidates[keep]] = True
+        
+        slots = np.flatnonzero(mask)
+        if len(slots) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        order = np.lexsort((prices[slots], -stock[slots], -scores[slots]))
+        ranked = slots[order]
+        return product_ids[ranked], scores[ranked]
+
+search_index = TrigramIndex()
+
+def build_search_index(db: Session):
+    """Load every product into the search index"""
+    search_index.build(
+        db.query(
+            ProductModel.id,
+            ProductModel.name,
+            ProductModel.description,
+            ProductModel.category,
+            ProductModel.price,
+            ProductModel.stock_quantity
+        ).yield_per(1000)
+    )
+
+def _snapshot(product) -> SimpleNamespace:
+    # Attributes are expired after commit, so capture what the index needs at flush time
+    return SimpleNamespace(
+        id=product.id,
+        name=product.name,
+        description=product.description,
+        category=product.category,
+        price=product.price,
+        stock_quantity=product.stock_quantity
+    )
+
+@event.listens_for(Session, "after_flush")
+def _collect_indexed_changes(session, flush_context):
+    changes = session.info.setdefault("search_index_changes", {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, ProductModel):
+            changes[obj.id] = _snapshot(obj)
+    for obj in session.deleted:
+        if isinstance(obj, ProductModel):
+            changes[obj.id] = None
+
+def record_stock_changes(session: Session, stock: Dict[int, int]):
+    """Queue stock levels written with bulk UPDATEs (which skip the ORM events) for the index"""
+    session.info.setdefault("search_index_stock", {}).update(stock)
+
+@event.listens_for(Session, "after_commit")
+def _apply_indexed_changes(session):
+    stock = session.info.pop("search_index_stock", None)
+    if stock:
+        search_index.set_stock(stock)
+    changes = session.info.pop("search_index_changes", None)
+    if not changes:
+        return
+    for product_id, product in changes.items():
+        if product is None:
+            search_index.remove(product_id)
+        else:
+            search_index.upsert(product)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_indexed_changes(session):
+    session.info.pop("search_index_changes", None)
+    session.info.pop("search_index_stock", None)
@@ -0,0 +1,187 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Solana payment quotes from the Sienna payment API.
+
+Identical quotes (same network, amount and currency) are fetched once: while
+a fetch is in flight, every other request for that quote, from any thread or
+event loop, waits for its result. Quotes are then reused for a few seconds.
+If the API is slow or down, calls give up at a short deadline and fall back
+to the last quote fetched within the stale window, if there is one.
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+
+from app.services.http_client import CircuitBreaker, CircuitOpenError, ServiceClient
+
+logger = logging.getLogger(__name__)
+
+SOLANA_PAYMENT_API = os.getenv("SOLANA_PAYMENT_API", "https://api.projectsienna.xyz/api/payment")
+SOLANA_PAYMENT_NETWORK = os.getenv("SOLANA_PAYMENT_NETWORK", "devnet")
+SOLANA_QUOTE_CACHE_TTL = float(os.getenv("SOLANA_QUOTE_CACHE_TTL", "5"))
+# How old a quote may be when it is served because the API is failing
+SOLANA_QUOTE_STALE_TTL = float(os.getenv("SOLANA_QUOTE_STALE_TTL", "60"))
+SOLANA_QUOTE_DEADLINE = float(os.getenv("SOLANA_QUOTE_DEADLINE", "3"))
+
+QuoteKey = Tuple[str, float, str]
+
+class SolanaQuoteUnavailable(Exception):
+    """The payment API could not produce a quote in time and no recent quote was available"""
+
+class SolanaQuoteRejected(Exception):
+    """The payment API answered with a client error"""
+    
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class SolanaQuoteClient:
+    """Coalescing, short-TTL cached client for Solana payment quotes"""
+    
+    def __init__(
+        self,
+        service: ServiceClient,
+        network: str = SOLANA_PAYMENT_NETWORK,
+        cache_ttl: float = SOLANA_QUOTE_CACHE_TTL,
+        stale_ttl: float = SOLANA_QUOTE_STALE_TTL,
+        max_cached_quotes: int = 1000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.service = service
+        self.network = network
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = max(stale_ttl, cache_ttl)
+        self.max_cached_quotes = max_cached_quotes
+        self.clock = clock
+        self._quotes: "OrderedDict[QuoteKey, Tuple[float, dict]]" = OrderedDict()
+        self._in_flight: Dict[QuoteKey, Future] = {}
+        self._lock = threading.Lock()
+    
+    def _cached(self, key: QuoteKey, max_age: float) -> Optional[dict]:
+        entry = self._quotes.get(key)
+        if entry is None:
+            return None
+        fetched_at, payment = entry
+        age = self.clock() - fetched_at
+        if age >= self.stale_ttl:
+            del self._quotes[key]
+            return None
+        return payment if age < max_age else None
+    
+    def _store(self, key: QuoteKey, payment: dict):
+        self._quotes[key] = (self.clock(), payment)
+        self._quotes.move_to_end(key)
+        while len(self._quotes) > self.max_cached_quotes:
+            self._quotes.popitem(last=False)
+    
+    async def quote(self, amount: float, currency: Optional[str] = "USDC") -> dict:
+        """
+        Payment details for `amount`; each caller gets its own copy.
+        Raises SolanaQuoteRejected when the API refuses the request and
+        SolanaQuoteUnavailable when it cannot be reached in time.
+        """
+        key = (self.network, round(float(amount), 2), currency or "")
+        with self._lock:
+            payment = self._cached(key, self.cache_ttl)
+            if payment is not None:
+                return copy.deepcopy(payment)
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        
+        try:
+            if leader:
+                payment = await self._lead(key, future, amount, currency)
+            else:
+                # Shielded: a waiter giving up must not cancel the shared fetch
+                payment = await asyncio.shield(asyncio.wrap_future(future))
+        except SolanaQuoteUnavailable as e:
+            with self._lock:
+                payment = self._cached(key, self.stale_ttl)
+            if payment is None:
+                raise
+            logger.warning(f"⚠️ Serving a cached Solana quote for {key[1]} {key[2]}: {e}")
+        return copy.deepcopy(payment)
+    
+    async def _lead(self, key: QuoteKey, future: Future, amount: float, currency: Optional[str]) -> dict:
+        try:
+            payment = await self._fetch(amount, currency)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.set_exception(SolanaQuoteUnavailable("Quote request was cancelled"))
+            raise
+        with self._lock:
+            self._store(key, payment)
+            self._in_flight.pop(key, None)
+        future.set_result(payment)
+        return payment
+    
+    async def _fetch(self, amount: float, currency: Optional[str]) -> dict:
+        params = {"network": self.network, "amount": amount}
+        if currency:
+            params["currency"] = currency
+        headers = {}
+        api_key = os.getenv("SOLANA_PAYMENT_API_KEY")
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        
+        try:
+            response = await self.service.get("", params=params, headers=headers)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            raise SolanaQuoteUnavailable(str(e) or type(e).__name__)
+        
+        if response.status_code >= 500:
+            raise SolanaQuoteUnavailable(f"Solana payment API returned {response.status_code}")
+        if response.status_code >= 400:
+            raise SolanaQuoteRejected(response.status_code, response.text)
+        
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        payment = body.get("payment") if isinstance(body, dict) else None
+        if not payment:
+            raise SolanaQuoteUnavailable("Invalid response from Solana payment API")
+        
+        payment["amountUSDC"] = payment.get("amountUSDC") or amount
+        payment["network"] = self.network
+        return payment
+    
+    def clear_cache(self):
+        with self._lock:
+            self._quotes.clear()
+    
+    async def aclose(self):
+        await self.service.aclose()
+
+solana_quote_client = SolanaQuoteClient(
+    ServiceClient(
+        SOLANA_PAYMENT_API,
+        timeout=SOLANA_QUOTE_DEADLINE,
+        deadline=SOLANA_QUOTE_DEADLINE,
+        retries=1,
+        breaker=CircuitBreaker(failure_threshold=5, reset_timeout=15.0)
+    )
+)
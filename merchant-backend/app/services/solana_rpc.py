@@ -0,0 +1,193 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Process-wide Solana RPC clients.
+
+Every payment endpoint borrows an AsyncClient from this pool instead of
+building its own, so RPC calls reuse keep-alive connections to the cluster
+and never block the event loop. Clients are created at startup and handed
+out round-robin per cluster. A recent blockhash per cluster is kept warm in
+memory, so signing a payment does not wait for one.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SOLANA_RPC_URLS = {
+    "mainnet": os.getenv("SOLANA_MAINNET_RPC", "https://api.mainnet-beta.solana.com"),
+    "devnet": os.getenv("SOLANA_DEVNET_RPC", "https://api.devnet.solana.com"),
+}
+SOLANA_RPC_CLIENTS_PER_CLUSTER = int(os.getenv("SOLANA_RPC_CLIENTS_PER_CLUSTER", "2"))
+SOLANA_RPC_TIMEOUT = float(os.getenv("SOLANA_RPC_TIMEOUT", "10"))
+SOLANA_RPC_COMMITMENT = "confirmed"
+# A blockhash stays usable for ~150 blocks (60-90s); refresh well inside that and never sign with one older
+# than half of it, which leaves the transaction time to land before its last valid block height
+SOLANA_BLOCKHASH_REFRESH_INTERVAL = float(os.getenv("SOLANA_BLOCKHASH_REFRESH_INTERVAL", "20"))
+SOLANA_BLOCKHASH_MAX_AGE = float(os.getenv("SOLANA_BLOCKHASH_MAX_AGE", "30"))
+
+def cluster_for(network: Optional[str]) -> str:
+    """Map a network name from a quote or request to a pooled cluster; anything but mainnet is devnet"""
+    return "mainnet" if network in ("mainnet", "mainnet-beta") else "devnet"
+
+def create_async_client(endpoint: str, commitment: str = SOLANA_RPC_COMMITMENT, timeout: float = SOLANA_RPC_TIMEOUT):
+    """solana-py AsyncClient; raises ImportError when the solana package is not installed"""
+    from solana.rpc.async_api import AsyncClient
+    from solana.rpc.commitment import Commitment
+    return AsyncClient(endpoint, Commitment(commitment), timeout=timeout)
+
+class SolanaRpcPool:
+    """AsyncClients per cluster, created once and shared by all requests"""
+    
+    def __init__(
+        self,
+        endpoints: Dict[str, str] = SOLANA_RPC_URLS,
+        clients_per_cluster: int = SOLANA_RPC_CLIENTS_PER_CLUSTER,
+        client_factory: Callable[[str], Any] = create_async_client
+    ):
+        self.endpoints = dict(endpoints)
+        self.clients_per_cluster = max(1, clients_per_cluster)
+        self.client_factory = client_factory
+        self._clients: Dict[str, List[Any]] = {}
+        self._rotation: Dict[str, Iterator[Any]] = {}
+        self._lock = threading.Lock()
+    
+    def _open(self, cluster: str) -> List[Any]:
+        clients = [self.client_factory(self.endpoints[cluster]) for _ in range(self.clients_per_cluster)]
+        self._clients[cluster] = clients
+        self._rotation[cluster] = itertools.cycle(clients)
+        return clients
+    
+    def start(self):
+        """Create the clients for every cluster; without the solana package, payments keep their fallback"""
+        with self._lock:
+            try:
+                for cluster in self.endpoints:
+                    if cluster not in self._clients:
+                        self._open(cluster)
+            except ImportError as e:
+                logger.warning(f"⚠️ Solana RPC pool not started, solana package unavailable: {e}")
+                return
+        logger.info(f"🔗 Solana RPC pool ready: {self.clients_per_cluster} client(s) for {', '.join(self.endpoints)}")
+    
+    def client(self, network: Optional[str]):
+        """A pooled AsyncClient for the network's cluster, created on first use if start() was not called"""
+        cluster = cluster_for(network)
+        with self._lock:
+            if cluster not in self._rotation:
+                self._open(cluster)
+            return next(self._rotation[cluster])
+    
+    async def close(self):
+        with self._lock:
+            clients = [client for pool in self._clients.values() for client in pool]
+            self._clients.clear()
+            self._rotation.clear()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not close Solana RPC client: {e}")
+
+class BlockhashPrefetcher:
+    """
+    Recent blockhash and its last valid block height per cluster, kept in memory.
+    A background task refreshes every cluster on a schedule; a read that finds
+    no blockhash, or one older than max_age, refreshes that cluster on demand.
+    Concurrent refreshes of a cluster share one RPC call.
+    """
+    
+    def __init__(
+        self,
+        pool: SolanaRpcPool,
+        refresh_interval: float = SOLANA_BLOCKHASH_REFRESH_INTERVAL,
+        max_age: float = SOLANA_BLOCKHASH_MAX_AGE,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.clock = clock
+        # cluster -> (blockhash, last_valid_block_height, fetched_at)
+        self._blockhashes: Dict[str, Tuple[Any, int, float]] = {}
+        self._refreshing: Dict[str, "asyncio.Task"] = {}
+        self._task: Optional["asyncio.Task"] = None
+    
+    async def _fetch(self, cluster: str) -> Tuple[Any, int]:
+        response = await self.pool.client(cluster).get_latest_blockhash()
+        blockhash, last_valid_block_height = response.value.blockhash, response.value.last_valid_block_height
+        self._blockhashes[cluster] = (blockhash, last_valid_block_height, self.clock())
+        return blockhash, last_valid_block_height
+    
+    async def refresh(self, network: Optional[str]) -> Tuple[Any, int]:
+        """Fetch a new blockhash for the network's cluster now; returns (blockhash, last_valid_block_height)"""
+        cluster = cluster_for(network)
+        task = self._refreshing.get(cluster)
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refreshing[cluster] = asyncio.ensure_future(self._fetch(cluster))
+        # Shielded: a caller giving up must not cancel the fetch others are waiting on
+        return await asyncio.shield(task)
+    
+    async def latest(self, network: Optional[str]) -> Tuple[Any, int]:
+        """The cached (blockhash, last_valid_block_height), refreshed first if missing or too old"""
+        entry = self._blockhashes.get(cluster_for(network))
+        if entry is not None and self.clock() - entry[2] < self.max_age:
+            return entry[0], entry[1]
+        return await self.refresh(network)
+    
+    async def blockhash(self, network: Optional[str]):
+        return (await self.latest(network))[0]
+    
+    def invalidate(self, network: Optional[str]):
+        """Forget the cluster's blockhash (e.g. the cluster rejected it); the next read refreshes it"""
+        self._blockhashes.pop(cluster_for(network), None)
+    
+    async def _refresh_quietly(self, cluster: str):
+        try:
+            await self.refresh(cluster)
+        except ImportError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Could not refresh the {cluster} blockhash: {e}")
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.gather(*(self._refresh_quietly(cluster) for cluster in self.pool.endpoints))
+            except ImportError as e:
+                logger.warning(f"⚠️ Blockhash prefetching stopped, solana package unavailable: {e}")
+                return
+            await asyncio.sleep(self.refresh_interval)
+    
+    def start(self):
+        """Start refreshing in the background; call from the event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        for task in self._refreshing.values():
+            task.cancel()
+        self._refreshing.clear()
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+solana_rpc_pool = SolanaRpcPool()
+blockhash_prefetcher = BlockhashPrefetcher(solana_rpc_pool)
@@ -0,0 +1,285 @@
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps entries per process; "sqlite" shares them between workers through one WAL database file
+TTL_STORE_BACKEND = os.getenv("TTL_STORE_BACKEND", "memory")
+TTL_STORE_PATH = os.getenv("TTL_STORE_PATH", "./merchant_ttl.db")
+TTL_STORE_MAX_ENTRIES = int(os.getenv("TTL_STORE_MAX_ENTRIES", "10000"))
+
+class TTLStore(ABC):
+    """
+    Key/value store whose entries expire after a per-entry TTL.
+    
+    Expired entries are never returned. They are reclaimed in expiry order,
+    so purging k entries costs O(k log n). When more than max_entries are
+    live, the entries closest to expiry are evicted first.
+    """
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+    
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        ...
+    
+    @abstractmethod
+    def pop(self, key: str) -> Optional[Any]:
+        """Remove and return an entry; only one caller can pop a given entry"""
+    
+    @abstractmethod
+    def purge_expired(self) -> int:
+        ...
+    
+    @abstractmethod
+    def clear(self):
+        ...
+    
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+class MemoryTTLStore(TTLStore):
+    """Per-process TTL store backed by a dict and a min-heap of expiry times"""
+    
+    def __init__(self, max_entries: int = TTL_STORE_MAX_ENTRIES, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: Dict[str, Tuple[float, int, Any]] = {}
+        # (expires_at, seq, key); entries replaced or popped stay in the heap until they surface
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+    
+    def _is_current(self, seq: int, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] == seq
+    
+    def _purge(self, now: float) -> int:
+        purged = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, seq, key = heapq.heappop(self._heap)
+            if self._is_current(seq, key):
+                del self._entries[key]
+                purged += 1
+        return purged
+    
+    def _evict_overflow(self):
+        while len(self._entries) > self.max_entries:
+            expires_at, seq, key = heapq.heappop(self._heap)
+            if self._is_current(seq, key):
+                del self._entries[key]
+        # Keep stale heap entries from outgrowing the live set
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [
+                (expires_at, seq, key) for key, (expires_at, seq, _) in self._entries.items()
+            ]
+            heapq.heapify(self._heap)
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self.clock():
+                del self._entries[key]
+                return None
+            return entry[2]
+    
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            now = self.clock()
+            self._purge(now)
+            seq = next(self._seq)
+            self._entries[key] = (now + ttl, seq, value)
+            heapq.heappush(self._heap, (now + ttl, seq, key))
+            self._evict_overflow()
+    
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= self.clock():
+                return None
+            return entry[2]
+    
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge(self.clock())
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._heap.clear()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class SQLiteTTLStore(TTLStore):
+    """
+    TTL store in a SQLite database in WAL mode, shared by every worker that opens the same file.
+    
+    Values are stored as JSON. Several stores can share one file; each one
+    only sees its own namespace. Expiry and eviction walk the
+    (namespace, expires_at) index, so they never scan the table, and triggers
+    keep a per-namespace row count so set() checks the bound with one lookup.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        max_entries: int = TTL_STORE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time
+    ):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ttl_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_ttl_entries_expiry ON ttl_entries (namespace, expires_at)"
+        )
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ttl_counts (
+                    namespace TEXT PRIMARY KEY,
+                    entries INTEGER NOT NULL
+                )
+            """)
+            # Upserts take the UPDATE path for existing keys, so only new and deleted rows change the count
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS ttl_entries_counted_insert AFTER INSERT ON ttl_entries BEGIN
+                    UPDATE ttl_counts SET entries = entries + 1 WHERE namespace = NEW.namespace;
+                END
+            """)
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS ttl_entries_counted_delete AFTER DELETE ON ttl_entries BEGIN
+                    UPDATE ttl_counts SET entries = entries - 1 WHERE namespace = OLD.namespace;
+                END
+            """)
+            # Seeded once per namespace, from entries written before the count existed
+            self._conn.execute(
+                "INSERT OR IGNORE INTO ttl_counts (namespace, entries) "
+                "SELECT ?, COUNT(*) FROM ttl_entries WHERE namespace = ?",
+                (namespace, namespace)
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM ttl_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, key, self.clock())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def set(self, key: str, value: Any, ttl: float):
+        payload = json.dumps(value)
+        with self._lock:
+            now = self.clock()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge(now)
+                self._conn.execute(
+                    "INSERT INTO ttl_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                    (self.namespace, key, payload, now + ttl)
+                )
+                self._evict_overflow()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "DELETE FROM ttl_entries WHERE namespace = ? AND key = ? RETURNING value, expires_at",
+                (self.namespace, key)
+            ).fetchone()
+        if row is None or row[1] <= self.clock():
+            return None
+        return json.loads(row[0])
+    
+    def _purge(self, now: float) -> int:
+        return self._conn.execute(
+            "DELETE FROM ttl_entries WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, now)
+        ).rowcount
+    
+    def _evict_overflow(self):
+        (count,) = self._conn.execute(
+            "SELECT entries FROM ttl_counts WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                """
+                DELETE FROM ttl_entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM ttl_entries WHERE namespace = ? ORDER BY expires_at LIMIT ?
+                )
+                """,
+                (self.namespace, self.namespace, count - self.max_entries)
+            )
+    
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge(self.clock())
+    
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM ttl_entries WHERE namespace = ?", (self.namespace,))
+    
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM ttl_entries WHERE namespace = ? AND expires_at > ?",
+                (self.namespace, self.clock())
+            ).fetchone()
+        return count
+    
+    def close(self):
+        self._conn.close()
+
+def create_ttl_store(namespace: str, max_entries: int = TTL_STORE_MAX_ENTRIES) -> TTLStore:
+    """Build the TTL store configured by TTL_STORE_BACKEND for one namespace"""
+    if TTL_STORE_BACKEND == "sqlite":
+        logger.info(f"🗄️ TTL store '{namespace}' shared via {TTL_STORE_PATH}")
+        return SQLiteTTLStore(TTL_STORE_PATH, namespace, max_entries=max_entries)
+    if TTL_STORE_BACKEND != "memory":
+        raise ValueError(f"Unknown TTL_STORE_BACKEND: {TTL_STORE_BACKEND}")
+    return MemoryTTLStore(max_entries=max_entries)
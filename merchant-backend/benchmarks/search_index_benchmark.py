@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# © 2025 Visa.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Latency benchmark: premium search over the trigram index vs. the SQL ilike scan.
+
+    python benchmarks/search_index_benchmark.py --products 1000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.models import Base
+from app.routes.products import _premium_search
+from app.services.search_index import search_index, build_search_index
+
+ADJECTIVES = ["wireless", "organic", "vintage", "portable", "ergonomic", "premium", "compact",
+              "waterproof", "handmade", "smart", "classic", "modern", "rustic", "digital"]
+NOUNS = ["headphones", "keyboard", "blender", "backpack", "lamp", "watch", "camera", "kettle",
+         "jacket", "notebook", "speaker", "monitor", "sneakers", "grinder", "tent", "mug"]
+BRANDS = ["acme", "zenith", "nova", "orbit", "summit", "harbor", "lumen", "vertex"]
+CATEGORIES = ["Electronics", "Kitchen", "Sports", "Home", "Books", "Outdoors", "Apparel", "Office"]
+
+QUERIES = ["wireless headphones", "wireles hedphones", "ergonomic keyboard", "vintage camra",
+           "portable speaker", "smart watch", "waterprof jacket", "rustic mug"]
+
+def populate(db_path: str, count: int, seed: int = 7):
+    """Bulk load synthetic products straight through sqlite3"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    categories = {name: i + 1 for i, name in enumerate(CATEGORIES)}
+    conn.executemany(
+        "INSERT INTO categories (id, name, display_name) VALUES (?, ?, ?)",
+        [(cid, name.lower(), name) for name, cid in categories.items()]
+    )
+    
+    created_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    
+    def rows():
+        for i in range(count):
+            adjective, noun, brand = rng.choice(ADJECTIVES), rng.choice(NOUNS), rng.choice(BRANDS)
+            category = rng.choice(CATEGORIES)
+            yield (
+                f"{brand.title()} {adjective.title()} {noun.title()} {i}",
+                f"A {adjective} {noun} by {brand} for everyday use",
+                round(rng.uniform(5, 500), 2),
+                category,
+                categories[category],
+                rng.randint(0, 50),
+                created_at,
+            )
+    
+    conn.executemany(
+        "INSERT INTO products (name, description, price, category, category_id, stock_quantity, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows()
+    )
+    conn.commit()
+    conn.close()
+
+def time_queries(db, repeats: int):
+    latencies = []
+    for _ in range(repeats):
+        for query in QUERIES:
+            started = time.perf_counter()
+            _premium_search(db, query, None, None, None, None, 20, 0)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def report(label: str, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<16} median {statistics.median(latencies):9.2f} ms   p95 {p95:9.2f} ms")
+    return statistics.median(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(bind=engine)
+        
+        print(f"📦 Loading {args.products:,} products...")
+        started = time.perf_counter()
+        populate(db_path, args.products)
+        print(f"   loaded in {time.perf_counter() - started:.1f}s")
+        
+        db = sessionmaker(bind=engine)()
+        try:
+            search_index.clear()
+            sql_median = report("SQL ilike scan", time_queries(db, args.repeats))
+            
+            started = time.perf_counter()
+            build_search_index(db)
+            print(f"🔎 Index built in {time.perf_counter() - started:.1f}s")
+            index_median = report("Trigram index", time_queries(db, args.repeats))
+        finally:
+            db.close()
+            engine.dispose()
+    
+    print(f"⚡ Speedup (median): {sql_median / index_median:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -21,8 +21,9 @@ def seed_monkedao_products():
     db = SessionLocal()
     
     try:
-        # Clear existing products
-        db.query(Product).delete()
+        # Clear existing products one by one, so each leaves a tombstone for change feed consumers
+        for product in db.query(Product).all():
+            db.delete(product)
         
         # MonkeDAO Art Products - Solana Monkey Business inspired
         # All prices between $0.00 - $0.30 for micro-transactions
@@ -19,8 +19,9 @@ def seed_shanni_art_products():
     db = SessionLocal()
     
     try:
-        # Clear existing products
-        db.query(Product).delete()
+        # Clear existing products one by one, so each leaves a tombstone for change feed consumers
+        for product in db.query(Product).all():
+            db.delete(product)
         
         # Shanni Art Products - Inspired by Instagram art style
         products = [
@@ -8,7 +8,7 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 """
-Script to update the database schema with new columns for the orders table
+Script to update the database schema of an existing merchant database
 """
 
 import sqlite3
@@ -18,8 +18,145 @@ from pathlib import Path
 # Database file path
 DB_PATH = Path(__file__).parent / "merchant.db"
 
-def update_database():
+def normalize_category(name):
+    """Mirror of app.models.models.normalize_category (kept local so the script has no app imports)"""
+    if name is None:
+        return None
+    normalized = " ".join(name.split()).lower()
+    return normalized or None
+
+def add_order_columns(cursor):
     """Add new columns to the orders table"""
+    # Check if the new columns already exist
+    cursor.execute("PRAGMA table_info(orders)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    new_columns = [
+        ('billing_address', 'TEXT'),
+        ('payment_method', 'VARCHAR(50)'),
+        ('billing_different', 'BOOLEAN DEFAULT 0'),
+        ('card_last_four', 'VARCHAR(4)'),
+        ('card_brand', 'VARCHAR(20)'),
+        ('payment_status', 'VARCHAR(20) DEFAULT "pending"')
+    ]
+    
+    for column_name, column_type in new_columns:
+        if column_name not in columns:
+            print(f"Adding column: {column_name}")
+            cursor.execute(f"ALTER TABLE orders ADD COLUMN {column_name} {column_type}")
+        else:
+            print(f"Column {column_name} already exists")
+
+def migrate_categories(cursor):
+    """Normalize products.category into the categories lookup table"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            display_name VARCHAR(100) NOT NULL,
+            created_at DATETIME
+        )
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_categories_name ON categories (name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_categories_id ON categories (id)")
+    
+    cursor.execute("PRAGMA table_info(products)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'category_id' not in columns:
+        print("Adding column: category_id")
+        cursor.execute("ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES categories (id)")
+    else:
+        print("Column category_id already exists")
+    
+    # Backfill the lookup table and product references
+    cursor.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL")
+    backfilled = 0
+    for (display_name,) in cursor.fetchall():
+        normalized = normalize_category(display_name)
+        if normalized is None:
+            continue
+        cursor.execute(
+            "INSERT OR IGNORE INTO categories (name, display_name, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (normalized, display_name.strip())
+        )
+        cursor.execute("SELECT id FROM categories WHERE name = ?", (normalized,))
+        category_id = cursor.fetchone()[0]
+        cursor.execute(
+            "UPDATE products SET category_id = ? WHERE category = ? AND category_id IS NOT ?",
+            (category_id, display_name, category_id)
+        )
+        backfilled += cursor.rowcount
+    print(f"Linked {backfilled} products to categories")
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_products_category_id_price ON products (category_id, price)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_products_price ON products (price)")
+
+def migrate_product_versions(cursor):
+    """Add updated_at/version to products and the tables backing the catalog change feed"""
+    cursor.execute("PRAGMA table_info(products)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'updated_at' not in columns:
+        print("Adding column: updated_at")
+        cursor.execute("ALTER TABLE products ADD COLUMN updated_at DATETIME")
+        cursor.execute("UPDATE products SET updated_at = created_at")
+    else:
+        print("Column updated_at already exists")
+    
+    if 'version' not in columns:
+        print("Adding column: version")
+        cursor.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        # Existing rows get distinct versions in id order
+        cursor.execute("UPDATE products SET version = id")
+    else:
+        print("Column version already exists")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_products_version ON products (version)")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_tombstones (
+            product_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            deleted_at DATETIME
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_product_tombstones_version ON product_tombstones (version)")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_sequence (
+            id INTEGER PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("SELECT MAX(version) FROM products")
+    latest = cursor.fetchone()[0] or 0
+    cursor.execute("INSERT OR IGNORE INTO catalog_sequence (id, value) VALUES (1, ?)", (latest,))
+    cursor.execute("UPDATE catalog_sequence SET value = MAX(value, ?) WHERE id = 1", (latest,))
+
+def migrate_cart_activity(cursor):
+    """Index cart activity so abandoned carts can be collected without table scans, and version carts for the read cache"""
+    cursor.execute("UPDATE carts SET updated_at = created_at WHERE updated_at IS NULL")
+    cursor.execute("PRAGMA table_info(carts)")
+    if 'version' not in [column[1] for column in cursor.fetchall()]:
+        print("Adding column: carts.version")
+        cursor.execute("ALTER TABLE carts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_carts_updated_at ON carts (updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_cart_items_cart_id ON cart_items (cart_id)")
+
+def migrate_order_history(cursor):
+    """Index order history lookups by customer, status and date, and order items by order"""
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_orders_customer_email_created_at "
+        "ON orders (customer_email, created_at DESC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_orders_status_created_at "
+        "ON orders (status, created_at DESC)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)")
+
+def update_database():
+    """Apply all schema migrations to the merchant database"""
     
     if not DB_PATH.exists():
         print("Database file not found. Please run the backend server first to create the database.")
@@ -29,25 +166,11 @@ def update_database():
     cursor = conn.cursor()
     
     try:
-        # Check if the new columns already exist
-        cursor.execute("PRAGMA table_info(orders)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        new_columns = [
-            ('billing_address', 'TEXT'),
-            ('payment_method', 'VARCHAR(50)'),
-            ('billing_different', 'BOOLEAN DEFAULT 0'),
-            ('card_last_four', 'VARCHAR(4)'),
-            ('card_brand', 'VARCHAR(20)'),
-            ('payment_status', 'VARCHAR(20) DEFAULT "pending"')
-        ]
-        
-        for column_name, column_type in new_columns:
-            if column_name not in columns:
-                print(f"Adding column: {column_name}")
-                cursor.execute(f"ALTER TABLE orders ADD COLUMN {column_name} {column_type}")
-            else:
-                print(f"Column {column_name} already exists")
+        add_order_columns(cursor)
+        migrate_categories(cursor)
+        migrate_product_versions(cursor)
+        migrate_cart_activity(cursor)
+        migrate_order_history(cursor)
         
         conn.commit()
         print("Database schema updated successfully!")
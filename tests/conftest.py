@@ -4,6 +4,7 @@
 
 import pytest
 import base64
+import httpx
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
 from cryptography.hazmat.backends import default_backend
@@ -60,3 +61,324 @@ def ed25519_keypair():
         'private_b64': base64.b64encode(private_bytes).decode('utf-8'),
         'public_b64': base64.b64encode(public_bytes).decode('utf-8')
     }
+
+
+# Merchant backend fixtures
+#
+# The merchant backend is imported as the `app` package from merchant-backend/,
+# backed by a throwaway SQLite database per test.
+
+import sys
+from pathlib import Path
+
+MERCHANT_BACKEND_DIR = Path(__file__).resolve().parent.parent / "merchant-backend"
+if str(MERCHANT_BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(MERCHANT_BACKEND_DIR))
+
+
+@pytest.fixture
+def merchant_engine(tmp_path):
+    """SQLite engine with the merchant schema created"""
+    from sqlalchemy import create_engine
+    from app.models.models import Base
+    
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'merchant.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def merchant_session_factory(merchant_engine):
+    """Session factory bound to the test engine"""
+    from sqlalchemy.orm import sessionmaker
+    return sessionmaker(autocommit=False, autoflush=False, bind=merchant_engine)
+
+
+@pytest.fixture
+def merchant_db(merchant_session_factory):
+    """Database session for arranging and inspecting test data"""
+    db = merchant_session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def make_product(merchant_db):
+    """Create a product and return its id"""
+    from app.models.models import Product
+
+    def make(stock=100, name="Poster", price=10.0, category="Art"):
+        product = Product(name=name, price=price, category=category, stock_quantity=stock)
+        merchant_db.add(product)
+        merchant_db.commit()
+        return product.id
+
+    return make
+
+
+@pytest.fixture
+def make_cart(merchant_db):
+    """Create a cart holding `items` ({product_id: quantity}), last active `idle_hours` ago, and return its session id"""
+    import uuid
+    from datetime import datetime, timedelta
+    from app.models.models import Cart, CartItem
+
+    def make(items, session_id=None, idle_hours=0):
+        touched = datetime.utcnow() - timedelta(hours=idle_hours)
+        cart = Cart(session_id=session_id or str(uuid.uuid4()), created_at=touched, updated_at=touched)
+        merchant_db.add(cart)
+        merchant_db.flush()
+        merchant_db.add_all([
+            CartItem(cart_id=cart.id, product_id=product_id, quantity=quantity)
+            for product_id, quantity in items.items()
+        ])
+        merchant_db.commit()
+        return cart.session_id
+
+    return make
+
+
+@pytest.fixture
+def make_order(merchant_db, make_product):
+    """
+    Create an order numbered ORD-TEST-<n> with `items` units of a 10.0 Poster.
+    Orders are placed one minute apart starting a day ago unless `created_at` is given.
+    """
+    from datetime import datetime, timedelta
+    from app.models.models import Order, OrderItem
+
+    product_ids = []
+    start = datetime.utcnow() - timedelta(days=1)
+    created = []
+
+    def make(status="confirmed", email="customer@example.com", items=2, created_at=None):
+        if not product_ids:
+            product_ids.append(make_product())
+        created_at = created_at or start + timedelta(minutes=len(created))
+        order = Order(
+            order_number=f"ORD-TEST-{len(created)}",
+            customer_email=email,
+            customer_name="Test Customer",
+            total_amount=10.0 * items,
+            status=status,
+            created_at=created_at,
+            updated_at=created_at,
+            items=[OrderItem(product_id=product_ids[0], quantity=1, price=10.0) for _ in range(items)]
+        )
+        merchant_db.add(order)
+        merchant_db.commit()
+        created.append(order)
+        return order
+
+    return make
+
+
+@pytest.fixture
+def merchant_client(merchant_session_factory):
+    """FastAPI test client with get_db bound to the test database"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.database.database import get_db
+    from app.services.cart_cache import cart_cache
+    from app.services.catalog import facet_cache
+    from app.services.search_index import search_index
+    
+    cart_cache.clear()
+    facet_cache.clear()
+    search_index.clear()
+    
+    def override_get_db():
+        db = merchant_session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+    
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+
+class QueryCounter:
+    """Counts SQL statements executed against an engine"""
+    
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+    
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    @property
+    def count(self):
+        return len(self.statements)
+    
+    def __enter__(self):
+        from sqlalchemy import event
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+    
+    def __exit__(self, *exc_info):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+
+@pytest.fixture
+def query_counter(merchant_engine):
+    """Context manager counting SQL statements run against the test database"""
+    return QueryCounter(merchant_engine)
+
+
+SETTLEMENT = {
+    "transaction_receipt": {
+        "receipt_id": "rcpt_test",
+        "transaction_id": "txn_test",
+        "payment_rail_used": "visa_card",
+        "amount": 1.0,
+        "processing_fee": 0.0,
+        "net_amount": 1.0,
+    },
+    "remaining_delegation_limit": 100.0,
+}
+
+
+class FakeSettlementFacilitator:
+    """httpx mock transport handler standing in for POST /x402/settle; replace `respond` to change answers"""
+
+    def __init__(self):
+        self.settlements = []
+        self.idempotency_keys = []
+
+    async def respond(self, request):
+        return httpx.Response(200, json=SETTLEMENT)
+
+    async def __call__(self, request):
+        import json
+        self.settlements.append(json.loads(request.content))
+        self.idempotency_keys.append(request.headers.get("Idempotency-Key"))
+        return await self.respond(request)
+
+
+@pytest.fixture
+def settlement_facilitator(monkeypatch):
+    """Route x402 settlement in the cart routes to a fake facilitator"""
+    from app.routes import cart
+    from app.services.facilitator import FacilitatorClient
+    from app.services.http_client import ServiceClient, CircuitBreaker
+
+    fake = FakeSettlementFacilitator()
+    client = FacilitatorClient(
+        ServiceClient(
+            "http://facilitator.test",
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+            transport=httpx.MockTransport(fake),
+            retries=2,
+            backoff_base=0.01
+        )
+    )
+    monkeypatch.setattr(cart, "facilitator_client", client)
+    fake.client = client
+    return fake
+
+
+class SolanaRpcStandIn:
+    """
+    Local JSON-RPC server answering the Solana RPC methods used by payment execution.
+    Set `latency` to delay every response and add method names to `errors` to fail
+    them; `calls` records (method, params) and
+    `connections` the client sockets seen, so connection reuse can be checked.
+    """
+
+    BLOCKHASH = "11111111111111111111111111111111"
+    SIGNATURE = "1" * 64
+
+    def __init__(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.calls = []
+        self.connections = set()
+        self.latency = 0.0
+        self.errors = set()
+        self.token_balance = 5_000_000
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                import json
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with standin._lock:
+                    standin.connections.add(self.client_address)
+                batch = body if isinstance(body, list) else [body]
+                replies = [standin.reply(request) for request in batch]
+                payload = json.dumps(replies if isinstance(body, list) else replies[0]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def reply(self, request):
+        import time
+        method, params = request["method"], request.get("params", [])
+        with self._lock:
+            self.calls.append((method, params))
+        if self.latency:
+            time.sleep(self.latency)
+        context = {"slot": 1}
+        results = {
+            "getHealth": "ok",
+            "getLatestBlockhash": {"context": context, "value": {"blockhash": self.BLOCKHASH, "lastValidBlockHeight": 100}},
+            "getTokenAccountBalance": {"context": context, "value": {
+                "amount": str(self.token_balance), "decimals": 6,
+                "uiAmount": self.token_balance / 1_000_000, "uiAmountString": str(self.token_balance / 1_000_000)
+            }},
+            "getAccountInfo": {"context": context, "value": {
+                "data": ["", "base64"], "executable": False, "lamports": 2039280,
+                "owner": "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA", "rentEpoch": 0, "space": 165
+            }},
+            "sendTransaction": self.SIGNATURE,
+            "getSignatureStatuses": {"context": context, "value": [{
+                "slot": 1, "confirmations": None, "err": None, "status": {"Ok": None}, "confirmationStatus": "confirmed"
+            }]},
+        }
+        if method in self.errors or method not in results:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32601, "message": "Method not found"}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": results[method]}
+
+    def methods(self):
+        with self._lock:
+            return [method for method, _ in self.calls]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def solana_rpc_standin():
+    """A local Solana JSON-RPC stand-in, served over HTTP on a free port"""
+    standin = SolanaRpcStandIn()
+    yield standin
+    standin.close()
@@ -0,0 +1,306 @@
+# © 2025 Project Sienna - Test Suite for the merchant cart API
+#
+# Run with: pytest tests/test_cart_api.py -v
+
+import pytest
+
+
+CUSTOMER = {"name": "Test Customer", "email": "customer@example.com"}
+ADDRESS = {
+    "street": "1 Market St",
+    "city": "San Francisco",
+    "state": "CA",
+    "postal_code": "94105",
+    "country": "US",
+}
+
+
+@pytest.fixture
+def cart_of_size(make_product, make_cart):
+    """Create a cart holding two each of `size` distinct products and return its session id"""
+
+    def make(size):
+        return make_cart({
+            make_product(stock=50, name=f"Product {i}", price=10.0 + i, category="Electronics"): 2
+            for i in range(size)
+        })
+
+    return make
+
+
+def count_queries(query_counter, call):
+    with query_counter:
+        response = call()
+    assert response.status_code < 500, response.text
+    return query_counter.count
+
+
+class TestCartPricing:
+    """price_cart loads a cart with current prices in one query"""
+
+    def test_lines_and_subtotal(self, merchant_db, cart_of_size, query_counter):
+        from app.services.cart_pricing import price_cart
+
+        session_id = cart_of_size(3)
+        with query_counter:
+            pricing = price_cart(merchant_db, session_id)
+
+        assert query_counter.count == 1
+        assert [line["unit_price"] for line in pricing["lines"]] == [10.0, 11.0, 12.0]
+        assert pricing["subtotal"] == 66.0
+
+    def test_missing_and_empty_carts(self, merchant_db, cart_of_size):
+        from app.services.cart_pricing import price_cart
+
+        assert price_cart(merchant_db, "no-such-cart") is None
+        assert price_cart(merchant_db, cart_of_size(0))["lines"] == []
+
+
+class TestCartQueryCounts:
+    """Cart totals and checkout issue a fixed number of queries regardless of cart size"""
+
+    def assert_constant(self, query_counter, cart_of_size, call):
+        small_cart, large_cart = cart_of_size(1), cart_of_size(10)
+        small = count_queries(query_counter, lambda: call(small_cart))
+        large = count_queries(query_counter, lambda: call(large_cart))
+        assert small == large
+
+    def test_finalize(self, merchant_client, cart_of_size, query_counter):
+        def finalize(session_id):
+            return merchant_client.post(
+                f"/api/cart/{session_id}/finalize",
+                json={"customer_info": CUSTOMER, "shipping_address": ADDRESS}
+            )
+
+        self.assert_constant(query_counter, cart_of_size, finalize)
+
+    def test_checkout(self, merchant_client, cart_of_size, query_counter):
+        def checkout(session_id):
+            response = merchant_client.post(
+                f"/api/cart/{session_id}/checkout",
+                json={
+                    "customer_name": CUSTOMER["name"],
+                    "customer_email": CUSTOMER["email"],
+                    "card_number": "4111111111111111",
+                    "expiry_date": "12/30",
+                    "cvv": "123",
+                }
+            )
+            assert response.status_code == 200, response.text
+            return response
+
+        self.assert_constant(query_counter, cart_of_size, checkout)
+
+    def test_checkout_response_items(self, merchant_client, cart_of_size):
+        response = merchant_client.post(
+            f"/api/cart/{cart_of_size(2)}/checkout",
+            json={
+                "customer_name": CUSTOMER["name"],
+                "customer_email": CUSTOMER["email"],
+                "card_number": "4111111111111111",
+                "expiry_date": "12/30",
+                "cvv": "123",
+            }
+        )
+
+        items = response.json()["data"]["order"]["items"]
+        assert [(i["product_name"], i["total_price"]) for i in items] == [
+            ("Product 0", 20.0), ("Product 1", 22.0)
+        ]
+        assert all(i["id"] for i in items)
+
+    def test_solana_quote(self, merchant_client, cart_of_size, query_counter, monkeypatch):
+        from app.routes import cart
+
+        monkeypatch.setattr(
+            cart, "request_solana_payment",
+            lambda amount, currency="USDC", metadata=None: {"amountUSDC": amount}
+        )
+
+        def quote(session_id):
+            return merchant_client.post(
+                f"/api/cart/{session_id}/solana/quote",
+                json={"customer_name": CUSTOMER["name"], "customer_email": CUSTOMER["email"]}
+            )
+
+        self.assert_constant(query_counter, cart_of_size, quote)
+
+    def test_x402_checkout(self, merchant_client, cart_of_size, query_counter, settlement_facilitator):
+        def x402(session_id):
+            response = merchant_client.post(
+                f"/api/cart/{session_id}/x402/checkout",
+                json={"delegation_token": "del_test", "agent_id": "agent-1"}
+            )
+            assert response.status_code == 200, response.text
+            return response
+
+        self.assert_constant(query_counter, cart_of_size, x402)
+
+
+@pytest.fixture
+def catalog(make_product):
+    return [
+        make_product(stock=10, name=f"Item {i}", price=5.0 + i, category="Electronics")
+        for i in range(20)
+    ]
+
+
+def cart_quantities(response):
+    return {item["product_id"]: item["quantity"] for item in response.json()["items"]}
+
+
+class TestBatchCartUpdate:
+    """PATCH /api/cart/{session_id}/items"""
+
+    def test_operations_apply_in_order(self, merchant_client, catalog):
+        first, second, third = catalog[:3]
+        merchant_client.post("/api/cart/batch-session/items", json={"product_id": first, "quantity": 1})
+
+        response = merchant_client.patch("/api/cart/batch-session/items", json={"operations": [
+            {"op": "add", "product_id": first, "quantity": 2},
+            {"op": "add", "product_id": second},
+            {"op": "set", "product_id": third, "quantity": 4},
+            {"op": "add", "product_id": third},
+            {"op": "remove", "product_id": second},
+        ]})
+
+        assert response.status_code == 200
+        assert cart_quantities(response) == {first: 3, third: 5}
+
+    def test_set_zero_removes_item(self, merchant_client, catalog):
+        product_id = catalog[0]
+        merchant_client.patch("/api/cart/zero-session/items", json={"operations": [
+            {"op": "add", "product_id": product_id, "quantity": 2}
+        ]})
+
+        response = merchant_client.patch("/api/cart/zero-session/items", json={"operations": [
+            {"op": "set", "product_id": product_id, "quantity": 0}
+        ]})
+
+        assert cart_quantities(response) == {}
+
+    def test_unknown_product_rejects_whole_batch(self, merchant_client, catalog):
+        merchant_client.post("/api/cart/reject-session/items", json={"product_id": catalog[0], "quantity": 1})
+
+        response = merchant_client.patch("/api/cart/reject-session/items", json={"operations": [
+            {"op": "add", "product_id": catalog[1]},
+            {"op": "add", "product_id": 999_999},
+        ]})
+
+        assert response.status_code == 404
+        cart = merchant_client.get("/api/cart/reject-session")
+        assert cart_quantities(cart) == {catalog[0]: 1}
+
+    def test_query_count_does_not_grow_with_batch_size(self, merchant_client, catalog, query_counter):
+        def build(session_id, product_ids):
+            with query_counter:
+                response = merchant_client.patch(f"/api/cart/{session_id}/items", json={"operations": [
+                    {"op": "add", "product_id": product_id, "quantity": 2} for product_id in product_ids
+                ]})
+            assert response.status_code == 200
+            assert len(response.json()["items"]) == len(product_ids)
+            return query_counter.count
+
+        assert build("small-batch", catalog[:2]) == build("large-batch", catalog)
+
+
+class TestCartReadCache:
+    """GET /cart/{session_id} loads eagerly and serves unchanged carts from the cache"""
+
+    def test_read_query_count_is_constant(self, merchant_client, cart_of_size, query_counter):
+        small, large = cart_of_size(1), cart_of_size(10)
+
+        small_count = count_queries(query_counter, lambda: merchant_client.get(f"/api/cart/{small}"))
+        large_count = count_queries(query_counter, lambda: merchant_client.get(f"/api/cart/{large}"))
+
+        assert small_count == large_count == 4
+
+    def test_repeated_polls_hit_the_cache(self, merchant_client, cart_of_size, query_counter):
+        session_id = cart_of_size(3)
+        first = merchant_client.get(f"/api/cart/{session_id}")
+
+        # Only the version check, which reads neither the items nor their products
+        assert count_queries(query_counter, lambda: merchant_client.get(f"/api/cart/{session_id}")) == 1
+        assert "cart_items" not in query_counter.statements[0] and "products" not in query_counter.statements[0]
+        assert merchant_client.get(f"/api/cart/{session_id}").json() == first.json()
+        assert len(first.json()["items"]) == 3
+
+    def test_mutations_invalidate(self, merchant_client, cart_of_size):
+        session_id = cart_of_size(2)
+        product_id = merchant_client.get(f"/api/cart/{session_id}").json()["items"][0]["product_id"]
+
+        merchant_client.put(f"/api/cart/{session_id}/items/{product_id}", json={"quantity": 7})
+        assert merchant_client.get(f"/api/cart/{session_id}").json()["items"][0]["quantity"] == 7
+
+        merchant_client.delete(f"/api/cart/{session_id}/items/{product_id}")
+        assert len(merchant_client.get(f"/api/cart/{session_id}").json()["items"]) == 1
+
+        merchant_client.delete(f"/api/cart/{session_id}")
+        assert merchant_client.get(f"/api/cart/{session_id}").json()["items"] == []
+
+    def test_changes_by_other_workers_are_seen(self, merchant_client, merchant_db, cart_of_size):
+        from app.models.models import Cart
+        from app.services.cart_cache import touch_cart
+
+        session_id = cart_of_size(2)
+        merchant_client.get(f"/api/cart/{session_id}")
+
+        # Committed outside this process's invalidation, as another worker would
+        cart = merchant_db.query(Cart).filter(Cart.session_id == session_id).one()
+        cart.items[0].quantity = 9
+        touch_cart(cart)
+        merchant_db.commit()
+
+        assert merchant_client.get(f"/api/cart/{session_id}").json()["items"][0]["quantity"] == 9
+
+    def test_checkout_invalidates(self, merchant_client, cart_of_size):
+        session_id = cart_of_size(2)
+        merchant_client.get(f"/api/cart/{session_id}")
+
+        response = merchant_client.post(f"/api/cart/{session_id}/checkout", json={
+            "customer_name": CUSTOMER["name"],
+            "customer_email": CUSTOMER["email"],
+            "card_number": "4111111111111111",
+            "expiry_date": "12/30",
+            "cvv": "123",
+        })
+
+        assert response.status_code == 200
+        assert merchant_client.get(f"/api/cart/{session_id}").json()["items"] == []
+
+    def test_product_changes_invalidate(self, merchant_client, merchant_db, cart_of_size):
+        from app.models.models import Product
+
+        session_id = cart_of_size(1)
+        item = merchant_client.get(f"/api/cart/{session_id}").json()["items"][0]
+
+        product = merchant_db.get(Product, item["product_id"])
+        product.price = 99.0
+        merchant_db.commit()
+
+        assert merchant_client.get(f"/api/cart/{session_id}").json()["items"][0]["product"]["price"] == 99.0
+
+    def test_catalog_changes_refresh_the_entry(self, merchant_client, make_product, cart_of_size, query_counter):
+        session_id = cart_of_size(1)
+        merchant_client.get(f"/api/cart/{session_id}")
+
+        # Any product change moves the catalog version, so the cart is loaded again
+        make_product(name="Elsewhere")
+
+        assert count_queries(query_counter, lambda: merchant_client.get(f"/api/cart/{session_id}")) == 4
+        assert count_queries(query_counter, lambda: merchant_client.get(f"/api/cart/{session_id}")) == 1
+
+    def test_collected_carts_are_evicted(self, merchant_client, merchant_db, merchant_session_factory, cart_of_size):
+        from datetime import datetime, timedelta
+        from app.models.models import Cart
+        from app.services.cart_gc import CartCollector
+
+        session_id = cart_of_size(1)
+        merchant_client.get(f"/api/cart/{session_id}")
+        cart = merchant_db.query(Cart).filter(Cart.session_id == session_id).one()
+        cart.updated_at = datetime.utcnow() - timedelta(days=30)
+        merchant_db.commit()
+
+        CartCollector(merchant_session_factory, idle_after=timedelta(days=1), sleep=lambda _: None).run_once()
+
+        assert merchant_client.get(f"/api/cart/{session_id}").status_code == 404
@@ -0,0 +1,94 @@
+# © 2025 Project Sienna - Test Suite for abandoned cart collection
+#
+# Run with: pytest tests/test_cart_gc.py -v
+
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.fixture
+def stickers(make_product):
+    return [make_product(name=f"Sticker {i}", price=2.0) for i in range(2)]
+
+
+@pytest.fixture
+def collector(merchant_session_factory):
+    from app.services.cart_gc import CartCollector
+
+    pauses = []
+    collector = CartCollector(
+        merchant_session_factory,
+        idle_after=timedelta(hours=24),
+        batch_size=2,
+        max_rows_per_second=10,
+        sleep=pauses.append
+    )
+    collector.pauses = pauses
+    return collector
+
+
+def session_ids(merchant_db):
+    from app.models.models import Cart
+
+    merchant_db.expire_all()
+    return sorted(cart.session_id for cart in merchant_db.query(Cart).all())
+
+
+class TestCartCollector:
+    """CartCollector deletes idle carts in paced batches"""
+
+    def test_idle_carts_and_items_are_deleted(self, merchant_db, make_cart, stickers, collector):
+        from app.models.models import CartItem
+
+        for i in range(5):
+            make_cart(dict.fromkeys(stickers, 1), session_id=f"idle-{i}", idle_hours=48)
+        make_cart(dict.fromkeys(stickers, 1), session_id="active", idle_hours=1)
+
+        assert collector.run_once() == (5, 10)
+
+        assert session_ids(merchant_db) == ["active"]
+        assert merchant_db.query(CartItem).count() == 2
+
+    def test_items_go_before_their_carts(self, merchant_engine, merchant_db, make_cart, stickers, collector):
+        from sqlalchemy import event
+
+        # Enforce the cart_items -> carts foreign key, as Postgres and MySQL do
+        event.listen(merchant_engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+        merchant_engine.dispose()
+        make_cart(dict.fromkeys(stickers, 1), session_id="idle", idle_hours=48)
+
+        assert collector.run_once() == (1, 2)
+        assert session_ids(merchant_db) == []
+
+    def test_batches_are_rate_limited(self, make_cart, stickers, collector):
+        for i in range(5):
+            make_cart(dict.fromkeys(stickers, 1), session_id=f"idle-{i}", idle_hours=48)
+
+        collector.run_once()
+
+        # Two full batches of 2 carts + 4 items are each followed by a pause of ~0.6s
+        assert len(collector.pauses) == 2
+        assert all(0 < pause <= 0.6 for pause in collector.pauses)
+
+    def test_metrics_report_rows_reclaimed(self, make_cart, stickers, collector):
+        for i in range(3):
+            make_cart({stickers[0]: 1}, session_id=f"idle-{i}", idle_hours=48)
+
+        collector.run_once()
+        collector.run_once()
+
+        metrics = collector.metrics()
+        assert metrics["runs"] == 2
+        assert metrics["carts_deleted"] == 3
+        assert metrics["cart_items_deleted"] == 3
+        assert metrics["last_run_carts_deleted"] == 0
+
+    def test_cart_activity_postpones_collection(self, merchant_client, merchant_db, make_cart, stickers, collector):
+        make_cart(dict.fromkeys(stickers, 1), session_id="returning", idle_hours=48)
+
+        response = merchant_client.put(f"/api/cart/returning/items/{stickers[0]}", json={"quantity": 3})
+        assert response.status_code == 200
+
+        assert collector.run_once() == (0, 0)
+        assert session_ids(merchant_db) == ["returning"]
@@ -0,0 +1,301 @@
+# © 2025 Project Sienna - Test Suite for the Payment Facilitator client
+#
+# Run with: pytest tests/test_facilitator_client.py -v
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+
+class FakeFacilitator:
+    """httpx mock transport standing in for the x402 Payment Facilitator"""
+
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {"valid": True}
+        self.calls = 0
+
+    def __call__(self, request):
+        self.calls += 1
+        if isinstance(self.body, bytes):
+            return httpx.Response(self.status_code, content=self.body)
+        return httpx.Response(self.status_code, json=self.body)
+
+
+@pytest.fixture
+def facilitator(monkeypatch):
+    """Install a FacilitatorClient backed by a fake facilitator into the products routes"""
+    from app.routes import products
+    from app.services.facilitator import FacilitatorClient
+    from app.services.http_client import ServiceClient, CircuitBreaker
+
+    fake = FakeFacilitator()
+    client = FacilitatorClient(
+        ServiceClient(
+            "http://facilitator.test",
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+            transport=httpx.MockTransport(fake)
+        )
+    )
+    monkeypatch.setattr(products, "facilitator_client", client)
+    return fake
+
+
+def premium_search(client, token="del_test"):
+    return client.get("/api/products/premium/search", params={"delegate_token": token})
+
+
+class TestPremiumSearchVerification:
+    """Delegation verification on /api/products/premium/search"""
+
+    def test_missing_token_requires_payment(self, merchant_client, facilitator):
+        response = merchant_client.get("/api/products/premium/search")
+
+        assert response.status_code == 402
+        assert facilitator.calls == 0
+
+    def test_positive_verification_is_reused(self, merchant_client, facilitator):
+        assert premium_search(merchant_client).status_code == 200
+        assert premium_search(merchant_client).status_code == 200
+
+        assert facilitator.calls == 1
+
+    def test_verification_expiry_is_respected(self, merchant_client, facilitator):
+        facilitator.body = {"valid": True, "expires_at": time.time() - 1}
+
+        premium_search(merchant_client)
+        premium_search(merchant_client)
+
+        assert facilitator.calls == 2
+
+    def test_rejected_token_is_not_cached(self, merchant_client, facilitator):
+        facilitator.body = {"valid": False}
+
+        assert premium_search(merchant_client).status_code == 402
+        assert premium_search(merchant_client).status_code == 402
+        assert facilitator.calls == 2
+
+    def test_unreadable_verification_is_an_upstream_failure(self, merchant_client, facilitator):
+        facilitator.body = b"<html>Bad gateway</html>"
+        assert premium_search(merchant_client).status_code == 502
+
+        facilitator.body = ["valid"]
+        assert premium_search(merchant_client).status_code == 502
+
+    def test_circuit_opens_after_upstream_failures(self, merchant_client, facilitator):
+        facilitator.status_code = 503
+
+        for token in ("del_a", "del_b", "del_c"):
+            assert premium_search(merchant_client, token).status_code == 502
+
+        assert facilitator.calls == 2
+
+
+def service_client(handler, **kwargs):
+    from app.services.http_client import ServiceClient, CircuitBreaker
+
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=10, reset_timeout=60))
+    return ServiceClient(
+        "http://upstream.test",
+        transport=httpx.MockTransport(handler),
+        backoff_base=0.01,
+        **kwargs
+    )
+
+
+class TestServiceClientResilience:
+    """Deadlines and jittered retries on the shared upstream client"""
+
+    def test_idempotent_calls_retry_upstream_failures(self):
+        statuses = [503, 502, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0))
+
+        client = service_client(handler, retries=2)
+        response = asyncio.run(client.get("/status"))
+
+        assert response.status_code == 200
+        assert statuses == []
+
+    def test_non_idempotent_calls_are_not_retried_after_reaching_upstream(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503)
+
+        client = service_client(handler, retries=2)
+        response = asyncio.run(client.post("/x402/settle", json={}))
+
+        assert response.status_code == 503
+        assert len(calls) == 1
+
+    def test_connect_errors_are_retried_for_any_call(self):
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            if len(attempts) < 3:
+                raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(200)
+
+        client = service_client(handler, retries=2)
+        response = asyncio.run(client.post("/x402/settle", json={}))
+
+        assert response.status_code == 200
+        assert len(attempts) == 3
+
+    def test_deadline_bounds_a_hanging_call(self):
+        async def hang(request):
+            await asyncio.sleep(10)
+
+        client = service_client(hang, deadline=0.2, retries=3)
+        started = time.monotonic()
+
+        with pytest.raises(httpx.TimeoutException):
+            asyncio.run(client.get("/status"))
+
+        assert time.monotonic() - started < 1
+        assert client.breaker.failures >= 1
+
+
+@pytest.fixture
+def slow_upstream():
+    """Local HTTP server answering every POST with 200 after `delay` seconds"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            requests.append(self.path)
+            time.sleep(server.delay)
+            payload = b'{"settled": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.delay = 0.6
+    server.requests = requests
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestCallDeadlines:
+    """A call's deadline, not the client's timeout, bounds attempts that are not retried"""
+
+    def test_non_idempotent_call_waits_until_its_deadline(self, slow_upstream):
+        from app.services.http_client import ServiceClient
+
+        client = ServiceClient(slow_upstream.url, timeout=0.2, retries=2)
+
+        async def settle():
+            try:
+                return await client.post("/x402/settle", json={}, deadline=5, idempotent=False)
+            finally:
+                await client.aclose()
+
+        response = asyncio.run(settle())
+
+        assert response.status_code == 200
+        assert slow_upstream.requests == ["/x402/settle"]
+
+    def test_idempotent_attempts_keep_the_client_timeout(self, slow_upstream):
+        from app.services.http_client import ServiceClient
+
+        client = ServiceClient(slow_upstream.url, timeout=0.2, retries=0)
+
+        async def fetch():
+            try:
+                return await client.post("/status", json={}, deadline=5, idempotent=True)
+            finally:
+                await client.aclose()
+
+        started = time.monotonic()
+        with pytest.raises(httpx.ReadTimeout):
+            asyncio.run(fetch())
+        assert time.monotonic() - started < 0.5
+
+
+class TestNonBlockingSettlement:
+    """x402 settlement awaits the facilitator without stalling the event loop"""
+
+    def test_other_requests_flow_while_settlement_hangs(self, merchant_client, make_product, make_cart,
+                                                        settlement_facilitator):
+        from app.main import app
+
+        make_cart({make_product(stock=5): 1}, session_id="hanging-settlement")
+
+        respond = settlement_facilitator.respond
+
+        async def run():
+            settling = asyncio.Event()
+            released = asyncio.Event()
+
+            async def hanging_settle(request):
+                settling.set()
+                await released.wait()
+                return await respond(request)
+
+            settlement_facilitator.respond = hanging_settle
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://merchant.test") as client:
+                checkout = asyncio.create_task(client.post(
+                    "/api/cart/hanging-settlement/x402/checkout",
+                    json={"delegation_token": "del_test", "agent_id": "agent-1"}
+                ))
+                await asyncio.wait_for(settling.wait(), timeout=5)
+
+                health = await asyncio.wait_for(client.get("/health"), timeout=5)
+                assert not checkout.done()
+
+                released.set()
+                return health, await asyncio.wait_for(checkout, timeout=5)
+
+        health, checkout = asyncio.run(run())
+
+        assert health.status_code == 200
+        assert checkout.status_code == 200, checkout.text
+        assert len(settlement_facilitator.settlements) == 1
+
+    def test_unreachable_facilitator_fails_fast_and_releases_stock(self, merchant_client, merchant_db, make_product,
+                                                                  make_cart, settlement_facilitator):
+        from app.models.models import Product
+
+        product_id = make_product(stock=5)
+        make_cart({product_id: 2}, session_id="unreachable-facilitator")
+
+        async def refuse(request):
+            raise httpx.ConnectError("connection refused", request=request)
+
+        settlement_facilitator.respond = refuse
+
+        response = merchant_client.post(
+            "/api/cart/unreachable-facilitator/x402/checkout",
+            json={"delegation_token": "del_test", "agent_id": "agent-1"}
+        )
+
+        assert response.status_code == 503
+        # Retried until the breaker (threshold 2) opened; the third attempt fails fast
+        assert len(settlement_facilitator.settlements) == 2
+        assert settlement_facilitator.client.service.breaker.state == "open"
+        merchant_db.expire_all()
+        assert merchant_db.get(Product, product_id).stock_quantity == 5
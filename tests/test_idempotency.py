@@ -0,0 +1,219 @@
+# © 2025 Project Sienna - Test Suite for Idempotency-Key handling on checkout endpoints
+#
+# Run with: pytest tests/test_idempotency.py -v
+
+import threading
+
+import pytest
+
+
+CHECKOUT = {
+    "customer_name": "Test Customer",
+    "customer_email": "customer@example.com",
+    "card_number": "4111111111111111",
+    "expiry_date": "12/30",
+    "cvv": "123",
+}
+
+
+@pytest.fixture
+def session_id(make_product, make_cart):
+    return make_cart({make_product(stock=5): 2}, session_id="idempotent-session")
+
+
+def order_count(merchant_db):
+    from app.models.models import Order
+
+    merchant_db.expire_all()
+    return merchant_db.query(Order).count()
+
+
+class TestCheckoutReplay:
+    """Retries with the same Idempotency-Key get the stored response"""
+
+    def test_retry_returns_stored_response(self, merchant_client, merchant_db, session_id):
+        headers = {"Idempotency-Key": "checkout-1"}
+
+        first = merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT, headers=headers)
+        retry = merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT, headers=headers)
+
+        assert first.status_code == retry.status_code == 200
+        assert retry.json()["order"]["order_number"] == first.json()["order"]["order_number"]
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert "Idempotent-Replayed" not in first.headers
+        assert order_count(merchant_db) == 1
+
+    def test_client_errors_are_replayed(self, merchant_client, session_id):
+        headers = {"Idempotency-Key": "checkout-bad-card"}
+        declined = {**CHECKOUT, "card_number": "4111111111111112"}
+
+        first = merchant_client.post(f"/api/cart/{session_id}/checkout", json=declined, headers=headers)
+        retry = merchant_client.post(f"/api/cart/{session_id}/checkout", json=declined, headers=headers)
+
+        assert first.status_code == retry.status_code == 400
+        assert retry.json() == first.json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+
+    def test_key_reused_with_different_request_is_rejected(self, merchant_client, session_id):
+        headers = {"Idempotency-Key": "checkout-2"}
+        merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT, headers=headers)
+
+        response = merchant_client.post(
+            f"/api/cart/{session_id}/checkout",
+            json={**CHECKOUT, "customer_name": "Someone Else"},
+            headers=headers
+        )
+
+        assert response.status_code == 422
+
+    def test_requests_without_key_are_not_deduplicated(self, merchant_client, merchant_db, session_id):
+        merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT)
+        retry = merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT)
+
+        assert retry.status_code == 400  # cart was already cleared
+        assert order_count(merchant_db) == 1
+
+
+class TestConcurrentDuplicates:
+    """A duplicate that arrives while the first request runs waits for its outcome"""
+
+    def test_concurrent_x402_checkouts_settle_once(self, merchant_client, merchant_db, session_id,
+                                                    settlement_facilitator):
+        import asyncio
+
+        respond = settlement_facilitator.respond
+
+        async def slow_settle(request):
+            await asyncio.sleep(0.3)
+            return await respond(request)
+
+        settlement_facilitator.respond = slow_settle
+
+        responses = []
+
+        def checkout():
+            responses.append(merchant_client.post(
+                f"/api/cart/{session_id}/x402/checkout",
+                json={"delegation_token": "del_test", "agent_id": "agent-1"},
+                headers={"Idempotency-Key": "x402-1"}
+            ))
+
+        threads = [threading.Thread(target=checkout) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(settlement_facilitator.settlements) == 1
+        assert [r.status_code for r in responses] == [200, 200, 200]
+        assert len({r.json()["order"]["order_number"] for r in responses}) == 1
+        assert order_count(merchant_db) == 1
+
+
+class TestUnknownSettlementOutcome:
+    """An x402 settlement that may have gone through keeps its hold and key until a retry reconciles it"""
+
+    def stock(self, merchant_db):
+        from app.models.models import Product
+
+        merchant_db.expire_all()
+        return merchant_db.query(Product).one().stock_quantity
+
+    def test_timeout_after_sending_is_reconciled_by_retry(self, merchant_client, merchant_db, session_id,
+                                                          settlement_facilitator):
+        import httpx
+
+        respond = settlement_facilitator.respond
+
+        async def timeout(request):
+            raise httpx.ReadTimeout("no answer", request=request)
+
+        settlement_facilitator.respond = timeout
+        headers = {"Idempotency-Key": "x402-timeout"}
+        checkout = {"delegation_token": "del_test", "agent_id": "agent-1"}
+
+        first = merchant_client.post(f"/api/cart/{session_id}/x402/checkout", json=checkout, headers=headers)
+
+        assert first.status_code == 202
+        assert self.stock(merchant_db) == 3  # still held
+        assert order_count(merchant_db) == 0
+
+        settlement_facilitator.respond = respond
+        settlement_facilitator.client.service.breaker.record_success()  # facilitator is back
+        retry = merchant_client.post(f"/api/cart/{session_id}/x402/checkout", json=checkout, headers=headers)
+
+        assert retry.status_code == 200, retry.text
+        assert self.stock(merchant_db) == 3  # the retry claimed the same hold
+        assert order_count(merchant_db) == 1
+        assert len(set(settlement_facilitator.idempotency_keys)) == 1
+        assert "x402-timeout" not in settlement_facilitator.idempotency_keys[0]
+
+    def test_unreadable_success_is_resent_under_the_same_key(self, merchant_client, merchant_db, session_id,
+                                                             settlement_facilitator):
+        import httpx
+
+        respond = settlement_facilitator.respond
+        answers = []
+
+        async def garbled_once(request):
+            answers.append(request)
+            if len(answers) == 1:
+                return httpx.Response(200, text="<html>OK</html>")
+            return await respond(request)
+
+        settlement_facilitator.respond = garbled_once
+
+        response = merchant_client.post(
+            f"/api/cart/{session_id}/x402/checkout",
+            json={"delegation_token": "del_test", "agent_id": "agent-1"},
+            headers={"Idempotency-Key": "x402-garbled"}
+        )
+
+        assert response.status_code == 200, response.text
+        assert len(settlement_facilitator.settlements) == 2
+        assert len(set(settlement_facilitator.idempotency_keys)) == 1
+        assert order_count(merchant_db) == 1
+
+
+class TestTakeover:
+    """The response is stored in the order's own transaction, so a takeover can never place a second order"""
+
+    def test_request_outliving_its_claim_loses_to_the_retry(self, merchant_client, merchant_db, session_id,
+                                                            monkeypatch):
+        import time
+
+        from app.routes import cart
+        from app.services import idempotency
+        from app.services.payments import SimulatedProcessor
+
+        monkeypatch.setattr(idempotency, "IDEMPOTENCY_LOCK_TIMEOUT", 0.1)
+        monkeypatch.setattr(cart, "payment_processor", SimulatedProcessor(latency_ms=300, latency_sigma=0))
+        headers = {"Idempotency-Key": "checkout-slow"}
+        responses = []
+
+        def checkout():
+            responses.append(merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT, headers=headers))
+
+        first = threading.Thread(target=checkout)
+        first.start()
+        time.sleep(0.2)
+        retry = threading.Thread(target=checkout)
+        retry.start()
+        first.join()
+        retry.join()
+
+        assert sorted(r.status_code for r in responses) == [200, 409]
+        assert order_count(merchant_db) == 1
+
+    def test_expired_keys_are_purged(self, merchant_client, merchant_db, session_id):
+        from datetime import datetime, timedelta
+
+        from app.models.models import IdempotencyKey
+        from app.services.idempotency import purge_expired_keys
+
+        merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT, headers={"Idempotency-Key": "old"})
+
+        assert purge_expired_keys(merchant_db, 100) == 0
+        assert purge_expired_keys(merchant_db, 100, now=datetime.utcnow() + timedelta(days=2)) == 1
+        merchant_db.commit()
+        assert merchant_db.query(IdempotencyKey).count() == 0
@@ -0,0 +1,222 @@
+# © 2025 Project Sienna - Test Suite for stock reservation at checkout
+#
+# Run with: pytest tests/test_inventory.py -v
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+
+CHECKOUT = {
+    "customer_name": "Test Customer",
+    "customer_email": "customer@example.com",
+    "card_number": "4111111111111111",
+    "expiry_date": "12/30",
+    "cvv": "123",
+}
+
+FINALIZE = {
+    "customer_info": {"name": "Test Customer", "email": "customer@example.com"},
+    "shipping_address": {
+        "street": "1 Market St", "city": "San Francisco", "state": "CA",
+        "postal_code": "94105", "country": "US",
+    },
+}
+
+
+def stock_of(merchant_db, product_id):
+    from app.models.models import Product
+
+    merchant_db.expire_all()
+    return merchant_db.get(Product, product_id).stock_quantity
+
+
+class TestReserveStock:
+    """reserve_stock is a single all-or-nothing conditional UPDATE"""
+
+    def test_reserve_is_all_or_nothing(self, merchant_db, make_product):
+        from app.services.inventory import InsufficientStock, reserve_stock
+
+        plenty, scarce = make_product(10, "Poster"), make_product(1, "Sculpture")
+
+        with pytest.raises(InsufficientStock) as error:
+            reserve_stock(merchant_db, [
+                {"product_id": plenty, "quantity": 3},
+                {"product_id": scarce, "quantity": 2},
+            ])
+        merchant_db.commit()
+
+        assert error.value.product_ids == [scarce]
+        assert stock_of(merchant_db, plenty) == 10
+        assert stock_of(merchant_db, scarce) == 1
+
+    def test_reserve_publishes_catalog_change(self, merchant_db, make_product):
+        from app.models.models import Product
+        from app.services.catalog import current_catalog_version
+        from app.services.inventory import reserve_stock
+
+        product_id = make_product(5)
+        version = merchant_db.get(Product, product_id).version
+        catalog_version = current_catalog_version(merchant_db)
+
+        reserve_stock(merchant_db, [{"product_id": product_id, "quantity": 2}])
+        merchant_db.commit()
+        merchant_db.expire_all()
+
+        assert merchant_db.get(Product, product_id).version > version
+        assert current_catalog_version(merchant_db) > catalog_version
+
+
+class TestCheckoutStock:
+    """Checkout paths take stock and never oversell"""
+
+    def test_checkout_decrements_stock(self, merchant_client, merchant_db, make_product, make_cart):
+        product_id = make_product(5)
+
+        response = merchant_client.post(f"/api/cart/{make_cart({product_id: 2})}/checkout", json=CHECKOUT)
+
+        assert response.status_code == 200
+        assert stock_of(merchant_db, product_id) == 3
+
+    def test_checkout_rejects_insufficient_stock(self, merchant_client, merchant_db, make_product, make_cart):
+        product_id = make_product(1)
+
+        response = merchant_client.post(f"/api/cart/{make_cart({product_id: 2})}/checkout", json=CHECKOUT)
+
+        assert response.status_code == 409
+        assert stock_of(merchant_db, product_id) == 1
+
+    def test_parallel_checkouts_do_not_oversell(self, merchant_client, merchant_db, make_product, make_cart):
+        from app.models.models import Order
+
+        product_id = make_product(50)
+        sessions = [make_cart({product_id: 1}) for _ in range(200)]
+
+        def checkout(session_id):
+            return merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT).status_code
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            statuses = list(pool.map(checkout, sessions))
+
+        assert statuses.count(200) == 50
+        assert statuses.count(409) == 150
+        assert stock_of(merchant_db, product_id) == 0
+        assert merchant_db.query(Order).count() == 50
+
+
+class TestReservationHolds:
+    """finalize_cart holds stock until fulfillment or expiry"""
+
+    def finalize(self, merchant_client, session_id):
+        response = merchant_client.post(f"/api/cart/{session_id}/finalize", json=FINALIZE)
+        assert response.status_code == 402
+        return response.json()["payment_session_id"]
+
+    def fulfill(self, merchant_client, session_id, payment_session_id):
+        return merchant_client.post(f"/api/cart/{session_id}/fulfill", json={
+            "payment_session_id": payment_session_id,
+            "card_number": CHECKOUT["card_number"],
+            "expiry_date": CHECKOUT["expiry_date"],
+            "cvv": CHECKOUT["cvv"],
+            "cardholder_name": CHECKOUT["customer_name"],
+        })
+
+    def test_fulfill_consumes_hold(self, merchant_client, merchant_db, make_product, make_cart):
+        from app.models.models import StockReservation
+
+        product_id = make_product(5)
+        session_id = make_cart({product_id: 2})
+
+        payment_session_id = self.finalize(merchant_client, session_id)
+        assert stock_of(merchant_db, product_id) == 3
+
+        assert self.fulfill(merchant_client, session_id, payment_session_id).status_code == 200
+        assert stock_of(merchant_db, product_id) == 3
+        assert merchant_db.query(StockReservation).count() == 0
+
+    def test_held_stock_is_unavailable_to_others(self, merchant_client, make_product, make_cart):
+        product_id = make_product(2)
+        self.finalize(merchant_client, make_cart({product_id: 2}))
+
+        response = merchant_client.post(f"/api/cart/{make_cart({product_id: 1})}/checkout", json=CHECKOUT)
+
+        assert response.status_code == 409
+
+    def test_finalizing_again_replaces_the_hold(self, merchant_client, merchant_db, make_product, make_cart):
+        from app.models.models import StockReservation
+
+        product_id = make_product(1)
+        session_id = make_cart({product_id: 1})
+        self.finalize(merchant_client, session_id)
+
+        # e.g. to add a coupon; the cart's own hold must not block it
+        payment_session_id = self.finalize(merchant_client, session_id)
+
+        assert stock_of(merchant_db, product_id) == 0
+        assert merchant_db.query(StockReservation).count() == 1
+        assert self.fulfill(merchant_client, session_id, payment_session_id).status_code == 200
+        assert stock_of(merchant_db, product_id) == 0
+
+    def test_solana_quote_after_finalize_takes_over_the_hold(self, merchant_client, merchant_db, make_product,
+                                                             make_cart, monkeypatch):
+        from app.models.models import StockReservation
+        from app.routes import cart
+
+        monkeypatch.setattr(
+            cart, "request_solana_payment",
+            lambda amount, currency="USDC", metadata=None: {"amountUSDC": amount}
+        )
+        product_id = make_product(1)
+        session_id = make_cart({product_id: 1})
+        self.finalize(merchant_client, session_id)
+
+        response = merchant_client.post(f"/api/cart/{session_id}/solana/quote", json={
+            "customer_name": CHECKOUT["customer_name"], "customer_email": CHECKOUT["customer_email"]
+        })
+
+        assert response.status_code == 200, response.text
+        assert stock_of(merchant_db, product_id) == 0
+        assert merchant_db.query(StockReservation).count() == 1
+
+    def test_sweeper_releases_expired_holds(self, merchant_client, merchant_db, merchant_session_factory,
+                                            make_product, make_cart, monkeypatch):
+        from app.services import inventory
+        from app.services.inventory import ReservationSweeper
+
+        product_id = make_product(5)
+        session_id = make_cart({product_id: 2})
+        payment_session_id = self.finalize(merchant_client, session_id)
+
+        later = datetime.utcnow() + timedelta(hours=1)
+        original = inventory.release_expired_holds
+        monkeypatch.setattr(
+            inventory, "release_expired_holds",
+            lambda db, batch_size: original(db, batch_size, now=later)
+        )
+        released = ReservationSweeper(merchant_session_factory, batch_size=1).sweep()
+
+        assert released == 1
+        assert stock_of(merchant_db, product_id) == 5
+
+        # A late fulfillment reserves the stock again
+        assert self.fulfill(merchant_client, session_id, payment_session_id).status_code == 200
+        assert stock_of(merchant_db, product_id) == 3
+
+    def test_failed_x402_settlement_releases_hold(self, merchant_client, merchant_db, make_product,
+                                                  make_cart, settlement_facilitator):
+        import httpx
+
+        async def declined(request):
+            return httpx.Response(402, text="insufficient delegation limit")
+
+        settlement_facilitator.respond = declined
+        product_id = make_product(5)
+
+        response = merchant_client.post(
+            f"/api/cart/{make_cart({product_id: 2})}/x402/checkout",
+            json={"delegation_token": "del_test", "agent_id": "agent-1"}
+        )
+
+        assert response.status_code == 402
+        assert stock_of(merchant_db, product_id) == 5
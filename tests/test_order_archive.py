@@ -0,0 +1,126 @@
+# © 2025 Project Sienna - Test Suite for hot/cold order archival
+#
+# Run with: pytest tests/test_order_archive.py -v
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def archiver(merchant_engine, merchant_session_factory, tmp_path):
+    from app.services.order_archive import OrderArchiver, attach_archive
+
+    attach_archive(merchant_engine, tmp_path / "archive.db")
+    return OrderArchiver(merchant_session_factory, archive_after=timedelta(days=30), batch_size=2)
+
+
+def days_ago(days):
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def live_order_numbers(merchant_db):
+    from app.models.models import Order
+
+    merchant_db.expire_all()
+    return sorted(number for (number,) in merchant_db.query(Order.order_number))
+
+
+class TestOrderArchiver:
+    """OrderArchiver moves finished orders past the horizon out of the live tables"""
+
+    def test_only_old_finished_orders_move(self, merchant_db, make_order, archiver):
+        from app.models.models import OrderItem
+        from app.services.order_archive import archived_order_items, archived_orders
+
+        make_order("delivered", created_at=days_ago(90))
+        make_order("cancelled", created_at=days_ago(60))
+        make_order("shipped", created_at=days_ago(90))
+        make_order("delivered", created_at=days_ago(1))
+        make_order("confirmed", created_at=days_ago(1))
+
+        assert archiver.run_once() == 2
+
+        assert live_order_numbers(merchant_db) == ["ORD-TEST-2", "ORD-TEST-3", "ORD-TEST-4"]
+        assert merchant_db.query(OrderItem).count() == 6
+        assert merchant_db.execute(archived_orders.select()).all()[0].order_number == "ORD-TEST-0"
+        assert len(merchant_db.execute(archived_order_items.select()).all()) == 4
+
+    def test_batches_until_done(self, merchant_db, make_order, archiver):
+        for _ in range(5):
+            make_order("delivered", created_at=days_ago(90))
+        make_order("pending", created_at=days_ago(1))
+
+        assert archiver.run_once() == 5
+        assert archiver.run_once() == 0
+        assert live_order_numbers(merchant_db) == ["ORD-TEST-5"]
+
+    def test_newest_order_stays_live(self, merchant_db, make_order, archiver):
+        make_order("delivered", created_at=days_ago(90))
+        make_order("cancelled", created_at=days_ago(90))
+
+        assert archiver.run_once() == 1
+        assert live_order_numbers(merchant_db) == ["ORD-TEST-1"]
+
+
+class TestArchivedOrderLookup:
+    """get_order and get_order_by_number fall back to the archive"""
+
+    def test_archived_order_reads_the_same(self, merchant_client, make_order, archiver):
+        order_id = make_order("delivered", created_at=days_ago(90)).id
+        make_order("pending", created_at=days_ago(1))
+        before = merchant_client.get(f"/api/orders/{order_id}").json()
+
+        assert archiver.run_once() == 1
+
+        by_id = merchant_client.get(f"/api/orders/{order_id}")
+        by_number = merchant_client.get(f"/api/orders/number/{before['order_number']}")
+        assert by_id.status_code == by_number.status_code == 200
+        assert by_id.json() == by_number.json() == before
+        assert [item["product"]["name"] for item in before["items"]] == ["Poster", "Poster"]
+
+    def test_missing_order_is_still_not_found(self, merchant_client, archiver):
+        assert merchant_client.get("/api/orders/999").status_code == 404
+        assert merchant_client.get("/api/orders/number/ORD-NOPE").status_code == 404
+
+
+class TestArchivedOrderListing:
+    """The export always includes archived orders; GET /orders does with include_archived"""
+
+    def test_export_merges_the_archive_in_order(self, merchant_client, make_order, archiver):
+        import json
+
+        oldest = make_order("delivered", created_at=days_ago(90)).id
+        middle = make_order("pending", created_at=days_ago(60)).id
+        archived = make_order("cancelled", created_at=days_ago(45)).id
+        make_order("pending", created_at=days_ago(1))
+        assert archiver.run_once() == 2
+
+        lines = merchant_client.get("/api/orders/export").text.splitlines()
+        exported = [json.loads(line) for line in lines]
+        assert [order["id"] for order in exported][:3] == [oldest, middle, archived]
+        assert len(exported) == 4
+        assert [len(order["items"]) for order in exported] == [2, 2, 2, 2]
+
+        recent = merchant_client.get("/api/orders/export", params={
+            "created_from": (datetime.utcnow() - timedelta(days=10)).isoformat()
+        }).text.splitlines()
+        assert len(recent) == 1
+
+    def test_listing_includes_archive_on_request(self, merchant_client, make_order, archiver):
+        archived = make_order("delivered", created_at=days_ago(90)).id
+        live = make_order("pending", created_at=days_ago(1)).id
+        archiver.run_once()
+
+        default = merchant_client.get("/api/orders/").json()
+        assert default["total"] == 1 and [o["id"] for o in default["orders"]] == [live]
+
+        everything = merchant_client.get("/api/orders/", params={"include_archived": True}).json()
+        assert everything["total"] == 2
+        assert [o["id"] for o in everything["orders"]] == [live, archived]
+        assert [len(o["items"]) for o in everything["orders"]] == [2, 2]
+
+        second_page = merchant_client.get("/api/orders/", params={
+            "include_archived": True, "limit": 1, "offset": 1, "status": "delivered"
+        }).json()
+        assert second_page["total"] == 1 and second_page["orders"] == []
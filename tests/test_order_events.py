@@ -0,0 +1,227 @@
+# © 2025 Project Sienna - Test Suite for the order event outbox and feed
+#
+# Run with: pytest tests/test_order_events.py -v
+
+import json
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def place(merchant_db, make_product):
+    """Place an order for `email` through the order service and return its number"""
+    from app.services.orders import place_order
+
+    product_id = make_product()
+
+    def make(email="customer@example.com"):
+        order = place_order(
+            merchant_db,
+            [{"product_id": product_id, "quantity": 1, "unit_price": 10.0}],
+            customer_email=email,
+            customer_name="Test Customer",
+            total_amount=10.0
+        )
+        return order["order_number"]
+
+    return make
+
+
+def ship(merchant_client, *order_numbers):
+    return merchant_client.post("/api/orders/status:bulk", json={
+        "updates": [{"order_number": number, "status": "shipped"} for number in order_numbers]
+    })
+
+
+def sse_events(text):
+    """Parse text/event-stream frames into (id, event, data) tuples, skipping comments and retry hints"""
+    frames = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "data" in fields:
+            frames.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return frames
+
+
+class TestOutbox:
+    """Order changes append events in the same transaction"""
+
+    def test_creation_and_status_changes_are_recorded(self, merchant_client, merchant_db, place):
+        from app.models.models import OrderEvent
+
+        number = place()
+        ship(merchant_client, number)
+
+        events = merchant_db.query(OrderEvent).order_by(OrderEvent.id).all()
+        assert [(e.event_type, e.previous_status, e.status) for e in events] == [
+            ("order.created", None, "confirmed"),
+            ("order.status_changed", "confirmed", "shipped"),
+        ]
+        assert all(e.order_number == number for e in events)
+
+    def test_single_update_and_cancel_are_recorded(self, merchant_client, merchant_db, place):
+        from app.models.models import Order, OrderEvent
+
+        first, second = place(), place()
+        order_ids = dict(merchant_db.query(Order.order_number, Order.id))
+
+        merchant_client.put(f"/api/orders/{order_ids[first]}/status", params={"status": "shipped"})
+        merchant_client.delete(f"/api/orders/{order_ids[second]}")
+
+        changes = merchant_db.query(OrderEvent.order_number, OrderEvent.status).filter(
+            OrderEvent.event_type == "order.status_changed"
+        ).order_by(OrderEvent.id).all()
+        assert changes == [(first, "shipped"), (second, "cancelled")]
+
+    def test_rejected_changes_record_nothing(self, merchant_client, merchant_db, place):
+        from app.models.models import OrderEvent
+
+        number = place()
+        merchant_client.post("/api/orders/status:bulk", json={
+            "updates": [{"order_number": number, "status": "delivered"}]
+        })
+
+        assert merchant_db.query(OrderEvent).count() == 1
+
+
+class TestLongPoll:
+    """GET /orders/events without an event-stream Accept header long-polls"""
+
+    def test_returns_events_after_cursor_for_customer(self, merchant_client, place):
+        mine = place("agent_bot-1@system.local")
+        place("someone@example.com")
+
+        body = merchant_client.get("/api/orders/events", params={"agent_id": "bot-1"}).json()
+
+        assert [e["order_number"] for e in body["events"]] == [mine]
+
+        again = merchant_client.get("/api/orders/events", params={
+            "agent_id": "bot-1", "since": body["last_event_id"], "timeout": 0.2
+        }).json()
+        assert again == {"events": [], "last_event_id": body["last_event_id"]}
+
+    def test_commit_wakes_waiting_poll(self, merchant_client, place, monkeypatch):
+        from app.services import order_events
+
+        # Only the commit notification, not the fallback re-check, can wake the poll in time
+        monkeypatch.setattr(order_events, "ORDER_EVENTS_POLL_INTERVAL", 30)
+        number = place()
+        cursor = merchant_client.get("/api/orders/events").json()["last_event_id"]
+        result = {}
+
+        def poll():
+            started = time.monotonic()
+            result["body"] = merchant_client.get("/api/orders/events", params={"since": cursor, "timeout": 10}).json()
+            result["elapsed"] = time.monotonic() - started
+
+        poller = threading.Thread(target=poll)
+        poller.start()
+        time.sleep(0.3)
+        ship(merchant_client, number)
+        poller.join()
+
+        assert [e["status"] for e in result["body"]["events"]] == ["shipped"]
+        assert result["elapsed"] < 5
+
+    def test_waiting_polls_share_one_outbox_read(self, merchant_client, place, query_counter, monkeypatch):
+        from app.services import order_events
+
+        monkeypatch.setattr(order_events, "ORDER_EVENTS_POLL_INTERVAL", 30)
+        mine, theirs = place("a@example.com"), place("b@example.com")
+        cursor = merchant_client.get("/api/orders/events").json()["last_event_id"]
+        results = {}
+
+        def poll(email):
+            results[email] = merchant_client.get("/api/orders/events", params={
+                "customer_email": email, "since": cursor, "timeout": 10
+            }).json()
+
+        pollers = [threading.Thread(target=poll, args=(email,)) for email in ("a@example.com", "b@example.com")]
+        pollers += [threading.Thread(target=poll, args=(None,))]
+        for poller in pollers:
+            poller.start()
+        time.sleep(0.5)
+        with query_counter:
+            ship(merchant_client, mine, theirs)
+            for poller in pollers:
+                poller.join()
+
+        outbox_reads = [s for s in query_counter.statements if s.startswith("SELECT") and "FROM order_events" in s]
+        assert len(outbox_reads) == 1
+        assert [e["order_number"] for e in results["a@example.com"]["events"]] == [mine]
+        assert [e["order_number"] for e in results["b@example.com"]["events"]] == [theirs]
+        assert [e["order_number"] for e in results[None]["events"]] == [mine, theirs]
+
+
+    def test_feed_waits_for_ids_still_committing(self, merchant_client, merchant_db, place, monkeypatch):
+        from sqlalchemy import insert
+        from app.models.models import OrderEvent
+        from app.services import order_events
+
+        monkeypatch.setattr(order_events, "ORDER_EVENTS_POLL_INTERVAL", 0.1)
+        place()
+        place()
+        # Event 2 is committed while the transaction holding event 1 is still open
+        first = merchant_db.get(OrderEvent, 1)
+        columns = {column.name: getattr(first, column.name) for column in OrderEvent.__table__.columns}
+        merchant_db.delete(first)
+        merchant_db.commit()
+
+        body = merchant_client.get("/api/orders/events", params={"timeout": 0.5}).json()
+        assert body == {"events": [], "last_event_id": 0}
+
+        merchant_db.execute(insert(OrderEvent).values(**columns))
+        merchant_db.commit()
+
+        body = merchant_client.get("/api/orders/events", params={"timeout": 5}).json()
+        assert [e["id"] for e in body["events"]] == [1, 2]
+
+
+class TestEventStream:
+    """GET /orders/events with Accept: text/event-stream pushes Server-Sent Events"""
+
+    def test_stream_frames_and_resume(self, merchant_client, place):
+        first, second = place(), place()
+        ship(merchant_client, first)
+
+        response = merchant_client.get(
+            "/api/orders/events", params={"limit": 2},
+            headers={"Accept": "text/event-stream"}
+        )
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        frames = sse_events(response.text)
+        assert [(event, data["order_number"]) for _, event, data in frames] == [
+            ("order.created", first), ("order.created", second)
+        ]
+
+        resumed = merchant_client.get(
+            "/api/orders/events", params={"limit": 1},
+            headers={"Accept": "text/event-stream", "Last-Event-ID": str(frames[-1][0])}
+        )
+        [(_, event, data)] = sse_events(resumed.text)
+        assert (event, data["order_number"], data["status"]) == ("order.status_changed", first, "shipped")
+
+    def test_stream_waits_for_new_events(self, merchant_client, place, monkeypatch):
+        from app.services import order_events
+
+        monkeypatch.setattr(order_events, "ORDER_EVENTS_POLL_INTERVAL", 30)
+        number = place()
+        result = {}
+
+        def listen():
+            result["response"] = merchant_client.get(
+                "/api/orders/events", params={"limit": 1, "since": 1},
+                headers={"Accept": "text/event-stream"}
+            )
+
+        listener = threading.Thread(target=listen)
+        listener.start()
+        time.sleep(0.3)
+        ship(merchant_client, number)
+        listener.join(timeout=10)
+
+        [(_, event, data)] = sse_events(result["response"].text)
+        assert (event, data["status"]) == ("order.status_changed", "shipped")
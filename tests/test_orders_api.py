@@ -0,0 +1,236 @@
+# © 2025 Project Sienna - Test Suite for the merchant orders API
+#
+# Run with: pytest tests/test_orders_api.py -v
+
+
+def query_plan(merchant_db, sql, **params):
+    from sqlalchemy import text
+
+    return " ".join(row[-1] for row in merchant_db.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params))
+
+
+class TestOrderHistoryIndexes:
+    """Order history filters are served by composite indexes, newest first"""
+
+    def test_customer_history_uses_index_without_sort(self, merchant_db):
+        plan = query_plan(
+            merchant_db,
+            "SELECT id FROM orders WHERE customer_email = :email ORDER BY created_at DESC LIMIT 20",
+            email="customer@example.com"
+        )
+
+        assert "ix_orders_customer_email_created_at" in plan
+        assert "TEMP B-TREE" not in plan
+
+    def test_status_filter_uses_index_without_sort(self, merchant_db):
+        plan = query_plan(
+            merchant_db,
+            "SELECT id FROM orders WHERE status = :status ORDER BY created_at DESC LIMIT 20",
+            status="shipped"
+        )
+
+        assert "ix_orders_status_created_at" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+class TestGetOrders:
+    """GET /orders returns pages with their items eager-loaded"""
+
+    def test_filters_and_orders_newest_first(self, merchant_client, make_order):
+        for email in ["customer@example.com"] * 3 + ["other@example.com"] * 2:
+            make_order(email=email)
+        make_order(status="shipped")
+
+        body = merchant_client.get("/api/orders/", params={"customer_email": "customer@example.com"}).json()
+
+        assert body["total"] == 4
+        numbers = [order["order_number"] for order in body["orders"]]
+        assert numbers == ["ORD-TEST-5", "ORD-TEST-2", "ORD-TEST-1", "ORD-TEST-0"]
+
+        shipped = merchant_client.get("/api/orders/", params={"status": "shipped"}).json()
+        assert [order["order_number"] for order in shipped["orders"]] == ["ORD-TEST-5"]
+
+    def test_query_count_does_not_grow_with_page_size(self, merchant_client, make_order, query_counter):
+        for _ in range(20):
+            make_order(items=3)
+
+        with query_counter:
+            small = merchant_client.get("/api/orders/", params={"limit": 2})
+        small_count = query_counter.count
+        with query_counter:
+            large = merchant_client.get("/api/orders/", params={"limit": 20})
+
+        assert len(small.json()["orders"]) == 2
+        assert len(large.json()["orders"]) == 20
+        assert all(len(order["items"]) == 3 for order in large.json()["orders"])
+        assert query_counter.count == small_count
+
+    def test_single_order_lookups_include_items(self, merchant_client, make_order):
+        order = make_order()
+
+        by_id = merchant_client.get(f"/api/orders/{order.id}").json()
+        by_number = merchant_client.get(f"/api/orders/number/{order.order_number}").json()
+
+        assert by_id == by_number
+        assert [item["product"]["name"] for item in by_id["items"]] == ["Poster", "Poster"]
+
+
+class TestOrderExport:
+    """GET /orders/export streams orders with items in creation order"""
+
+    def test_ndjson_lines_carry_items(self, merchant_client, make_order):
+        import json
+
+        for _ in range(3):
+            make_order()
+
+        response = merchant_client.get("/api/orders/export")
+
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        orders = [json.loads(line) for line in response.text.splitlines()]
+        assert [order["order_number"] for order in orders] == ["ORD-TEST-0", "ORD-TEST-1", "ORD-TEST-2"]
+        assert all(len(order["items"]) == 2 for order in orders)
+        assert orders[0]["items"][0]["unit_price"] == 10.0
+
+    def test_csv_has_one_row_per_item(self, merchant_client, make_order):
+        import csv
+        import io
+
+        make_order(items=3)
+        make_order(items=3)
+        make_order(items=0)
+
+        response = merchant_client.get("/api/orders/export", params={"format": "csv"})
+
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert response.headers["content-type"].startswith("text/csv")
+        assert len(rows) == 7
+        assert rows[-1]["order_number"] == "ORD-TEST-2" and rows[-1]["item_id"] == ""
+
+    def test_date_range_and_status_filters(self, merchant_client, make_order):
+        import json
+
+        orders = [make_order() for _ in range(4)]
+        make_order(status="delivered")
+        make_order(status="delivered")
+
+        response = merchant_client.get("/api/orders/export", params={
+            "created_from": orders[1].created_at.isoformat(),
+            "created_to": orders[3].created_at.isoformat(),
+        })
+        assert [json.loads(line)["order_number"] for line in response.text.splitlines()] == [
+            "ORD-TEST-1", "ORD-TEST-2"
+        ]
+
+        response = merchant_client.get("/api/orders/export", params=[("status", "delivered"), ("status", "shipped")])
+        assert [json.loads(line)["order_number"] for line in response.text.splitlines()] == [
+            "ORD-TEST-4", "ORD-TEST-5"
+        ]
+
+    def test_streams_in_batches(self, merchant_db, merchant_session_factory, make_order, query_counter):
+        from app.services.orders import iter_order_export
+
+        for _ in range(25):
+            make_order(items=1)
+
+        with query_counter:
+            chunks = list(iter_order_export(merchant_session_factory, batch_size=10))
+
+        # Three partitions of orders, each followed by one query for its items
+        assert len(chunks) == 3
+        assert sum(chunk.count("\n") for chunk in chunks) == 25
+        assert [s.split()[0] for s in query_counter.statements] == ["SELECT"] * 4
+
+    def test_export_uses_created_at_index(self, merchant_db):
+        plan = query_plan(
+            merchant_db,
+            "SELECT id FROM orders WHERE created_at >= :start ORDER BY created_at, id",
+            start="2025-01-01"
+        )
+
+        assert "ix_orders_created_at" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+class TestBulkStatusUpdate:
+    """POST /orders/status:bulk validates transitions and applies them set-based"""
+
+    def bulk(self, merchant_client, updates):
+        response = merchant_client.post("/api/orders/status:bulk", json={
+            "updates": [{"order_number": number, "status": status} for number, status in updates]
+        })
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def test_per_order_outcomes(self, merchant_client, merchant_db, make_order):
+        from app.models.models import Order
+
+        make_order()
+        make_order()
+        make_order(status="delivered")
+
+        body = self.bulk(merchant_client, [
+            ("ORD-TEST-0", "shipped"),
+            ("ORD-TEST-1", "confirmed"),
+            ("ORD-TEST-2", "pending"),
+            ("ORD-MISSING", "shipped"),
+            ("ORD-TEST-1", "lost"),
+            ("ORD-TEST-0", "delivered"),
+        ])
+
+        assert body["updated"] == 1
+        assert [r["result"] for r in body["results"]] == [
+            "updated", "unchanged", "invalid_transition", "not_found", "duplicate", "duplicate"
+        ]
+        assert body["results"][0]["previous_status"] == "confirmed"
+        merchant_db.expire_all()
+        assert [o.status for o in merchant_db.query(Order).order_by(Order.id)] == ["shipped", "confirmed", "delivered"]
+
+    def test_invalid_status_is_reported(self, merchant_client, make_order):
+        make_order()
+
+        body = self.bulk(merchant_client, [("ORD-TEST-0", "lost")])
+
+        assert body["results"][0]["result"] == "invalid_status"
+
+    def test_statement_count_does_not_grow_with_batch(self, merchant_client, merchant_db, make_order, query_counter):
+        from unittest.mock import patch
+
+        # Flushed as they are made and committed together, to keep arranging 1300 orders quick
+        with patch.object(merchant_db, "commit", merchant_db.flush):
+            for i in range(1300):
+                make_order(status="confirmed" if i < 1200 else "pending", items=0)
+        merchant_db.commit()
+        updates = [(f"ORD-TEST-{i}", "shipped") for i in range(1200)]
+        updates += [(f"ORD-TEST-{i}", "cancelled") for i in range(1200, 1300)]
+
+        with query_counter:
+            body = self.bulk(merchant_client, updates)
+
+        assert body["updated"] == 1300
+        writes = [s for s in query_counter.statements if s.startswith("UPDATE")]
+        # One UPDATE per target status and chunk of 500 orders
+        assert len(writes) == 4
+        assert len(query_counter.statements) <= 8
+
+    def test_concurrent_change_is_a_conflict(self, merchant_client, merchant_db, make_order, monkeypatch):
+        from sqlalchemy import text
+        from app.services import orders
+
+        make_order()
+        original = orders._chunks
+
+        def cancel_before_update(values, size=orders.STATUS_UPDATE_CHUNK):
+            # Another writer cancels the order between the read and the write
+            if values == ["ORD-TEST-0"] and getattr(cancel_before_update, "reads", 0) == 1:
+                merchant_db.execute(text("UPDATE orders SET status = 'cancelled'"))
+                merchant_db.commit()
+            cancel_before_update.reads = getattr(cancel_before_update, "reads", 0) + 1
+            return original(values, size)
+
+        monkeypatch.setattr(orders, "_chunks", cancel_before_update)
+
+        body = self.bulk(merchant_client, [("ORD-TEST-0", "shipped")])
+
+        assert body["results"][0]["result"] == "conflict"
+        assert body["updated"] == 0
@@ -0,0 +1,115 @@
+# © 2025 Project Sienna - Test Suite for single-transaction order placement
+#
+# Run with: pytest tests/test_orders_service.py -v
+
+import pytest
+
+
+@pytest.fixture
+def priced_cart(merchant_db, make_product, make_cart):
+    """Create a cart with three products and return its pricing"""
+    from app.services.cart_pricing import price_cart
+
+    session_id = make_cart({
+        make_product(stock=10, name=f"Print {i}", price=5.0 * (i + 1)): i + 1
+        for i in range(3)
+    })
+    return price_cart(merchant_db, session_id)
+
+
+class TestPlaceOrder:
+    """place_order writes the order, its items and the cart clear in one transaction"""
+
+    def test_order_items_and_cart_clear_in_one_round_trip_each(self, merchant_db, priced_cart, query_counter):
+        from app.services.orders import place_order
+
+        with query_counter:
+            place_order(
+                merchant_db,
+                priced_cart["lines"],
+                cart_id=priced_cart["cart_id"],
+                customer_email="customer@example.com",
+                customer_name="Test Customer",
+                total_amount=priced_cart["subtotal"],
+                payment_status="processed"
+            )
+
+        writes = [s for s in query_counter.statements if not s.startswith("SELECT")]
+        assert [" ".join(s.split()[:3]) for s in writes] == [
+            "INSERT INTO orders", "INSERT INTO order_items", "DELETE FROM cart_items", "UPDATE carts SET",
+            "INSERT INTO order_events"
+        ]
+
+    def test_returned_order_matches_database(self, merchant_db, priced_cart):
+        from app.models.models import CartItem, Order
+        from app.services.orders import place_order
+
+        order = place_order(
+            merchant_db,
+            priced_cart["lines"],
+            cart_id=priced_cart["cart_id"],
+            customer_email="customer@example.com",
+            customer_name="Test Customer",
+            total_amount=priced_cart["subtotal"]
+        )
+
+        merchant_db.expire_all()
+        stored = merchant_db.get(Order, order["id"])
+        assert stored.order_number == order["order_number"]
+        assert stored.status == "confirmed"
+        assert {(i.id, i.product_id, i.quantity) for i in stored.items} == {
+            (i["id"], i["product_id"], i["quantity"]) for i in order["items"]
+        }
+        assert [i["total_price"] for i in order["items"]] == [5.0, 20.0, 45.0]
+        assert merchant_db.query(CartItem).count() == 0
+
+    def test_item_ids_match_their_lines(self, merchant_db, priced_cart):
+        from app.models.models import OrderItem
+        from app.services.orders import place_order
+
+        first, second, third = priced_cart["lines"]
+        lines = [third, first, {**second, "quantity": 7}, first]
+        order = place_order(merchant_db, lines, customer_email="customer@example.com",
+                            customer_name="Test Customer", total_amount=1.0)
+
+        merchant_db.expire_all()
+        stored = {item.id: (item.product_id, item.quantity) for item in merchant_db.query(OrderItem)}
+        assert len(set(i["id"] for i in order["items"])) == 4
+        assert [stored[i["id"]] for i in order["items"]] == [(l["product_id"], l["quantity"]) for l in lines]
+
+    def test_failure_rolls_back_everything(self, merchant_db, priced_cart):
+        from app.models.models import CartItem, Order
+        from app.services.orders import place_order
+
+        lines = priced_cart["lines"] + [{"product_id": None, "quantity": 1, "unit_price": 1.0}]
+        with pytest.raises(Exception):
+            place_order(
+                merchant_db,
+                lines,
+                cart_id=priced_cart["cart_id"],
+                customer_email="customer@example.com",
+                customer_name="Test Customer",
+                total_amount=1.0
+            )
+        merchant_db.rollback()
+
+        assert merchant_db.query(Order).count() == 0
+        assert merchant_db.query(CartItem).count() == 3
+
+    def test_checkout_places_order_with_fixed_statements(self, merchant_client, merchant_db, priced_cart, query_counter):
+        from app.models.models import Cart
+
+        session_id = merchant_db.get(Cart, priced_cart["cart_id"]).session_id
+        with query_counter:
+            response = merchant_client.post(f"/api/cart/{session_id}/checkout", json={
+                "customer_name": "Test Customer",
+                "customer_email": "customer@example.com",
+                "card_number": "4111111111111111",
+                "expiry_date": "12/30",
+                "cvv": "123",
+            })
+
+        assert response.status_code == 200, response.text
+        order_writes = [s for s in query_counter.statements if s.startswith(("INSERT INTO order", "DELETE FROM cart_items"))]
+        assert len(order_writes) == 4  # order, items, cart clear, outbox event
+        assert len(query_counter.statements) <= 9
@@ -0,0 +1,249 @@
+# © 2025 Project Sienna - Test Suite for the payment processor interface
+#
+# Run with: pytest tests/test_payments.py -v
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+CARD = {"card_number": "4111111111111111", "expiry_date": "12/30", "cvv": "123"}
+
+CHECKOUT = {
+    "customer_name": "Test Customer",
+    "customer_email": "customer@example.com",
+    **CARD,
+}
+
+
+@pytest.fixture
+def use_processor(monkeypatch):
+    from app.routes import cart
+
+    def use(processor):
+        monkeypatch.setattr(cart, "payment_processor", processor)
+        return processor
+
+    return use
+
+
+class TestCardValidation:
+    """Checks applied before any processor is called"""
+
+    def test_luhn(self):
+        from app.services.payments import validate_card_number
+
+        assert validate_card_number("4111 1111 1111 1111")
+        assert validate_card_number("378282246310005")
+        assert not validate_card_number("4111111111111112")
+        assert not validate_card_number("4111")
+
+    def test_expiry(self):
+        from app.services.payments import validate_expiry
+
+        assert validate_expiry("12/99")
+        assert not validate_expiry("01/20")
+        assert not validate_expiry("13/30")
+        assert not validate_expiry("1230")
+
+
+class TestSimulatedProcessor:
+    """The local stand-in's latency and failure distributions"""
+
+    def test_approves_valid_cards(self):
+        from app.services.payments import SimulatedProcessor
+
+        result = asyncio.run(SimulatedProcessor().charge(CARD, 10.0))
+
+        assert result["card_brand"] == "Visa"
+        assert result["last_four"] == "1111"
+        assert result["transaction_id"].startswith("txn_")
+
+    def test_failure_rates(self):
+        from app.services.payments import PaymentDeclined, PaymentProcessorUnavailable, SimulatedProcessor
+
+        with pytest.raises(PaymentDeclined):
+            asyncio.run(SimulatedProcessor(decline_rate=1.0).authorize(CARD, 10.0))
+        with pytest.raises(PaymentProcessorUnavailable):
+            asyncio.run(SimulatedProcessor(error_rate=1.0).authorize(CARD, 10.0))
+
+    def test_decline_rate_is_roughly_honoured(self):
+        from app.services.payments import PaymentDeclined, SimulatedProcessor
+
+        processor = SimulatedProcessor(decline_rate=0.3, seed=7)
+
+        async def attempt():
+            try:
+                await processor.authorize(CARD, 10.0)
+                return True
+            except PaymentDeclined:
+                return False
+
+        async def run():
+            return await asyncio.gather(*(attempt() for _ in range(1000)))
+
+        declined = asyncio.run(run()).count(False)
+        assert 230 < declined < 370
+
+    def test_concurrency_is_bounded(self):
+        from app.services.payments import SimulatedProcessor
+
+        class Tracking(SimulatedProcessor):
+            in_flight = peak = 0
+
+            async def _authorize(self, card, amount, idempotency_key):
+                Tracking.in_flight += 1
+                Tracking.peak = max(Tracking.peak, Tracking.in_flight)
+                try:
+                    return await super()._authorize(card, amount, idempotency_key)
+                finally:
+                    Tracking.in_flight -= 1
+
+        processor = Tracking(latency_ms=20, latency_sigma=0, max_concurrency=3)
+
+        async def run():
+            await asyncio.gather(*(processor.authorize(CARD, 1.0) for _ in range(12)))
+
+        asyncio.run(run())
+        assert Tracking.peak == 3
+
+    def test_concurrency_is_clamped_to_worker_threads(self):
+        from anyio import to_thread
+        from app.services.payments import SimulatedProcessor
+
+        processor = SimulatedProcessor(max_concurrency=1000)
+
+        async def run():
+            return processor._concurrency(), to_thread.current_default_thread_limiter().total_tokens
+
+        concurrency, threads = asyncio.run(run())
+        assert concurrency == threads
+
+    def test_processor_must_implement_every_call(self):
+        from app.services.payments import PaymentProcessor
+
+        class AuthorizeOnly(PaymentProcessor):
+            async def _authorize(self, card, amount, idempotency_key):
+                return {}
+
+        with pytest.raises(TypeError):
+            AuthorizeOnly()
+
+    def test_failed_capture_voids_the_authorization(self):
+        from app.services.payments import PaymentProcessorUnavailable, SimulatedProcessor
+
+        voided = []
+
+        class FailingCapture(SimulatedProcessor):
+            async def _capture(self, authorization_id, amount, idempotency_key):
+                raise PaymentProcessorUnavailable("capture timed out")
+
+            async def _void(self, authorization_id):
+                voided.append(authorization_id)
+
+        with pytest.raises(PaymentProcessorUnavailable):
+            asyncio.run(FailingCapture().charge(CARD, 10.0))
+
+        assert len(voided) == 1 and voided[0].startswith("auth_")
+
+    def test_repeated_idempotency_key_returns_the_original_charge(self):
+        from app.services.payments import SimulatedProcessor
+
+        processor = SimulatedProcessor()
+
+        async def run():
+            return [await processor.charge(CARD, 10.0, "order-1") for _ in range(2)]
+
+        first, retry = asyncio.run(run())
+        assert retry == first
+
+
+class TestCheckoutPayments:
+    """Checkout routes charge through the configured processor"""
+
+    def test_declined_card_leaves_stock(self, merchant_client, merchant_db, make_product, make_cart, use_processor):
+        from app.models.models import Product
+        from app.services.payments import SimulatedProcessor
+
+        use_processor(SimulatedProcessor(decline_rate=1.0))
+
+        session_id = make_cart({make_product(stock=10): 1})
+        response = merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT)
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Payment failed: Card declined"
+        assert merchant_db.query(Product.stock_quantity).scalar() == 10
+
+    def test_processor_outage_is_unavailable(self, merchant_client, make_product, make_cart, use_processor):
+        from app.services.payments import SimulatedProcessor
+
+        use_processor(SimulatedProcessor(error_rate=1.0))
+
+        session_id = make_cart({make_product(stock=10): 1})
+        response = merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT)
+
+        assert response.status_code == 503
+
+    def test_charge_is_refunded_when_stock_runs_out(self, merchant_client, make_product, make_cart, use_processor):
+        from app.services.payments import SimulatedProcessor
+
+        refunds = []
+
+        class Recording(SimulatedProcessor):
+            async def _refund(self, transaction_id, amount):
+                refunds.append((transaction_id, amount))
+
+        use_processor(Recording())
+
+        session_id = make_cart({make_product(stock=0): 1})
+        response = merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT)
+
+        assert response.status_code == 409
+        assert len(refunds) == 1 and refunds[0][1] == 10.0
+
+    def test_charge_is_refunded_when_placing_the_order_fails(self, merchant_client, merchant_db, make_product,
+                                                             make_cart, use_processor, monkeypatch):
+        from app.models.models import Order, Product
+        from app.routes import cart
+        from app.services.payments import SimulatedProcessor
+
+        refunds = []
+
+        class Recording(SimulatedProcessor):
+            async def _refund(self, transaction_id, amount):
+                refunds.append((transaction_id, amount))
+
+        def broken_place_order(*args, **kwargs):
+            raise RuntimeError("database went away")
+
+        use_processor(Recording())
+        monkeypatch.setattr(cart, "place_order", broken_place_order)
+
+        session_id = make_cart({make_product(stock=10): 1})
+        with pytest.raises(RuntimeError):
+            merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT)
+
+        assert len(refunds) == 1 and refunds[0][1] == 10.0
+        merchant_db.expire_all()
+        assert merchant_db.query(Product.stock_quantity).scalar() == 10
+        assert merchant_db.query(Order).count() == 0
+
+    def test_processor_latency_overlaps_across_checkouts(self, merchant_client, make_product, make_cart, use_processor):
+        from app.services.payments import SimulatedProcessor
+
+        use_processor(SimulatedProcessor(latency_ms=200, latency_sigma=0))
+        sessions = [make_cart({make_product(stock=10): 1}) for _ in range(8)]
+
+        def checkout(session_id):
+            return merchant_client.post(f"/api/cart/{session_id}/checkout", json=CHECKOUT).status_code
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(checkout, sessions))
+        elapsed = time.monotonic() - started
+
+        # Serialized, 8 checkouts x (authorize + capture) would take 3.2s
+        assert statuses == [200] * 8
+        assert elapsed < 2.0
@@ -0,0 +1,200 @@
+# © 2025 Project Sienna - Test Suite for the merchant product catalog API
+#
+# Run with: pytest tests/test_products_api.py -v
+
+import pytest
+from sqlalchemy import select, text
+
+
+@pytest.fixture
+def catalog(merchant_db):
+    """Small catalog spread across a few categories"""
+    from app.models.models import Product
+
+    products = [
+        Product(name="Trail Shoes", description="Lightweight runners", price=89.0, category="Sports", stock_quantity=5),
+        Product(name="Yoga Mat", description="Non-slip mat", price=25.0, category="sports ", stock_quantity=0),
+        Product(name="Sports Watch", description="GPS watch", price=199.0, category="Sports Tech", stock_quantity=3),
+        Product(name="Chef Knife", description="Forged steel", price=59.0, category="Kitchen", stock_quantity=10),
+    ]
+    merchant_db.add_all(products)
+    merchant_db.commit()
+    return products
+
+
+class TestCategoryNormalization:
+    """Products are linked to a normalized categories lookup table"""
+
+    def test_categories_are_normalized_and_shared(self, merchant_db, catalog):
+        from app.models.models import Category
+
+        names = sorted(c.name for c in merchant_db.query(Category).all())
+        assert names == ["kitchen", "sports", "sports tech"]
+        assert catalog[0].category_id == catalog[1].category_id
+
+    def test_category_change_relinks_product(self, merchant_db, catalog):
+        product = catalog[3]
+        product.category = "Home"
+        merchant_db.commit()
+
+        assert product.category_ref.name == "home"
+
+
+class TestCategoryFiltering:
+    """Exact and prefix category filters on /api/products"""
+
+    def test_exact_match_is_case_insensitive(self, merchant_client, catalog):
+        response = merchant_client.get("/api/products/", params={"category": "SPORTS"})
+
+        assert response.status_code == 200
+        names = sorted(p["name"] for p in response.json()["products"])
+        assert names == ["Trail Shoes", "Yoga Mat"]
+
+    def test_prefix_match(self, merchant_client, catalog):
+        response = merchant_client.get("/api/products/", params={"category_prefix": "spo"})
+
+        assert response.json()["total"] == 3
+
+    def test_category_with_price_range(self, merchant_client, catalog):
+        response = merchant_client.get(
+            "/api/products/",
+            params={"category": "sports", "min_price": 50, "max_price": 100}
+        )
+
+        assert [p["name"] for p in response.json()["products"]] == ["Trail Shoes"]
+
+    def test_category_price_query_uses_composite_index(self, merchant_db, catalog):
+        from app.models.models import Product
+        from app.routes.products import category_filters, price_filters
+
+        statement = select(Product).where(
+            *category_filters("sports"), *price_filters(10, 100)
+        )
+        compiled = statement.compile(
+            dialect=merchant_db.get_bind().dialect,
+            compile_kwargs={"literal_binds": True}
+        )
+        plan = merchant_db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+
+        details = " ".join(row[-1] for row in plan)
+        assert "ix_products_category_id_price" in details
+        assert "SCAN products" not in details
+
+
+class TestProductFacets:
+    """GET /api/products/facets"""
+
+    def test_facets_summarize_filtered_catalog(self, merchant_client, catalog):
+        response = merchant_client.get("/api/products/facets", params={"bucket_size": 50})
+
+        assert response.status_code == 200
+        facets = response.json()
+        assert facets["total"] == 4
+        assert [(c["name"], c["count"]) for c in facets["categories"]] == [
+            ("Sports", 2), ("Kitchen", 1), ("Sports Tech", 1)
+        ]
+        assert facets["price_histogram"] == [
+            {"min": 0.0, "max": 50.0, "count": 1},
+            {"min": 50.0, "max": 100.0, "count": 2},
+            {"min": 150.0, "max": 200.0, "count": 1},
+        ]
+        assert facets["availability"] == {"in_stock": 3, "out_of_stock": 1}
+        assert facets["price_range"] == {"min": 25.0, "max": 199.0}
+
+    def test_facets_respect_filters(self, merchant_client, catalog):
+        response = merchant_client.get("/api/products/facets", params={"category_prefix": "sports"})
+
+        assert response.json()["total"] == 3
+
+    def test_facets_are_cached_until_catalog_changes(self, merchant_client, merchant_db, catalog, query_counter):
+        from app.models.models import Product
+
+        params = {"category": "kitchen"}
+        merchant_client.get("/api/products/facets", params=params)
+
+        with query_counter:
+            cached = merchant_client.get("/api/products/facets", params=params).json()
+        # Only the catalog version check
+        assert query_counter.count == 1
+        assert cached["total"] == 1
+
+        merchant_db.add(Product(name="Skillet", price=35.0, category="Kitchen", stock_quantity=2))
+        merchant_db.commit()
+
+        refreshed = merchant_client.get("/api/products/facets", params=params).json()
+        assert refreshed["total"] == 2
+
+    def test_stock_changes_refresh_availability(self, merchant_client, merchant_db, catalog):
+        from app.models.models import Product
+        from app.services.inventory import reserve_stock
+
+        params = {"category": "kitchen"}
+        assert merchant_client.get("/api/products/facets", params=params).json()["availability"]["in_stock"] == 1
+
+        # A bulk stock UPDATE, as a checkout on any worker would make
+        product = merchant_db.query(Product).filter(Product.name == "Chef Knife").one()
+        reserve_stock(merchant_db, [{"product_id": product.id, "quantity": product.stock_quantity}])
+        merchant_db.commit()
+
+        assert merchant_client.get("/api/products/facets", params=params).json()["availability"] == {
+            "in_stock": 0, "out_of_stock": 1
+        }
+
+
+def read_changes(client, since=0, **params):
+    import json
+
+    response = client.get("/api/products/changes", params={"since": since, **params})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return lines[:-1], lines[-1]
+
+
+class TestCatalogChangeFeed:
+    """GET /api/products/changes"""
+
+    def test_versions_are_distinct_and_increasing(self, merchant_db, catalog):
+        versions = [p.version for p in catalog]
+
+        assert versions == sorted(versions)
+        assert len(set(versions)) == len(versions)
+
+    def test_full_sync_then_deltas(self, merchant_client, merchant_db, catalog):
+        changes, checkpoint = read_changes(merchant_client)
+        assert [c["product"]["name"] for c in changes] == [p.name for p in catalog]
+        assert checkpoint["has_more"] is False
+
+        shoes, mat = catalog[0], catalog[1]
+        shoes.price = 79.0
+        merchant_db.delete(mat)
+        merchant_db.commit()
+
+        deltas, next_checkpoint = read_changes(merchant_client, since=checkpoint["version"])
+        assert [(c["op"], c.get("id") or c["product"]["id"]) for c in deltas] == [
+            ("upsert", shoes.id), ("delete", mat.id)
+        ]
+        assert deltas[0]["product"]["price"] == 79.0
+        assert next_checkpoint["version"] > checkpoint["version"]
+
+        assert read_changes(merchant_client, since=next_checkpoint["version"])[0] == []
+
+    def test_pagination_resumes_from_checkpoint(self, merchant_client, catalog):
+        seen = []
+        since = 0
+        while True:
+            changes, checkpoint = read_changes(merchant_client, since=since, limit=3)
+            seen.extend(c["product"]["id"] for c in changes)
+            since = checkpoint["version"]
+            if not checkpoint["has_more"]:
+                break
+
+        assert seen == [p.id for p in catalog]
+
+    def test_unchanged_products_do_not_get_new_versions(self, merchant_db, catalog):
+        product = catalog[2]
+        version = product.version
+        product.price = product.price
+        merchant_db.commit()
+
+        assert product.version == version
@@ -0,0 +1,235 @@
+# © 2025 Project Sienna - Test Suite for the daily sales rollups
+#
+# Run with: pytest tests/test_sales_rollup.py -v
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def products(make_product):
+    return [make_product(name=f"Print {i}") for i in range(2)]
+
+
+@pytest.fixture
+def place(merchant_db, products):
+    """Place an order through the order service: `quantities` per product, at `unit_price` each"""
+    from app.services.orders import place_order
+
+    def make(quantities, payment_method="credit_card", unit_price=10.0):
+        lines = [
+            {"product_id": product_id, "quantity": quantity, "unit_price": unit_price}
+            for product_id, quantity in zip(products, quantities) if quantity
+        ]
+        return place_order(
+            merchant_db,
+            lines,
+            customer_email="customer@example.com",
+            customer_name="Test Customer",
+            total_amount=sum(line["quantity"] * unit_price for line in lines),
+            payment_method=payment_method
+        )["order_number"]
+
+    return make
+
+
+@pytest.fixture
+def rollup(merchant_session_factory):
+    from app.services.sales_rollup import SalesRollupJob
+
+    return SalesRollupJob(merchant_session_factory, batch_size=2)
+
+
+def sales(merchant_client, **params):
+    response = merchant_client.get("/api/analytics/sales", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def by_product(summary):
+    return {row["product_id"]: (row["orders"], row["units"], row["revenue"]) for row in summary["rows"]}
+
+
+class TestSalesRollup:
+    """SalesRollupJob folds order events into the daily rollups exactly once"""
+
+    def test_placed_orders_are_rolled_up(self, merchant_client, products, place, rollup):
+        first, second = products
+        place([1, 2])
+        place([3, 0])
+        place([0, 1], payment_method="x402_delegation")
+
+        assert rollup.run_once() == 3
+
+        assert by_product(sales(merchant_client)) == {first: (2, 4, 40.0), second: (2, 3, 30.0)}
+        methods = sales(merchant_client, group_by="payment_method")
+        assert {row["payment_method"]: row["revenue"] for row in methods["rows"]} == {
+            "credit_card": 60.0, "x402_delegation": 10.0
+        }
+        assert methods["orders"] == 3
+        assert methods["as_of_event_id"] == 3 and methods["pending_events"] == 0
+
+    def test_runs_are_incremental(self, merchant_client, products, place, rollup):
+        place([1, 0])
+        rollup.run_once()
+        place([1, 0])
+
+        assert sales(merchant_client)["pending_events"] == 1
+        assert rollup.run_once() == 1
+        assert rollup.run_once() == 0
+        assert by_product(sales(merchant_client))[products[0]] == (2, 2, 20.0)
+
+    def test_cancellation_is_subtracted(self, merchant_client, products, place, rollup):
+        kept, cancelled = place([1, 0]), place([2, 1])
+        rollup.run_once()
+
+        response = merchant_client.post("/api/orders/status:bulk", json={
+            "updates": [{"order_number": cancelled, "status": "cancelled"}]
+        })
+        assert response.json()["updated"] == 1
+        rollup.run_once()
+
+        assert by_product(sales(merchant_client)) == {products[0]: (1, 1, 10.0)}
+
+    def test_reinstated_order_is_added_back(self, merchant_client, merchant_db, products, place, rollup):
+        from app.models.models import Order
+
+        number = place([2, 0])
+        order_id = merchant_db.query(Order.id).filter(Order.order_number == number).scalar()
+        rollup.run_once()
+
+        merchant_client.delete(f"/api/orders/{order_id}")
+        merchant_client.delete(f"/api/orders/{order_id}")
+        rollup.run_once()
+        assert by_product(sales(merchant_client)) == {}
+
+        merchant_client.put(f"/api/orders/{order_id}/status", params={"status": "confirmed"})
+        rollup.run_once()
+        assert by_product(sales(merchant_client)) == {products[0]: (1, 2, 20.0)}
+
+    def test_changes_within_one_batch_net_out(self, merchant_client, merchant_db, products, place, rollup):
+        from app.models.models import Order
+
+        rollup.run_once()
+        number = place([1, 0])
+        order_id = merchant_db.query(Order.id).filter(Order.order_number == number).scalar()
+        merchant_client.delete(f"/api/orders/{order_id}")
+        merchant_client.put(f"/api/orders/{order_id}/status", params={"status": "confirmed"})
+
+        rollup.batch_size = 10
+        assert rollup.run_once() == 3
+        assert by_product(sales(merchant_client)) == {products[0]: (1, 1, 10.0)}
+
+    def test_checkpoint_waits_for_ids_still_committing(self, merchant_client, merchant_db, products, place, rollup):
+        from sqlalchemy import insert
+        from app.models.models import OrderEvent
+
+        rollup.run_once()  # checkpoint first, so order 1 is not backfilled as a legacy order
+        place([1, 0])
+        place([2, 0])
+        # Event 2 is committed while the transaction holding event 1 is still open
+        first = merchant_db.get(OrderEvent, 1)
+        columns = {column.name: getattr(first, column.name) for column in OrderEvent.__table__.columns}
+        merchant_db.delete(first)
+        merchant_db.commit()
+
+        assert rollup.run_once() == 0
+
+        merchant_db.execute(insert(OrderEvent).values(**columns))
+        merchant_db.commit()
+
+        assert rollup.run_once() == 2
+        assert by_product(sales(merchant_client))[products[0]] == (2, 3, 30.0)
+
+    def test_checkpoint_passes_settled_gaps(self, merchant_client, merchant_db, products, place, rollup):
+        from app.models.models import OrderEvent
+
+        rollup.run_once()  # checkpoint first, so order 1 is not backfilled as a legacy order
+        place([1, 0])
+        place([2, 0])
+        # Event 1 was rolled back long enough ago that nothing can fill its id any more
+        merchant_db.delete(merchant_db.get(OrderEvent, 1))
+        merchant_db.get(OrderEvent, 2).created_at = datetime.utcnow() - timedelta(minutes=1)
+        merchant_db.commit()
+
+        assert rollup.run_once() == 1
+        assert by_product(sales(merchant_client))[products[0]] == (1, 2, 20.0)
+
+    def test_existing_orders_are_backfilled(self, merchant_client, merchant_db, products, place, rollup):
+        from app.models.models import Order, OrderItem
+
+        placed_at = datetime.utcnow() - timedelta(days=3)
+        for status in ("delivered", "cancelled"):
+            order = Order(
+                order_number=f"ORD-LEGACY-{status}", customer_email="legacy@example.com", customer_name="Legacy",
+                total_amount=50.0, status=status, payment_method="visa", created_at=placed_at
+            )
+            merchant_db.add(order)
+            merchant_db.flush()
+            merchant_db.add(OrderItem(order_id=order.id, product_id=products[1], quantity=5, price=10.0))
+        merchant_db.commit()
+        place([1, 0])
+
+        rollup.run_once()
+
+        summary = sales(merchant_client, group_by="payment_method")
+        assert {(row["day"], row["payment_method"], row["orders"]) for row in summary["rows"]} == {
+            (placed_at.date().isoformat(), "visa", 1),
+            (datetime.utcnow().date().isoformat(), "credit_card", 1),
+        }
+
+    def test_stale_checkpoint_folds_nothing(self, merchant_db, merchant_session_factory, place, rollup):
+        from app.models.models import RollupCheckpoint
+        from app.services.sales_rollup import fold_order_events
+
+        place([1, 0])
+        rollup.run_once()
+        place([1, 0])
+
+        # Another worker advances the checkpoint between our read and our claim
+        racer = merchant_session_factory()
+        original = racer.execute
+
+        def execute(statement, *args, **kwargs):
+            if getattr(statement, "is_update", False):
+                other = merchant_session_factory()
+                other.query(RollupCheckpoint).update({"last_event_id": 2})
+                other.commit()
+                other.close()
+            return original(statement, *args, **kwargs)
+
+        racer.execute = execute
+        try:
+            assert fold_order_events(racer) == 0
+        finally:
+            racer.rollback()
+            racer.close()
+
+
+class TestSalesEndpoint:
+    """GET /api/analytics/sales reads only the rollups"""
+
+    def test_statement_count_does_not_grow_with_history(self, merchant_client, place, rollup, query_counter):
+        place([1, 1])
+        rollup.run_once()
+        with query_counter:
+            sales(merchant_client)
+        baseline = query_counter.count
+
+        for _ in range(20):
+            place([2, 1])
+        rollup.run_once()
+        with query_counter:
+            sales(merchant_client)
+
+        assert query_counter.count == baseline
+        assert not any("order_items" in statement for statement in query_counter.statements)
+
+    def test_date_range_is_validated(self, merchant_client):
+        assert merchant_client.get("/api/analytics/sales", params={
+            "date_from": "2025-02-01", "date_to": "2025-01-01"
+        }).status_code == 400
+        assert merchant_client.get("/api/analytics/sales", params={
+            "date_from": "2020-01-01", "date_to": "2025-01-01"
+        }).status_code == 400
@@ -0,0 +1,145 @@
+# © 2025 Project Sienna - Test Suite for the premium search trigram index
+#
+# Run with: pytest tests/test_search_index.py -v
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def index():
+    from app.services.search_index import TrigramIndex
+    return TrigramIndex()
+
+
+def indexed_product(product_id, name, category="Electronics", price=10.0, stock=1, description=""):
+    from types import SimpleNamespace
+    return SimpleNamespace(
+        id=product_id, name=name, description=description,
+        category=category, price=price, stock_quantity=stock
+    )
+
+
+class TestTrigramIndex:
+    """Ranking and filtering in TrigramIndex"""
+
+    def test_typo_tolerant_match(self, index):
+        index.build([
+            indexed_product(1, "Wireless Headphones"),
+            indexed_product(2, "Coffee Grinder", category="Kitchen"),
+        ])
+
+        product_ids, scores = index.search("wireles hedphones")
+
+        assert list(product_ids) == [1]
+        assert scores[0] > 0.5
+
+    def test_name_matches_rank_above_description_matches(self, index):
+        index.build([
+            indexed_product(1, "Travel Case", description="Fits most headphones"),
+            indexed_product(2, "Studio Headphones"),
+        ])
+
+        product_ids, _ = index.search("headphones")
+
+        assert list(product_ids) == [2, 1]
+
+    def test_filters_are_applied(self, index):
+        index.build([
+            indexed_product(1, "Running Shoes", category="Sports", price=80),
+            indexed_product(2, "Running Shorts", category="Sports Apparel", price=30),
+            indexed_product(3, "Running Watch", category="Electronics", price=150),
+        ])
+
+        exact, _ = index.search("running", category="sports")
+        prefixed, _ = index.search("running", category_prefix="Sports", max_price=50)
+
+        assert list(exact) == [1]
+        assert list(prefixed) == [2]
+
+    def test_upsert_and_remove(self, index):
+        index.build([indexed_product(1, "Desk Lamp")])
+
+        index.upsert(indexed_product(1, "Floor Lamp"))
+        index.upsert(indexed_product(2, "Desk Organizer"))
+        assert list(index.search("desk")[0]) == [2]
+
+        index.remove(2)
+        assert list(index.search("desk")[0]) == []
+        assert len(index) == 1
+
+    def test_tombstones_are_compacted(self):
+        from app.services.search_index import TrigramIndex
+
+        index = TrigramIndex(compact_ratio=0.5, compact_min_dead=4)
+        index.build([indexed_product(i, f"Lamp {i}", stock=i) for i in range(1, 9)])
+        for round_ in range(10):
+            for product_id in (1, 2, 3):
+                index.upsert(indexed_product(product_id, f"Lamp {product_id} mk{round_}", stock=product_id))
+        index.set_stock({8: 0})
+
+        # Never more than half as many dead slots as live ones, once past the minimum
+        assert len(index._product_ids) <= len(index) + max(4, len(index) // 2)
+        product_ids, _ = index.search("lamp")
+        assert sorted(product_ids) == list(range(1, 9))
+        assert list(index.search("lamp 7")[0][:1]) == [7]
+        assert list(index.search("mk9")[0]) == [3, 2, 1]
+
+
+class TestSearchIndexMaintenance:
+    """The shared index follows committed product changes"""
+
+    def test_committed_changes_are_indexed(self, merchant_db):
+        from app.models.models import Product
+        from app.services.search_index import search_index, build_search_index
+
+        build_search_index(merchant_db)
+        product = Product(name="Espresso Machine", price=300.0, category="Kitchen", stock_quantity=2)
+        merchant_db.add(product)
+        merchant_db.commit()
+        assert list(search_index.search("expresso")[0]) == [product.id]
+
+        merchant_db.delete(product)
+        merchant_db.commit()
+        assert list(search_index.search("expresso")[0]) == []
+
+    def test_rolled_back_changes_are_not_indexed(self, merchant_db):
+        from app.models.models import Product
+        from app.services.search_index import search_index, build_search_index
+
+        build_search_index(merchant_db)
+        merchant_db.add(Product(name="Espresso Machine", price=300.0, category="Kitchen"))
+        merchant_db.flush()
+        merchant_db.rollback()
+
+        assert list(search_index.search("espresso")[0]) == []
+
+
+class TestPremiumSearchRanking:
+    """premium_search_products uses the index for ranked results"""
+
+    def test_premium_search_is_typo_tolerant(self, merchant_client, merchant_db, make_product, monkeypatch):
+        from app.routes import products
+        from app.services.facilitator import FacilitatorClient
+        from app.services.http_client import ServiceClient
+        from app.services.search_index import build_search_index
+
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"valid": True}))
+        monkeypatch.setattr(
+            products, "facilitator_client",
+            FacilitatorClient(ServiceClient("http://facilitator.test", transport=transport))
+        )
+        make_product(stock=4, name="Mechanical Keyboard", price=120.0, category="Electronics")
+        make_product(stock=9, name="Keyboard Wrist Rest", price=20.0, category="Accessories")
+        make_product(stock=3, name="Desk Mat", price=25.0, category="Accessories")
+        build_search_index(merchant_db)
+
+        response = merchant_client.get(
+            "/api/products/premium/search",
+            params={"query": "mechanicl keybord", "delegate_token": "del_test"}
+        )
+
+        body = response.json()
+        assert response.status_code == 200
+        assert [p["name"] for p in body["products"]] == ["Mechanical Keyboard", "Keyboard Wrist Rest"]
+        assert body["total"] == 2
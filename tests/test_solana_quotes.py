@@ -0,0 +1,179 @@
+# © 2025 Project Sienna - Test Suite for coalesced, cached Solana quotes
+#
+# Run with: pytest tests/test_solana_quotes.py -v
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+
+class FakeQuoteApi:
+    """httpx mock transport handler standing in for the Sienna payment API"""
+
+    def __init__(self):
+        self.calls = []
+        self.delay = 0.0
+        self.status_code = 200
+
+    async def __call__(self, request):
+        self.calls.append(dict(request.url.params))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, text="upstream says no")
+        return httpx.Response(200, json={"payment": {"recipient": "wallet", "reference": len(self.calls)}})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def api():
+    return FakeQuoteApi()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def quotes(api, clock):
+    from app.services.http_client import CircuitBreaker, ServiceClient
+    from app.services.solana_quotes import SolanaQuoteClient
+
+    return SolanaQuoteClient(
+        ServiceClient(
+            "http://sienna.test/api/payment",
+            breaker=CircuitBreaker(failure_threshold=100),
+            transport=httpx.MockTransport(api),
+            deadline=0.3,
+            retries=0
+        ),
+        network="devnet",
+        cache_ttl=5,
+        stale_ttl=60,
+        clock=clock
+    )
+
+
+class TestQuoteCoalescing:
+    """Identical concurrent quotes share one upstream call"""
+
+    def test_concurrent_identical_quotes_share_one_fetch(self, api, quotes):
+        api.delay = 0.05
+
+        async def burst():
+            return await asyncio.gather(*(quotes.quote(12.5) for _ in range(100)))
+
+        results = asyncio.run(burst())
+
+        assert len(api.calls) == 1
+        assert api.calls[0] == {"network": "devnet", "amount": "12.5", "currency": "USDC"}
+        assert all(r == {"recipient": "wallet", "reference": 1, "amountUSDC": 12.5, "network": "devnet"} for r in results)
+        results[0]["metadata"] = {"mutated": True}
+        assert "metadata" not in results[1]
+
+    def test_coalescing_spans_event_loops(self, api, quotes):
+        api.delay = 0.1
+        barrier = threading.Barrier(8)
+
+        def quote_in_own_loop(_):
+            barrier.wait()
+            return asyncio.run(quotes.quote(30.0))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(quote_in_own_loop, range(8)))
+
+        assert len(api.calls) == 1
+        assert {r["reference"] for r in results} == {1}
+
+    def test_different_amounts_are_fetched_separately(self, api, quotes):
+        async def quotes_for(*amounts):
+            return await asyncio.gather(*(quotes.quote(amount) for amount in amounts))
+
+        asyncio.run(quotes_for(10.0, 10.0, 20.0))
+
+        assert sorted(call["amount"] for call in api.calls) == ["10.0", "20.0"]
+
+
+class TestQuoteCache:
+    """Quotes are reused for the cache TTL, and past it only while the API fails"""
+
+    def test_quote_is_refetched_after_ttl(self, api, quotes, clock):
+        asyncio.run(quotes.quote(10.0))
+        clock.now += 4
+        asyncio.run(quotes.quote(10.0))
+        assert len(api.calls) == 1
+
+        clock.now += 2
+        assert asyncio.run(quotes.quote(10.0))["reference"] == 2
+
+    def test_stale_quote_is_served_while_api_fails(self, api, quotes, clock):
+        from app.services.solana_quotes import SolanaQuoteUnavailable
+
+        asyncio.run(quotes.quote(10.0))
+        api.status_code = 503
+        clock.now += 30
+
+        assert asyncio.run(quotes.quote(10.0))["reference"] == 1
+
+        clock.now += 31
+        with pytest.raises(SolanaQuoteUnavailable):
+            asyncio.run(quotes.quote(10.0))
+
+    def test_slow_api_fails_within_deadline(self, api, quotes):
+        from app.services.solana_quotes import SolanaQuoteUnavailable
+
+        api.delay = 5
+        started = time.monotonic()
+
+        with pytest.raises(SolanaQuoteUnavailable):
+            asyncio.run(quotes.quote(10.0))
+
+        assert time.monotonic() - started < 1
+
+    def test_client_errors_are_not_cached(self, api, quotes):
+        from app.services.solana_quotes import SolanaQuoteRejected
+
+        api.status_code = 400
+        with pytest.raises(SolanaQuoteRejected) as error:
+            asyncio.run(quotes.quote(10.0))
+        assert error.value.status_code == 400
+
+        api.status_code = 200
+        assert asyncio.run(quotes.quote(10.0))["reference"] == 2
+
+
+class TestQuoteRoute:
+    """POST /cart/{session_id}/solana/quote maps quote failures to HTTP errors"""
+
+    def test_unavailable_api_returns_503(self, merchant_client, make_product, make_cart, api, quotes, monkeypatch):
+        from app.routes import cart
+
+        make_cart({make_product(stock=5): 1}, session_id="solana-cart")
+        monkeypatch.setattr(cart, "solana_quote_client", quotes)
+
+        def request_quote():
+            return merchant_client.post("/api/cart/solana-cart/solana/quote", json={
+                "customer_name": "Test Customer", "customer_email": "customer@example.com"
+            })
+
+        ok = request_quote()
+        assert ok.status_code == 200, ok.text
+        assert ok.json()["payment"]["reference"] == 1
+
+        quotes.clear_cache()
+        api.status_code = 502
+        failed = request_quote()
+        assert failed.status_code == 503
+        assert "unavailable" in failed.json()["detail"]
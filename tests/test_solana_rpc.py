@@ -0,0 +1,331 @@
+# © 2025 Project Sienna - Test Suite for the pooled Solana RPC clients
+#
+# Run with: pytest tests/test_solana_rpc.py -v
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+
+class RecordingClient:
+    """Stands in for solana-py's AsyncClient where only pooling is under test"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool():
+    from app.services.solana_rpc import SolanaRpcPool
+
+    return SolanaRpcPool(
+        {"mainnet": "http://mainnet.test", "devnet": "http://devnet.test"},
+        clients_per_cluster=2,
+        client_factory=RecordingClient
+    )
+
+
+class TestSolanaRpcPool:
+    """SolanaRpcPool hands out a fixed set of clients per cluster"""
+
+    def test_start_creates_clients_per_cluster(self, pool):
+        pool.start()
+
+        handed_out = [pool.client("devnet") for _ in range(6)]
+
+        assert len({id(client) for client in handed_out}) == 2
+        assert {client.endpoint for client in handed_out} == {"http://devnet.test"}
+        assert pool.client("mainnet").endpoint == "http://mainnet.test"
+        assert pool.client("mainnet-beta").endpoint == "http://mainnet.test"
+        assert pool.client("testnet").endpoint == "http://devnet.test"
+
+    def test_clients_are_created_on_demand_without_start(self, pool):
+        first = pool.client("devnet")
+
+        assert pool.client("devnet") is not first
+        assert pool.client("devnet") is first
+
+    def test_close_closes_every_client(self, pool):
+        pool.start()
+        clients = [pool.client(cluster) for cluster in ("devnet", "devnet", "mainnet", "mainnet")]
+
+        asyncio.run(pool.close())
+
+        assert all(client.closed for client in clients)
+
+    def test_missing_solana_package_leaves_pool_unstarted(self):
+        from app.services.solana_rpc import SolanaRpcPool
+
+        def unavailable(endpoint):
+            raise ImportError("No module named 'solana'")
+
+        pool = SolanaRpcPool({"devnet": "http://devnet.test"}, client_factory=unavailable)
+        pool.start()
+
+        with pytest.raises(ImportError):
+            pool.client("devnet")
+
+
+class TestSolanaRpcStandIn:
+    """The local JSON-RPC stand-in answers like a cluster, over keep-alive HTTP"""
+
+    def test_standin_answers_json_rpc(self, solana_rpc_standin):
+        async def call(client, method, params=None):
+            response = await client.post(solana_rpc_standin.url, json={
+                "jsonrpc": "2.0", "id": 1, "method": method, "params": params or []
+            })
+            return response.json()["result"]
+
+        async def run():
+            async with httpx.AsyncClient() as client:
+                blockhash = await call(client, "getLatestBlockhash")
+                balance = await call(client, "getTokenAccountBalance", ["account"])
+                return blockhash, balance
+
+        blockhash, balance = asyncio.run(run())
+
+        assert blockhash["value"]["blockhash"] == solana_rpc_standin.BLOCKHASH
+        assert balance["value"]["amount"] == "5000000"
+        assert solana_rpc_standin.methods() == ["getLatestBlockhash", "getTokenAccountBalance"]
+        assert len(solana_rpc_standin.connections) == 1
+
+    def test_pooled_async_client_reuses_its_connection(self, solana_rpc_standin):
+        pytest.importorskip("solana.rpc.async_api")
+        from app.services.solana_rpc import SolanaRpcPool
+
+        pool = SolanaRpcPool({"devnet": solana_rpc_standin.url}, clients_per_cluster=1)
+        pool.start()
+
+        async def run():
+            try:
+                for _ in range(3):
+                    response = await pool.client("devnet").get_latest_blockhash()
+                    assert str(response.value.blockhash) == solana_rpc_standin.BLOCKHASH
+            finally:
+                await pool.close()
+
+        asyncio.run(run())
+
+        assert solana_rpc_standin.methods() == ["getLatestBlockhash"] * 3
+        assert len(solana_rpc_standin.connections) == 1
+
+
+class StandInRpcClient:
+    """
+    Minimal async JSON-RPC client exposing the AsyncClient reads used by the
+    pre-flight, so its round trips can be measured without the solana package.
+    """
+
+    FIELDS = {
+        "amount": "amount", "ui_amount_string": "uiAmountString", "lamports": "lamports",
+        "blockhash": "blockhash", "last_valid_block_height": "lastValidBlockHeight",
+    }
+
+    def __init__(self, url):
+        self.url = url
+        self.http = httpx.AsyncClient()
+
+    async def _call(self, method, *params):
+        from types import SimpleNamespace
+
+        response = await self.http.post(self.url, json={"jsonrpc": "2.0", "id": 1, "method": method, "params": list(params)})
+        body = response.json()
+        if "error" in body:
+            raise RuntimeError(body["error"]["message"])
+        value = body["result"]["value"]
+        if isinstance(value, dict):
+            value = SimpleNamespace(**{key: value[camel] for key, camel in self.FIELDS.items() if camel in value})
+        return SimpleNamespace(value=value)
+
+    async def get_token_account_balance(self, account):
+        return await self._call("getTokenAccountBalance", str(account))
+
+    async def get_account_info(self, account):
+        return await self._call("getAccountInfo", str(account))
+
+    async def get_latest_blockhash(self):
+        return await self._call("getLatestBlockhash")
+
+    async def close(self):
+        await self.http.aclose()
+
+
+async def sequential_preflight(connection, payer_token_account, recipient_token_account):
+    """The pre-flight as it used to run: four reads, one after another"""
+    await connection.get_token_account_balance(payer_token_account)
+    await connection.get_token_account_balance(payer_token_account)
+    await connection.get_account_info(recipient_token_account)
+    return await connection.get_latest_blockhash()
+
+
+class TestPreflightReads:
+    """execute_sienna_payment's pre-flight reads run once each, concurrently"""
+
+    LATENCY = 0.2
+
+    def measure(self, make_client, preflight):
+        async def run():
+            connection = make_client()
+            try:
+                # Warm the connection so only request latency is measured
+                await connection.get_latest_blockhash()
+                started = time.monotonic()
+                result = await preflight(connection, "PayerTokenAccount", "RecipientTokenAccount")
+                return result, time.monotonic() - started
+            finally:
+                await connection.close()
+
+        return asyncio.run(run())
+
+    def test_preflight_costs_one_round_trip(self, solana_rpc_standin):
+        from app.routes.sienna_payment import preflight_reads
+
+        solana_rpc_standin.latency = self.LATENCY
+        make_client = lambda: StandInRpcClient(solana_rpc_standin.url)
+
+        _, sequential = self.measure(make_client, sequential_preflight)
+        solana_rpc_standin.calls.clear()
+        (balance, recipient_exists, (blockhash, last_valid)), concurrent = self.measure(make_client, preflight_reads)
+
+        print(f"\npre-flight at {self.LATENCY * 1000:.0f}ms per RPC: sequential {sequential * 1000:.0f}ms, "
+              f"concurrent {concurrent * 1000:.0f}ms")
+        assert sequential >= 4 * self.LATENCY
+        assert concurrent < 2 * self.LATENCY
+        assert sorted(solana_rpc_standin.methods()[1:]) == [
+            "getAccountInfo", "getLatestBlockhash", "getTokenAccountBalance"
+        ]
+        assert (balance.amount, recipient_exists, blockhash, last_valid) == (
+            "5000000", True, solana_rpc_standin.BLOCKHASH, 100
+        )
+
+    def test_unreadable_accounts_do_not_fail_preflight(self, solana_rpc_standin):
+        from app.routes.sienna_payment import preflight_reads
+
+        solana_rpc_standin.errors = {"getTokenAccountBalance", "getAccountInfo"}
+
+        (balance, recipient_exists, (blockhash, _)), _ = self.measure(
+            lambda: StandInRpcClient(solana_rpc_standin.url), preflight_reads
+        )
+
+        assert (balance, recipient_exists, blockhash) == (None, False, solana_rpc_standin.BLOCKHASH)
+
+    def test_preflight_with_async_client(self, solana_rpc_standin):
+        pytest.importorskip("solana.rpc.async_api")
+        from solders.pubkey import Pubkey
+        from app.routes.sienna_payment import preflight_reads
+        from app.services.solana_rpc import create_async_client
+
+        solana_rpc_standin.latency = self.LATENCY
+
+        async def run():
+            connection = create_async_client(solana_rpc_standin.url)
+            try:
+                await connection.get_latest_blockhash()
+                started = time.monotonic()
+                await preflight_reads(connection, Pubkey.default(), Pubkey.default())
+                return time.monotonic() - started
+            finally:
+                await connection.close()
+
+        assert asyncio.run(run()) < 2 * self.LATENCY
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def prefetcher(solana_rpc_standin):
+    from app.services.solana_rpc import BlockhashPrefetcher, SolanaRpcPool
+
+    pool = SolanaRpcPool({"devnet": solana_rpc_standin.url}, clients_per_cluster=1, client_factory=StandInRpcClient)
+    return BlockhashPrefetcher(pool, refresh_interval=0.05, max_age=60, clock=Clock())
+
+
+class TestBlockhashPrefetcher:
+    """BlockhashPrefetcher serves a recent blockhash from memory"""
+
+    def test_blockhash_is_fetched_once_and_served_from_memory(self, solana_rpc_standin, prefetcher):
+        async def run():
+            first = await asyncio.gather(*(prefetcher.latest("devnet") for _ in range(10)))
+            again = await prefetcher.latest("devnet")
+            await prefetcher.pool.close()
+            return first, again
+
+        first, again = asyncio.run(run())
+
+        assert set(first) == {again} == {(solana_rpc_standin.BLOCKHASH, 100)}
+        assert solana_rpc_standin.methods() == ["getLatestBlockhash"]
+
+    def test_old_or_invalidated_blockhash_is_refreshed_on_demand(self, solana_rpc_standin, prefetcher):
+        async def run():
+            await prefetcher.latest("devnet")
+            prefetcher.clock.now += 61
+            await prefetcher.latest("devnet")
+            prefetcher.invalidate("devnet")
+            await prefetcher.latest("devnet")
+            await prefetcher.pool.close()
+
+        asyncio.run(run())
+
+        assert solana_rpc_standin.methods() == ["getLatestBlockhash"] * 3
+
+    def test_background_task_keeps_blockhash_warm(self, solana_rpc_standin, prefetcher):
+        async def run():
+            prefetcher.start()
+            await asyncio.sleep(0.2)
+            solana_rpc_standin.latency = 1
+            started = time.monotonic()
+            await prefetcher.latest("devnet")
+            served_in = time.monotonic() - started
+            await prefetcher.stop()
+            await prefetcher.pool.close()
+            return served_in
+
+        served_in = asyncio.run(run())
+
+        assert served_in < 0.05
+        assert solana_rpc_standin.methods().count("getLatestBlockhash") >= 2
+
+    def test_refresh_failure_is_logged_and_retried(self, solana_rpc_standin, prefetcher):
+        solana_rpc_standin.errors = {"getLatestBlockhash"}
+
+        async def run():
+            prefetcher.start()
+            await asyncio.sleep(0.15)
+            running = not prefetcher._task.done()
+            await prefetcher.stop()
+            await prefetcher.pool.close()
+            return running
+
+        assert asyncio.run(run())
+        assert solana_rpc_standin.methods().count("getLatestBlockhash") >= 2
+
+    def test_preflight_with_warm_blockhash_skips_its_rpc(self, solana_rpc_standin, prefetcher):
+        from app.routes.sienna_payment import preflight_reads
+
+        async def run():
+            await prefetcher.latest("devnet")
+            solana_rpc_standin.calls.clear()
+            connection = prefetcher.pool.client("devnet")
+            result = await preflight_reads(
+                connection, "PayerTokenAccount", "RecipientTokenAccount",
+                recent_blockhash=prefetcher.latest("devnet")
+            )
+            await prefetcher.pool.close()
+            return result
+
+        _, _, latest = asyncio.run(run())
+
+        assert latest == (solana_rpc_standin.BLOCKHASH, 100)
+        assert sorted(solana_rpc_standin.methods()) == ["getAccountInfo", "getTokenAccountBalance"]
@@ -0,0 +1,195 @@
+# © 2025 Project Sienna - Test Suite for the shared TTL store
+#
+# Run with: pytest tests/test_ttl_store.py -v
+
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path, clock):
+    """Build stores of either backend; sqlite stores built by one test share a database file"""
+    from app.services.ttl_store import MemoryTTLStore, SQLiteTTLStore
+
+    stores = []
+
+    def make(namespace="test", max_entries=100):
+        if request.param == "memory":
+            store = MemoryTTLStore(max_entries=max_entries, clock=clock)
+        else:
+            store = SQLiteTTLStore(str(tmp_path / "ttl.db"), namespace, max_entries=max_entries, clock=clock)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        if hasattr(store, "close"):
+            store.close()
+
+
+class TestTTLStore:
+    """Behaviour shared by every TTL store backend"""
+
+    def test_set_get_pop(self, make_store):
+        store = make_store()
+        store.set("a", {"total": 12.5}, ttl=60)
+
+        assert store.get("a") == {"total": 12.5}
+        assert store.pop("a") == {"total": 12.5}
+        assert store.pop("a") is None
+        assert store.get("a") is None
+
+    def test_entries_expire(self, make_store, clock):
+        store = make_store()
+        store.set("short", 1, ttl=10)
+        store.set("long", 2, ttl=100)
+
+        clock.now += 50
+        assert store.get("short") is None
+        assert store.pop("short") is None
+        assert store.get("long") == 2
+
+        assert store.purge_expired() <= 1
+        assert len(store) == 1
+
+    def test_overwrite_extends_ttl(self, make_store, clock):
+        store = make_store()
+        store.set("a", 1, ttl=10)
+        store.set("a", 2, ttl=100)
+
+        clock.now += 50
+        store.purge_expired()
+        assert store.get("a") == 2
+
+    def test_size_is_bounded_by_evicting_soonest_expiry(self, make_store):
+        store = make_store(max_entries=3)
+        for i, ttl in enumerate([50, 10, 40, 30]):
+            store.set(f"k{i}", i, ttl=ttl)
+
+        assert len(store) == 3
+        assert store.get("k1") is None
+        assert [store.get(k) for k in ("k0", "k2", "k3")] == [0, 2, 3]
+
+    def test_namespaces_are_isolated(self, make_store):
+        quotes, carts = make_store("quotes"), make_store("carts")
+        quotes.set("id", "quote", ttl=60)
+
+        assert carts.get("id") is None
+        assert quotes.get("id") == "quote"
+
+
+class TestSharedSQLiteStore:
+    """The SQLite backend is shared between independent workers"""
+
+    def test_second_worker_sees_entries(self, tmp_path):
+        from app.services.ttl_store import SQLiteTTLStore
+
+        path = str(tmp_path / "shared.db")
+        worker_a = SQLiteTTLStore(path, "finalized_carts")
+        worker_b = SQLiteTTLStore(path, "finalized_carts")
+
+        worker_a.set("payment-session", {"total_amount": 42.0}, ttl=60)
+
+        assert worker_b.pop("payment-session") == {"total_amount": 42.0}
+        assert worker_a.pop("payment-session") is None
+
+    def test_bound_is_checked_without_counting_rows(self, tmp_path):
+        from app.services.ttl_store import SQLiteTTLStore
+
+        path = str(tmp_path / "shared.db")
+        worker_a = SQLiteTTLStore(path, "quotes", max_entries=3)
+        worker_b = SQLiteTTLStore(path, "quotes", max_entries=3)
+        statements = []
+        worker_a._conn.set_trace_callback(statements.append)
+
+        worker_b.set("b", 1, ttl=10)
+        worker_b.set("b", 2, ttl=10)  # an overwrite is not a new entry
+        for i, ttl in enumerate([50, 40, 30]):
+            worker_a.set(f"a{i}", i, ttl=ttl)
+        worker_a.pop("a2")
+        worker_a.set("a3", 3, ttl=60)
+
+        assert not any("COUNT(" in statement for statement in statements)
+        assert len(worker_a) == 3
+        assert worker_a.get("b") is None
+        assert [worker_a.get(key) for key in ("a0", "a1", "a3")] == [0, 1, 3]
+
+    def test_count_is_seeded_from_existing_entries(self, tmp_path):
+        import sqlite3
+        import time
+        from app.services.ttl_store import SQLiteTTLStore
+
+        path = str(tmp_path / "legacy.db")
+        legacy = sqlite3.connect(path)
+        legacy.execute(
+            "CREATE TABLE ttl_entries (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        legacy.executemany(
+            "INSERT INTO ttl_entries VALUES ('quotes', ?, '1', ?)", [(f"k{i}", time.time() + 30 + i) for i in range(3)]
+        )
+        legacy.commit()
+        legacy.close()
+
+        store = SQLiteTTLStore(path, "quotes", max_entries=3)
+        store.set("new", 1, ttl=60)
+
+        assert len(store) == 3
+        assert store.get("k0") is None
+
+
+class TestTTLStoreInterface:
+    def test_base_class_is_abstract(self):
+        from app.services.ttl_store import TTLStore
+
+        with pytest.raises(TypeError):
+            TTLStore()
+
+
+class TestCheckoutSessionsUseStore:
+    """finalize_cart/fulfill_cart go through the configured TTL store"""
+
+    def test_fulfill_reads_finalized_cart_from_store(self, merchant_client, make_product, make_cart, tmp_path, monkeypatch):
+        from app.routes import cart
+        from app.services.ttl_store import SQLiteTTLStore
+
+        # Two handles on one file stand in for two workers
+        path = str(tmp_path / "shared.db")
+        monkeypatch.setattr(cart, "FINALIZED_CARTS", SQLiteTTLStore(path, "finalized_carts"))
+
+        make_cart({make_product(stock=5): 1}, session_id="ttl-session")
+
+        finalized = merchant_client.post("/api/cart/ttl-session/finalize", json={
+            "customer_info": {"name": "Test Customer", "email": "customer@example.com"},
+            "shipping_address": {
+                "street": "1 Market St", "city": "San Francisco", "state": "CA",
+                "postal_code": "94105", "country": "US",
+            },
+        })
+        payment_session_id = finalized.json()["payment_session_id"]
+
+        monkeypatch.setattr(cart, "FINALIZED_CARTS", SQLiteTTLStore(path, "finalized_carts"))
+        fulfill_request = {
+            "payment_session_id": payment_session_id,
+            "card_number": "4111111111111111",
+            "expiry_date": "12/30",
+            "cvv": "123",
+            "cardholder_name": "Test Customer",
+        }
+        fulfilled = merchant_client.post("/api/cart/ttl-session/fulfill", json=fulfill_request)
+        assert fulfilled.status_code == 200, fulfilled.text
+
+        repeated = merchant_client.post("/api/cart/ttl-session/fulfill", json=fulfill_request)
+        assert repeated.status_code == 404